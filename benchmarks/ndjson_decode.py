@@ -0,0 +1,89 @@
+"""Micro-benchmark of decoding an Ollama /api/generate stream.
+
+Compares the old `iter_lines()` + `json.loads` loop with enhance_this.ndjson on a
+synthetic stream of 100k frames held in memory, so only the Python side is measured.
+
+    python benchmarks/ndjson_decode.py [frames]
+"""
+import json
+import sys
+import time
+
+from requests.models import Response
+
+from enhance_this import ndjson
+
+WORDS = ["the", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", ".\n", " \"quoted\""]
+
+
+def build_stream(frames: int) -> bytes:
+    lines = []
+    for i in range(frames):
+        frame = {"model": "llama3.1:8b", "created_at": "2024-06-01T12:00:00.000000Z",
+                 "response": WORDS[i % len(WORDS)], "done": False}
+        lines.append(json.dumps(frame, separators=(",", ":")))
+    lines.append(json.dumps({"model": "llama3.1:8b", "response": "", "done": True,
+                             "context": list(range(2000)), "eval_count": frames}, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _Raw:
+    """Stands in for urllib3's response so requests' own iter_content/iter_lines run unchanged."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.position = 0
+
+    def stream(self, amt, decode_content=True):
+        while self.position < len(self.body):
+            block = self.body[self.position:self.position + amt]
+            self.position += len(block)
+            yield block
+
+
+def make_response(body: bytes) -> Response:
+    response = Response()
+    response.raw = _Raw(body)
+    response.status_code = 200
+    return response
+
+
+def baseline(body: bytes) -> str:
+    parts = []
+    for line in make_response(body).iter_lines():
+        if line:
+            data = json.loads(line)
+            parts.append(data.get("response", ""))
+    return "".join(parts)
+
+
+def tuned(body: bytes) -> str:
+    parts = []
+    for line in ndjson.iter_frames(make_response(body)):
+        text, _ = ndjson.decode_frame(line)
+        parts.append(text)
+    return "".join(parts)
+
+
+def measure(name: str, func, body: bytes, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<32} {best * 1000:8.1f} ms")
+    return best
+
+
+def main():
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    body = build_stream(frames)
+    assert baseline(body) == tuned(body)
+    print(f"{frames} frames, {len(body) / 1e6:.1f} MB, orjson: {'yes' if ndjson.orjson else 'no'}")
+    old = measure("iter_lines + json.loads", baseline, body)
+    new = measure("ndjson.iter_frames + decode_frame", tuned, body)
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+from .api import EnhancementResult, Enhancer
+from .errors import EnhanceError
+
+__all__ = ["Enhancer", "EnhancementResult", "EnhanceError"]
@@ -0,0 +1,368 @@
+"""Python API for enhancing prompts from other programs.
+
+Unlike the CLI, nothing here prints, copies to the clipboard or writes history
+unless asked to, and failures raise the typed errors in `enhance_this.errors`::
+
+    from enhance_this.api import Enhancer
+
+    enhancer = Enhancer(model="llama3.1:8b")
+    result = enhancer.enhance("write unit tests for my parser", style="technical")
+    print(result.enhanced_prompt, result.timings["total"])
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from rich.text import Text
+
+from .config import DEFAULT_CONFIG, load_config
+from .enhancer import PromptEnhancer, session_context_size
+from .errors import EmptyResponseError, ModelNotFoundError, OllamaRequestError, TemplateError
+from .guards import StreamGuard
+from .ollama_client import CancelToken, GenerationCancelled, OllamaClient
+from .resilience import Deadline
+from .scheduler import PRIORITIES, Scheduler
+
+# Enhancements enhance_many runs at once when no scheduler limits them
+DEFAULT_BATCH_CONCURRENCY = 4
+
+_THINKING = re.compile(r"<think>.*?(</think>|$)", re.DOTALL)
+
+
+def strip_thinking(text: str) -> str:
+    """Removes the <think>...</think> reasoning block some models emit before their answer."""
+    return _THINKING.sub("", text).strip()
+
+
+class EnhancementRequest:
+    """Everything sent to Ollama for one enhancement, as built by `Enhancer.prepare`."""
+
+    def __init__(self, prompt: str, style: str, model: str, system: str, request_prompt: str,
+                 temperature: float, num_predict: int, num_ctx: Optional[int], stop: Optional[List[str]],
+                 priority: str = "interactive", deadline: Optional[float] = None,
+                 context: Optional[List[int]] = None):
+        self.prompt = prompt
+        self.style = style
+        self.model = model
+        self.system = system
+        self.request_prompt = request_prompt
+        self.temperature = temperature
+        self.num_predict = num_predict
+        self.num_ctx = num_ctx
+        self.stop = stop
+        self.priority = priority
+        # Seconds the whole enhancement may take once sent, including retries; None for no limit
+        self.deadline = deadline
+        # Ollama context of an earlier result this request refines, see `Enhancer.prepare`
+        self.context = context
+        # Extra Ollama runtime options, over the model profile (num_thread, num_batch, ...)
+        self.options: Optional[Dict[str, Any]] = None
+
+
+class EnhancementResult:
+    """The outcome of one enhancement.
+
+    `timings` holds seconds: "ttft" (time to first token), "queue" (waiting for the
+    scheduler, part of ttft), "load" (model load in Ollama) and "total". `metrics` holds Ollama's token counts and, if a guard ended
+    the output early, "stopped_by"; "retries" if the generation had to be sent again and "hedged" if a hedged
+    request answered first. `context` is Ollama's context after the generation, which
+    `Enhancer.prepare` takes to refine this result.
+    """
+
+    def __init__(self, original_prompt: str, enhanced_prompt: str, style: str, model: str,
+                 timings: Dict[str, float], metrics: Dict[str, Any]):
+        self.original_prompt = original_prompt
+        self.enhanced_prompt = enhanced_prompt
+        self.style = style
+        self.model = model
+        self.timings = timings
+        self.metrics = metrics
+        self.context: Optional[List[int]] = None
+        self.copied = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "original_prompt": self.original_prompt,
+            "enhanced_prompt": self.enhanced_prompt,
+            "style": self.style,
+            "model": self.model,
+            "timings": dict(self.timings),
+            "metrics": dict(self.metrics),
+        }
+
+    def __repr__(self) -> str:
+        return (f"EnhancementResult(style={self.style!r}, model={self.model!r}, "
+                f"total={self.timings.get('total', 0.0):.2f}s, chars={len(self.enhanced_prompt)})")
+
+
+class EnhancementStream:
+    """Yields the text of an enhancement as it is generated.
+
+    Once the iteration finishes, `result` holds the `EnhancementResult`. Closing the
+    stream (or calling `cancel()` from another thread) stops the generation. A stream
+    sends one request: iterating it again continues where the last iteration stopped.
+    """
+
+    def __init__(self, enhancer: "Enhancer", request: EnhancementRequest, client: OllamaClient,
+                 cancel: Optional[CancelToken] = None):
+        self.request = request
+        self.result: Optional[EnhancementResult] = None
+        self._enhancer = enhancer
+        self._client = client
+        self._cancel = cancel or CancelToken()
+        self._chunks: Optional[Iterator[str]] = None
+        self._iterator: Optional[Iterator[str]] = None
+
+    def __iter__(self) -> Iterator[str]:
+        if self._iterator is None:
+            self._iterator = self._run()
+        return self._iterator
+
+    def _run(self) -> Iterator[str]:
+        request = self.request
+        start = time.perf_counter()
+        parts = []
+        self._chunks = self._client.generate_stream(
+            request.model, request.request_prompt, request.temperature, request.num_predict,
+            context=request.context, system=request.system, cancel=self._cancel, stop=request.stop,
+            guard=StreamGuard.from_config(self._enhancer.config), num_ctx=request.num_ctx,
+            options=request.options, priority=request.priority, deadline=Deadline(request.deadline))
+        try:
+            for chunk in self._chunks:
+                parts.append(chunk)
+                yield chunk
+        except OllamaRequestError as e:
+            if e.response is not None and e.response.status_code == 404:
+                raise ModelNotFoundError(f"Model '{request.model}' is not installed. "
+                                         f"Pull it with: ollama pull {request.model}") from e
+            raise
+        finally:
+            # Also runs when the caller closes this generator, which ends the request
+            self._chunks.close()
+        text = strip_thinking("".join(parts))
+        if not text:
+            raise EmptyResponseError(f"Model '{request.model}' returned no text.")
+        metrics = dict(self._client.last_metrics)
+        timings = {
+            "ttft": metrics.pop("ttft", 0.0),
+            "queue": metrics.pop("queue_wait", 0.0),
+            "load": metrics.pop("load_time", 0.0),
+            "total": time.perf_counter() - start,
+        }
+        metrics.pop("total_time", None)
+        result = self._enhancer._finish(request, text, timings, metrics)
+        result.context = self._client.last_context
+        self.result = result
+
+    def text(self) -> EnhancementResult:
+        """Consumes the rest of the stream and returns the result."""
+        if self.result is None:
+            for _ in self:
+                pass
+        if self.result is None:
+            raise GenerationCancelled("The stream was closed before it finished.")
+        return self.result
+
+    def cancel(self):
+        self._cancel.cancel()
+
+    def close(self):
+        if self._iterator is not None:
+            self._iterator.close()
+        if self._chunks is not None:
+            self._chunks.close()
+
+
+class Enhancer:
+    """Enhances prompts with a local Ollama model.
+
+    Settings come from `config` (the same keys as ~/.enhance-this/config.yaml, see
+    `Enhancer.from_config`), or the built-in defaults; keyword arguments override
+    them. History and clipboard are only written with `save_history`/`copy`.
+    An Enhancer can be shared between threads; each thread talks to Ollama through
+    its own OllamaClient.
+    """
+
+    def __init__(self, model: Optional[str] = None, style: Optional[str] = None,
+                 temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                 host: Optional[str] = None, timeout: Optional[int] = None,
+                 config: Optional[Dict[str, Any]] = None, save_history: bool = False, copy: bool = False,
+                 strict_templates: bool = False, client: Optional[OllamaClient] = None):
+        self.config = {**deepcopy(DEFAULT_CONFIG), **(config or {})}
+        if host:
+            self.config['ollama_host'] = host
+        if timeout:
+            self.config['timeout'] = timeout
+        self.model = model
+        self.style = style or self.config.get('default_style', 'detailed')
+        self.temperature = temperature if temperature is not None else self.config.get('default_temperature', 0.7)
+        self.max_tokens = max_tokens
+        self.save_history = save_history
+        self.copy = copy
+        self.template_errors: List[str] = []
+        self.templates = PromptEnhancer(self.config.get('enhancement_templates'),
+                                        on_error=lambda message: self.template_errors.append(Text.from_markup(message).plain))
+        if strict_templates and self.template_errors:
+            raise TemplateError("; ".join(self.template_errors))
+        # Shared by every Enhancer with the same scheduler_* settings in this process
+        self.scheduler = Scheduler.from_config(self.config)
+        self._local = threading.local()
+        # A given client serves the creating thread, other threads make their own
+        self._local.client = client
+        self._models: Optional[List[str]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config_path: Optional[str] = None, **kwargs) -> "Enhancer":
+        """Creates an Enhancer from the user's config file (and ENHANCE_* variables)."""
+        return cls(config=load_config(config_path), **kwargs)
+
+    def _client(self) -> OllamaClient:
+        # OllamaClient keeps per-call state (last_metrics), so each thread gets its own
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = OllamaClient.from_config(self.config, quiet=True, scheduler=self.scheduler)
+            self._local.client = client
+        return client
+
+    def is_available(self) -> bool:
+        """Returns whether Ollama answers."""
+        return self._client().is_running()
+
+    @property
+    def styles(self) -> List[str]:
+        return list(self.templates.templates)
+
+    def models(self, refresh: bool = False) -> List[str]:
+        """Returns the installed models. Raises OllamaUnavailableError if Ollama is down."""
+        with self._lock:
+            if self._models is None or refresh:
+                self._models = self._client().fetch_models()
+            return list(self._models)
+
+    def resolve_model(self, model: Optional[str] = None) -> str:
+        """Returns `model`, the configured model, or the first installed preferred model."""
+        model = model or self.model
+        if model:
+            return model
+        available = self.models()
+        for preferred in self.config.get('preferred_models', []):
+            if preferred in available:
+                return preferred
+        if available:
+            return available[0]
+        raise ModelNotFoundError("No models are installed. Pull one with: ollama pull llama3.1:8b")
+
+    def prepare(self, prompt: str, style: Optional[str] = None, model: Optional[str] = None,
+                temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                priority: str = "interactive", deadline: Optional[float] = None,
+                context: Optional[List[int]] = None) -> EnhancementRequest:
+        """Builds the request for a prompt without sending it. Raises UnknownStyleError.
+
+        With the `context` of an earlier result, the prompt is sent as a refinement
+        of that result in the same Ollama context, so the template is not evaluated again.
+
+        `priority` ("interactive", "default" or "bulk") decides which requests reach
+        Ollama first when the scheduler has more than it may run at once. `deadline`
+        (seconds) bounds the whole enhancement, retries included, as does the
+        `deadline` setting if it is shorter; past it, DeadlineExceededError is raised.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of: {', '.join(PRIORITIES)}.")
+        style = style or self.style
+        if context:
+            system, request_prompt = "", self.templates.refine(prompt)
+        else:
+            system, request_prompt = self.templates.build(prompt, style, split=self.config.get('use_system_prompt', True))
+        # An explicit limit wins, otherwise the style's own budget capped by max_tokens
+        num_predict = max_tokens or self.max_tokens or self.templates.num_predict(style, self.config.get('max_tokens', 2000))
+        deadline = min(filter(None, (deadline, self.config.get('deadline'))), default=None)
+        model = self.resolve_model(model)
+        # Sized for the largest style, so switching styles does not make Ollama reload the model
+        reserve = self.templates.largest_request(prompt, self.max_tokens or self.config.get('max_tokens', 2000))
+        num_ctx = session_context_size(self.config, model, system, request_prompt, num_predict, context, reserve)
+        return EnhancementRequest(
+            prompt, style, model, system, request_prompt,
+            temperature if temperature is not None else self.temperature,
+            num_predict, num_ctx,
+            self.templates.stop_sequences(style), priority, deadline, context,
+        )
+
+    def preload(self, model: Optional[str] = None) -> str:
+        """Loads a model into Ollama with the context size enhancements use, so none reloads it.
+
+        Returns the model.
+        """
+        request = self.prepare("", model=model)
+        self._client().preload_model(request.model, num_ctx=request.num_ctx)
+        return request.model
+
+    def stream(self, request: EnhancementRequest, cancel: Optional[CancelToken] = None) -> EnhancementStream:
+        """Sends a prepared request, see `enhance_stream`. Cancelling `cancel` stops it like `cancel()`."""
+        return EnhancementStream(self, request, self._client(), cancel)
+
+    def enhance_stream(self, prompt: str, **kwargs) -> EnhancementStream:
+        """Starts an enhancement whose text can be iterated as it is generated.
+
+        Accepts the keyword arguments of `prepare`. Iterating raises the typed errors
+        of `enhance`.
+        """
+        return self.stream(self.prepare(prompt, **kwargs))
+
+    def enhance(self, prompt: str, **kwargs) -> EnhancementResult:
+        """Enhances one prompt and returns the result.
+
+        Accepts the keyword arguments of `prepare`. Raises OllamaUnavailableError,
+        OllamaTimeoutError, ModelNotFoundError, UnknownStyleError, EmptyResponseError
+        or QueueFullError.
+        """
+        return self.enhance_stream(prompt, **kwargs).text()
+
+    def enhance_many(self, prompts: Iterable[str], concurrency: Optional[int] = None, return_exceptions: bool = False,
+                     **kwargs) -> List[Union[EnhancementResult, Exception]]:
+        """Enhances several prompts, up to `concurrency` at a time, in input order.
+
+        By default as many run as the scheduler may allow, its adaptive maximum if it
+        adapts, so the scheduler alone limits them.
+
+        With `return_exceptions` a failed prompt yields its exception in the list
+        instead of raising the first one. The prompts run at "bulk" priority unless
+        `priority` is given, so they do not hold up interactive enhancements.
+        """
+        prompts = list(prompts)
+        kwargs.setdefault("priority", "bulk")
+        kwargs["model"] = self.resolve_model(kwargs.get("model"))
+
+        def run(prompt: str) -> Union[EnhancementResult, Exception]:
+            try:
+                return self.enhance(prompt, **kwargs)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        if concurrency is None:
+            if self.scheduler is None:
+                concurrency = DEFAULT_BATCH_CONCURRENCY
+            elif self.scheduler.limiter is not None:
+                concurrency = self.scheduler.limiter.maximum
+            else:
+                concurrency = self.scheduler.max_concurrent
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(prompts) or 1))) as pool:
+            return list(pool.map(run, prompts))
+
+    def _finish(self, request: EnhancementRequest, text: str, timings: Dict[str, float],
+                metrics: Dict[str, Any]) -> EnhancementResult:
+        result = EnhancementResult(request.prompt, text, request.style, request.model, timings, metrics)
+        if self.save_history:
+            from .history import RetentionPolicy, save_enhancement
+            save_enhancement(request.prompt, text, request.style, request.model,
+                             policy=RetentionPolicy.from_config(self.config))
+        if self.copy:
+            from .clipboard import copy_to_clipboard
+            result.copied = copy_to_clipboard(text, backend=self.config.get('clipboard_backend', 'auto'),
+                                              timeout=self.config.get('clipboard_timeout', 2.0), report=False)
+        return result
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+from .locking import append_line
+
+REFS_FILE_NAME = "refs.log"
+
+
+class BlobStore:
+    """Content-addressed storage for history bodies, so repeated text is stored once.
+
+    Each body is zlib-compressed in `<directory>/<first two hash chars>/<sha256>`.
+    Reference counts live in an append-only journal of "<delta> <hash> <size>" lines,
+    which keeps adding a reference cheap. `prune` replays the journal, deletes
+    unreferenced blobs and compacts the journal. Writers must hold the history lock.
+    """
+
+    # Recently read bodies, since repeated outputs are the common case this store exists for
+    CACHE_SIZE = 256
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.refs_path = directory / REFS_FILE_NAME
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def put(self, text: str) -> str:
+        """Stores `text` if it is new, adds a reference to it and returns its key."""
+        key = self.key(text)
+        path = self._path(key)
+        data = zlib.compress(text.encode("utf-8"))
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        self._journal([(1, key, len(data))])
+        return key
+
+    def get(self, key: str) -> str:
+        text = self._cache.get(key)
+        if text is None:
+            text = zlib.decompress(self._path(key).read_bytes()).decode("utf-8")
+            self._cache[key] = text
+            if len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return text
+
+    def release(self, keys: Iterable[str]):
+        """Drops one reference to each key. Blobs are only deleted by `prune`."""
+        self._journal([(-1, key, 0) for key in keys])
+
+    def _journal(self, changes):
+        if not changes:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        append_line(self.refs_path, "".join(f"{delta:+d} {key} {size}\n" for delta, key, size in changes).encode("utf-8"))
+
+    def usage(self) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """Replays the journal into (reference count, stored size) per key."""
+        counts: Dict[str, int] = {}
+        sizes: Dict[str, int] = {}
+        try:
+            with open(self.refs_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 3:
+                        continue  # Torn write
+                    try:
+                        delta, size = int(parts[0]), int(parts[2])
+                    except ValueError:
+                        continue
+                    counts[parts[1]] = counts.get(parts[1], 0) + delta
+                    if size:
+                        sizes[parts[1]] = size
+        except FileNotFoundError:
+            pass
+        return counts, sizes
+
+    def total_bytes(self) -> int:
+        counts, sizes = self.usage()
+        return sum(sizes.get(key, 0) for key, count in counts.items() if count > 0)
+
+    def prune(self) -> int:
+        """Deletes blobs without references and compacts the journal. Returns the number deleted."""
+        counts, sizes = self.usage()
+        removed = 0
+        live = []
+        for key, count in counts.items():
+            if count > 0:
+                live.append((count, key, sizes.get(key, 0)))
+                continue
+            try:
+                self._path(key).unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if counts:
+            tmp_path = self.refs_path.with_name(f"{REFS_FILE_NAME}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(f"{count:+d} {key} {size}\n" for count, key, size in live))
+            os.replace(tmp_path, self.refs_path)
+        return removed
@@ -10,15 +10,24 @@ from rich.spinner import Spinner
 from rich.table import Table
 from rich.text import Text
 import sys
-import difflib
 import time
 import random
 
 from .config import load_config, create_default_config_if_not_exists
 from .ollama_client import OllamaClient
-from .enhancer import PromptEnhancer
-from .clipboard import copy_to_clipboard
-from .history import save_enhancement, load_history
+from .clipboard import copy_to_clipboard, wait_for_clipboard
+from .history import RetentionPolicy, save_enhancement, recent_history, history_page, load_entry
+from . import stats
+from .profiling import StageTimer
+from .diffing import (DEFAULT_MAX_TOKENS as DEFAULT_DIFF_MAX_TOKENS, DEFAULT_TIMEOUT as DEFAULT_DIFF_TIMEOUT,
+                      compute_diff, render_inline, render_side_by_side)
+from .speculative import SpeculativeGenerator, predict_next_styles
+from .api import Enhancer
+from .errors import ConfigError, EmptyResponseError, OllamaStalledError
+from .resilience import PHASE_SETTINGS
+from .semantic import DEFAULT_EMBEDDING_MODEL, DEFAULT_THRESHOLD as DEFAULT_SEMANTIC_THRESHOLD, SemanticCache
+
+HISTORY_PAGE_SIZE = 20
 
 @click.command()
 @click.argument('prompt', required=False)
@@ -28,20 +37,34 @@ from .history import save_enhancement, load_history
 @click.option('-c', '--config', 'config_path', type=click.Path(), help='Configuration file path')
 @click.option('-v', '--verbose', is_flag=True, help='Enable verbose output')
 @click.option('-n', '--no-copy', is_flag=True, help="Don't copy to clipboard")
-@click.option('-o', '--output', 'output_file', type=click.File('w'), help='Save enhanced prompt to file')
+@click.option('-o', '--output', 'output_file', type=click.Path(dir_okay=False, allow_dash=True),
+              help='Save enhanced prompt (or a history export) to file')
 @click.option('-s', '--style', type=click.Choice(['detailed', 'concise', 'creative', 'technical', 'json', 'bullets', 'summary', 'formal', 'casual']), help='Enhancement style')
 @click.option('--diff', is_flag=True, help='Show a diff between the original and enhanced prompt')
+@click.option('--diff-mode', type=click.Choice(['word', 'line']), help='Compare words or whole lines in the diff view.')
+@click.option('--side-by-side', is_flag=True, help='Show the diff view as two columns.')
 @click.option('--list-models', is_flag=True, help='List available Ollama models')
 @click.option('--download-model', 'download_model_name', help='Download specific model from Ollama')
 @click.option('--auto-setup', is_flag=True, help='Automatically setup Ollama with optimal model')
-@click.option('--history', 'show_history', is_flag=True, help='Show enhancement history.')
+@click.option('--history', 'show_history', is_flag=True, help='Show enhancement history (filter with -s and -m).')
 @click.option('--interactive', 'is_interactive', is_flag=True, help='Start an interactive enhancement session.')
+@click.option('--speculate', is_flag=True, help='In interactive mode, pre-generate likely next styles in the background.')
 @click.option('--preload-model', is_flag=True, help='Preload a model to keep it in memory for faster responses.')
 @click.option('--config-wizard', is_flag=True, help='Run the configuration wizard for first-time setup.')
 @click.option('--template-editor', is_flag=True, help='Launch the visual template editor.')
+@click.option('--stats', 'show_stats', is_flag=True, help='Show latency statistics of past enhancements.')
+@click.option('--profile', is_flag=True, help='Show a timing breakdown of each step of the enhancement.')
+@click.option('--tune', is_flag=True, help='Benchmark runtime options for the model and save the fastest to its profile.')
+@click.option('--history-export', type=click.Choice(['jsonl', 'csv', 'parquet']), help='Export history to -o (or stdout). Filter with -s, -m, --since and --until.')
+@click.option('--history-import', type=click.Path(exists=True, dir_okay=False), help='Import history from a .jsonl, .csv or .parquet export.')
+@click.option('--since', type=click.DateTime(), help='Only export history from this date or time (UTC) on.')
+@click.option('--until', type=click.DateTime(), help='Only export history up to this date or time (UTC).')
+@click.option('--semantic-index', is_flag=True, help='Embed your history for the semantic cache (see semantic_cache in the config).')
+@click.option('--http-serve', is_flag=True, help='Serve enhancements over HTTP (see server_* in the config).')
+@click.option('--port', type=click.IntRange(0, 65535), help='Port for --http-serve (default: server_port).')
 @click.version_option()
 @click.help_option('-h', '--help')
-def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, no_copy, output_file, style, diff, list_models, download_model_name, auto_setup, show_history, is_interactive, preload_model, config_wizard, template_editor):
+def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, no_copy, output_file, style, diff, diff_mode, side_by_side, list_models, download_model_name, auto_setup, show_history, is_interactive, speculate, preload_model, config_wizard, template_editor, show_stats, profile, tune, history_export, history_import, since, until, semantic_index, http_serve, port):
     """
     Enhances a simple prompt using Ollama AI models, displays the enhanced version,
     and automatically copies it to the clipboard.
@@ -57,8 +80,10 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
     underlying performance factors.
     """
     console = Console()
-    config = load_config(config_path)
-    client = OllamaClient(host=config['ollama_host'], timeout=config['timeout'])
+    profiler = StageTimer()
+    with profiler.stage("Load config"):
+        config = load_config(config_path)
+    client = OllamaClient.from_config(config, priority='interactive')
 
     # Handle configuration wizard
     if config_wizard:
@@ -70,6 +95,10 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         run_template_editor(console, config)
         return
 
+    if show_stats:
+        run_stats_report(console)
+        return
+
     # Custom loading messages for better UX
     loading_messages = [
         "Initializing enhancement engine...",
@@ -105,30 +134,67 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
             console=console,
         ) as progress:
             task = progress.add_task(f"[cyan]Preloading model '{model_to_preload}'...", total=None)
-            client.preload_model(model_to_preload)
+            Enhancer(config=config, client=client).preload(model_to_preload)
             progress.update(task, description=f"[green]✔ Model '{model_to_preload}' preloaded successfully!")
             time.sleep(1)  # Brief pause for visual feedback
         return
 
+    if tune:
+        available_models = client.list_models()
+        if not available_models:
+            console.print("[red]✖[/red] No models available to tune. Please run [bold]`enhance --auto-setup`[/bold] first.")
+            sys.exit(1)
+        model_to_tune = model_name or next(
+            (m for m in config.get('preferred_models', []) if m in available_models), available_models[0])
+        run_tune(console, config, config_path, model_to_tune, prompt)
+        return
+
+    if history_export:
+        run_history_export(console, history_export, output_file, style, model_name, since, until)
+        return
+
+    if history_import:
+        run_history_import(console, config, history_import)
+        return
+
+    if semantic_index:
+        run_semantic_index(console, config, client)
+        return
+
+    if http_serve:
+        run_http_server(console, config, port, verbose)
+        return
+
     if show_history:
-        history_entries = load_history()
-        if not history_entries:
-            console.print(Panel("[yellow]No history found.[/yellow]", title="History", border_style="yellow"))
-            return
+        # Only one page of preview labels is read from the index; -s and -m filter it
+        page = 0
+        selected_record = None
+        while True:
+            records, has_older = history_page(page, HISTORY_PAGE_SIZE, style=style, model=model_name)
+            if not records and page == 0:
+                console.print(Panel("[yellow]No history found.[/yellow]", title="History", border_style="yellow"))
+                return
 
-        choices = [
-            {
-                'name': f"{entry['original_prompt']} -> {entry['enhanced_prompt'][:50]}...",
-                'value': entry
-            }
-            for entry in history_entries
-        ]
-
-        selected_entry = questionary.select(
-            "Select a history entry to view:",
-            choices=choices
-        ).ask()
+            choices = [{'name': record['label'], 'value': record} for record in records]
+            if has_older:
+                choices.append({'name': "⬇ Older entries", 'value': 'older'})
+            if page > 0:
+                choices.append({'name': "⬆ Newer entries", 'value': 'newer'})
+
+            selected_record = questionary.select(
+                f"Select a history entry to view (page {page + 1}):",
+                choices=choices
+            ).ask()
+            if selected_record == 'older':
+                page += 1
+            elif selected_record == 'newer':
+                page -= 1
+            else:
+                break
 
+        selected_entry = load_entry(selected_record) if selected_record else None
+        if selected_record and selected_entry is None:
+            console.print("[yellow]⚠[/yellow] That entry is no longer in the history.")
         if selected_entry:
             # Enhanced history display
             history_table = Table(title="History Details", border_style="green")
@@ -143,7 +209,7 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
             console.print(history_table)
 
             if questionary.confirm("Copy enhanced prompt to clipboard?").ask():
-                copy_to_clipboard(selected_entry['enhanced_prompt'])
+                copy_to_clipboard(selected_entry['enhanced_prompt'], backend=config.get('clipboard_backend', 'auto'))
                 console.print("[green]✔ Copied to clipboard.[/green]")
         return
 
@@ -158,9 +224,6 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         )
         console.print(welcome_panel)
 
-        enhancer = PromptEnhancer(config.get('enhancement_templates'))
-        available_styles = list(enhancer.templates.keys())
-        
         # Enhanced Ollama connection check
         try:
             if not client.is_running():
@@ -217,10 +280,26 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         final_model = model_name or config.get('preferred_models', ["llama3.1:8b", "llama3", "mistral"])[0]
 
         console.print(f"[bold blue]🤖 Using model:[/bold blue] [cyan]{final_model}[/cyan]")
+        library = Enhancer(model=final_model, temperature=temperature, max_tokens=max_tokens,
+                           config=config, client=client)
+        for message in library.template_errors:
+            console.print(f"[yellow]⚠[/yellow] {message}")
+        available_styles = library.styles
         
         current_prompt = ""
         enhanced_prompt = ""
         current_style = config.get('default_style', 'detailed')
+        # Ollama context of the last turn, so refinements only pay prompt eval for the new text
+        reuse_context = config.get('reuse_context', True)
+        session_context = None
+        is_refinement = False
+        # Optionally pre-generate the styles the user is likely to switch to next
+        speculator = None
+        if speculate or config.get('speculate', False):
+            # Guesses are not worth a hedged request
+            speculator = SpeculativeGenerator(Enhancer(model=final_model, temperature=temperature, max_tokens=max_tokens,
+                                                       config={**config, 'hedge_after': 0}))
+        speculative_result = None
 
         while True:
             try:
@@ -229,7 +308,10 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                     if current_prompt.lower() in ['quit', 'exit']:
                         break
 
-                system_prompt = enhancer.enhance(current_prompt, current_style)
+                turn_context = session_context if (reuse_context and is_refinement) else None
+                is_refinement = False
+                turn_speculation, speculative_result = speculative_result, None
+                request = library.prepare(current_prompt, style=current_style, context=turn_context)
                 
                 # Enhanced loading experience with streaming
                 enhanced_prompt = ""
@@ -273,8 +355,13 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                     random.shuffle(thinking_messages)
                     message_iterator = iter(thinking_messages)
 
+                    generation_cancelled = False
+                    # A speculative result or an EnhancementStream; both can be cancelled and hold the result
+                    generation = turn_speculation if turn_speculation is not None else library.stream(request)
+                    stream = None
                     try:
-                        for i, chunk in enumerate(client.generate_stream(final_model, system_prompt, 0.7, 2000)):
+                        stream = turn_speculation.stream() if turn_speculation is not None else iter(generation)
+                        for i, chunk in enumerate(stream):
                             if is_thinking:
                                 think_buffer += chunk
                                 if "</think>" in think_buffer:
@@ -335,6 +422,13 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                             border_style="red"
                         ))
                         continue
+                    except OllamaStalledError as e:
+                        console.print(Panel(
+                            f"[red]✖ Request timed out.[/red]\n[yellow]{e}[/yellow]",
+                            title="Timeout Error",
+                            border_style="red"
+                        ))
+                        continue
                     except requests.exceptions.Timeout:
                         console.print(Panel(
                             "[red]✖ Request timed out.[/red]\n"
@@ -344,13 +438,19 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                         ))
                         continue
                     except KeyboardInterrupt:
-                        console.print(Panel(
-                            "[yellow]⚠ Operation cancelled by user.[/yellow]\n\n"
-                            "[dim]You can resume your session later.[/dim]",
+                        # Abort only this generation and release Ollama, the session goes on
+                        generation.cancel()
+                        if stream is not None:
+                            stream.close()
+                        generation_cancelled = True
+                        live_display.update(Panel(
+                            "[yellow]⚠ Generation cancelled.[/yellow]\n\n"
+                            "[dim]Refine, change the style or quit below. Press Ctrl+C again to end the session.[/dim]",
                             title="Cancelled",
                             border_style="yellow"
                         ))
-                        break
+                    except EmptyResponseError:
+                        pass  # Reported below like any other empty result
                     except Exception as e:
                         console.print(Panel(
                             f"[red]✖ Error during enhancement:[/red]\n{str(e)}\n\n"
@@ -360,32 +460,54 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                         ))
                         continue
                     
-                    # Check if we received any content
-                    if chunk_count == 0:
-                        console.print("[yellow]⚠[/yellow] Warning: No response received from model.")
+                    if not generation_cancelled:
+                        # Check if we received any content
+                        result = generation.result
+                        if result is None:
+                            console.print("[yellow]⚠[/yellow] Warning: No response received from model.")
+                        else:
+                            record_stats(config, result_metrics(result), final_model, current_style)
+                            session_context = result.context if reuse_context else None
+                            try:
+                                save_enhancement(current_prompt, enhanced_prompt, current_style, final_model,
+                                                 policy=RetentionPolicy.from_config(config))
+                            except Exception as e:
+                                console.print(f"[yellow]⚠[/yellow] Warning: Could not save to history: {e}")
                     
-                    # Show completion with enhanced visual feedback
-                    completion_panel = Panel(
-                        "[green]✨ Enhancement complete! AI response generated successfully.[/green]",
-                        title="[bold green]✅ Success[/bold green]",
-                        border_style="green",
-                        expand=False,
-                        padding=(1, 2)
-                    )
+                        # Show completion with enhanced visual feedback
+                        completion_panel = Panel(
+                            "[green]✨ Enhancement complete! AI response generated successfully.[/green]",
+                            title="[bold green]✅ Success[/bold green]",
+                            border_style="green",
+                            expand=False,
+                            padding=(1, 2)
+                        )
                     
-                    display_table = Table.grid(padding=1)
-                    display_table.add_column(width=5)
-                    display_table.add_column()
-                    display_table.add_row("[green]✔[/green]", completion_panel)
-                    live_display.update(display_table)
-                    time.sleep(0.8)  # Longer pause for visual feedback
+                        display_table = Table.grid(padding=1)
+                        display_table.add_column(width=5)
+                        display_table.add_column()
+                        display_table.add_row("[green]✔[/green]", completion_panel)
+                        live_display.update(display_table)
+                        time.sleep(0.8)  # Longer pause for visual feedback
                 
                 # Enhanced prompt display
-                console.print("\n[bold magenta]✨ Enhanced Prompt ✨[/bold magenta]")
-                console.print(Panel(Markdown(enhanced_prompt), 
-                                  title="Enhanced Output", 
-                                  border_style="green",
-                                  expand=False))
+                if generation_cancelled:
+                    if enhanced_prompt:
+                        console.print(Panel(Markdown(enhanced_prompt),
+                                          title="Partial Output (cancelled)",
+                                          border_style="yellow",
+                                          expand=False))
+                else:
+                    console.print("\n[bold magenta]✨ Enhanced Prompt ✨[/bold magenta]")
+                    console.print(Panel(Markdown(enhanced_prompt), 
+                                      title="Enhanced Output", 
+                                      border_style="green",
+                                      expand=False))
+
+                if speculator is not None and not generation_cancelled:
+                    next_styles = predict_next_styles(current_style, available_styles, recent_history(1000, resolve=False),
+                                                      config.get('speculative_styles', 2))
+                    speculator.start(current_prompt, next_styles)
 
                 action = console.input(
                     "[bold blue]Choose action:[/bold blue] "
@@ -396,17 +518,24 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                 ).lower()
 
                 if action == 'r':
+                    if speculator is not None:
+                        speculator.cancel_all()
                     current_prompt = console.input("[bold cyan]Refine prompt: [/bold cyan]")
+                    is_refinement = True
                 elif action == 's':
                     console.print(f"[bold blue]Available styles:[/bold blue] {', '.join(available_styles)}")
                     new_style = console.input(f"[bold cyan]New style ({current_style}): [/bold cyan]")
                     if new_style in available_styles:
                         current_style = new_style
+                        # A different template means the cached context no longer applies
+                        session_context = None
+                        if speculator is not None:
+                            speculative_result = speculator.take(new_style, current_prompt)
                     elif new_style:
                         console.print(f"[yellow]Invalid style. Sticking with {current_style}.[/yellow]")
                 elif action == 'c':
                     try:
-                        copy_to_clipboard(enhanced_prompt)
+                        copy_to_clipboard(enhanced_prompt, backend=config.get('clipboard_backend', 'auto'))
                     except Exception as e:
                         console.print(Panel(
                             f"[red]✖ Error copying to clipboard:[/red]\n{str(e)}\n\n"
@@ -430,6 +559,8 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                     border_style="red"
                 ))
 
+        if speculator is not None:
+            speculator.cancel_all()
         console.print(Panel("[bold green]Exiting interactive mode. Goodbye![/bold green] 👋", 
                           title="Session Ended", border_style="green"))
         return
@@ -438,7 +569,9 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
     
     # Enhanced Ollama connection check with better error handling
     try:
-        if not client.is_running():
+        with profiler.stage("Connect to Ollama"):
+            is_running = client.is_running()
+        if not is_running:
             console.print(Panel(
                 "[red]✖ Ollama service is not running or is unreachable.[/red]\n\n"
                 "[bold]Troubleshooting steps:[/bold]\n"
@@ -509,7 +642,8 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         
     available_models = []
     try:
-        available_models = client.list_models()
+        with profiler.stage("List models"):
+            available_models = client.list_models()
     except Exception as e:
         console.print(Panel(
             f"[red]✖ Error retrieving model list:[/red]\n{str(e)}\n\n"
@@ -618,24 +752,47 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
 
     final_style = style or config.get('default_style', 'detailed')
     final_temperature = temperature if temperature is not None else config.get('default_temperature', 0.7)
-    final_max_tokens = max_tokens or config.get('max_tokens', 2000)
     auto_copy_enabled = not no_copy and config.get('auto_copy', True)
 
-    enhancer = PromptEnhancer(config.get('enhancement_templates'))
-
-    system_prompt = enhancer.enhance(prompt, final_style)
+    with profiler.stage("Load templates"):
+        library = Enhancer(model=final_model, style=final_style, temperature=final_temperature,
+                           max_tokens=max_tokens, config=config, client=client)
+        for message in library.template_errors:
+            console.print(f"[yellow]⚠[/yellow] {message}")
+        request = library.prepare(prompt)
 
     if verbose:
         console.print("\n[bold blue]🔧 System Prompt:[/bold blue]")
-        console.print(Panel(system_prompt, title="System Prompt", border_style="dim"))
+        console.print(Panel(request.system or "[dim](none, template sent as prompt)[/dim]", title="System Prompt", border_style="dim"))
+        console.print(Panel(request.request_prompt, title="Prompt", border_style="dim"))
+        console.print(f"[dim]num_predict: {request.num_predict}, num_ctx: {request.num_ctx or 'model default'}[/dim]")
 
     enhanced_prompt = ""
-    
+
+    semantic_cache = SemanticCache.from_config(client, config)
+    prompt_vector = None
+    cached_prompt = None
+    if semantic_cache is not None:
+        with profiler.stage("Semantic lookup"):
+            prompt_vector = semantic_cache.embed(prompt)
+            match = semantic_cache.lookup(prompt_vector, final_style) if prompt_vector else None
+        if match:
+            cached_prompt = offer_cached_enhancement(console, config, *match)
+
     # Enhanced loading experience with dynamic messages and streaming
-    console.print("[bold blue]🤖 Generating enhanced prompt...[/bold blue]")
+    if cached_prompt:
+        console.print("[bold blue]⚡ Reusing an earlier enhancement...[/bold blue]")
+    else:
+        console.print("[bold blue]🤖 Generating enhanced prompt...[/bold blue]")
+    generation_start = time.perf_counter()
+    stream_generator = None
     
     try:
-        stream_generator = client.generate_stream(final_model, system_prompt, final_temperature, final_max_tokens)
+        if cached_prompt:
+            # Shown through the same display as a generation, as a single chunk
+            stream_generator = iter([cached_prompt])
+        else:
+            stream_generator = iter(library.stream(request))
         
         # Use Live for streaming output with a spinner
         with Live(console=console, auto_refresh=True, refresh_per_second=4) as live_display:
@@ -769,7 +926,12 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
             display_table.add_column()
             display_table.add_row("[green]✔[/green]", completion_panel)
             live_display.update(display_table)
-            time.sleep(0.8)  # Longer pause for visual feedback
+            profiler.add("Generate", time.perf_counter() - generation_start)
+            if client.last_metrics:
+                profiler.add("  time to first token", client.last_metrics['ttft'])
+                profiler.add("  model load (Ollama)", client.last_metrics['load_time'])
+            if not cached_prompt:
+                time.sleep(0.8)  # Longer pause for visual feedback
             
     except requests.exceptions.ConnectionError:
         console.print(Panel(
@@ -783,15 +945,18 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
             border_style="red"
         ))
         sys.exit(1)
-    except requests.exceptions.Timeout:
+    except requests.exceptions.Timeout as e:
+        # Name the limit that ran out; `timeout` itself no longer bounds generations
+        setting = PHASE_SETTINGS.get(getattr(e, "phase", None), "first_token_timeout or inter_token_timeout")
         console.print(Panel(
             "[red]✖ Request timed out while communicating with Ollama.[/red]\n\n"
+            + (f"{e}\n\n" if isinstance(e, OllamaStalledError) else "") +
             "[yellow]This might happen if:[/yellow]\n"
             "• The model is still loading\n"
             "• The prompt is very complex\n"
             "• Your system is under heavy load\n\n"
             "[bold]Try:[/bold]\n"
-            "• Increasing timeout in config (~/.enhance-this/config.yaml)\n"
+            f"• Increasing {setting} in config (~/.enhance-this/config.yaml)\n"
             "• Using a smaller model\n"
             "• Restarting Ollama",
             title="Timeout Error",
@@ -799,6 +964,9 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         ))
         sys.exit(1)
     except KeyboardInterrupt:
+        # Close the stream so Ollama stops generating for us right away
+        if stream_generator is not None:
+            stream_generator.close()
         console.print(Panel(
             "[yellow]⚠ Operation cancelled by user.[/yellow]\n\n"
             "[dim]You can resume your work later.[/dim]",
@@ -806,6 +974,8 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
             border_style="yellow"
         ))
         sys.exit(0)
+    except EmptyResponseError:
+        pass  # Reported below like any other empty result
     except Exception as e:
         console.print(Panel(
             f"[red]✖ Unexpected error during enhancement:[/red]\n{str(e)}\n\n"
@@ -815,11 +985,33 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         ))
         sys.exit(1)
 
-    if enhanced_prompt:
+    if enhanced_prompt and not cached_prompt:
         try:
-            save_enhancement(prompt, enhanced_prompt, final_style, final_model)
+            record = save_enhancement(prompt, enhanced_prompt, final_style, final_model,
+                                      policy=RetentionPolicy.from_config(config))
+            if prompt_vector:
+                semantic_cache.remember(prompt_vector, record)
         except Exception as e:
             console.print(f"[yellow]⚠[/yellow] Warning: Could not save to history: {e}")
+        record_stats(config, client.last_metrics, final_model, final_style)
+        if verbose and client.scheduler is not None:
+            console.print(f"[dim]{client.scheduler.describe()}, "
+                          f"queued {client.last_metrics.get('queue_wait', 0.0):.2f}s[/dim]")
+
+    if enhanced_prompt:
+
+        # Start the copy now so clipboard tools run while the output is rendered
+        if auto_copy_enabled:
+            try:
+                copy_to_clipboard(enhanced_prompt, backend=config.get('clipboard_backend', 'auto'), background=True,
+                                  timeout=config.get('clipboard_timeout', 2.0))
+            except Exception as e:
+                console.print(Panel(
+                    f"[red]✖ Unexpected error during clipboard copy:[/red]\n{str(e)}\n\n"
+                    f"[yellow]You can manually copy the prompt above.[/yellow]",
+                    title="Clipboard Error",
+                    border_style="red"
+                ))
         
         # Enhanced success message
         success_panel = Panel(
@@ -835,21 +1027,16 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         if diff:
             try:
                 console.print("\n[bold yellow]↔️  Diff View ↔️[/bold yellow]")
-                diff_result = difflib.unified_diff(
-                    prompt.splitlines(keepends=True),
-                    enhanced_prompt.splitlines(keepends=True),
-                    fromfile='Original',
-                    tofile='Enhanced',
+                used_mode, original_tokens, enhanced_tokens, opcodes = compute_diff(
+                    prompt, enhanced_prompt,
+                    mode=diff_mode or config.get('diff_mode', 'word'),
+                    max_tokens=config.get('diff_max_tokens', DEFAULT_DIFF_MAX_TOKENS),
+                    timeout=config.get('diff_timeout', DEFAULT_DIFF_TIMEOUT) or None,
                 )
-                for line in diff_result:
-                    if line.startswith('+'):
-                        console.print(f"[green]{line}[/green]", end="")
-                    elif line.startswith('-'):
-                        console.print(f"[red]{line}[/red]", end="")
-                    elif line.startswith('@'):
-                        console.print(f"[dim]{line}[/dim]", end="")
-                    else:
-                        console.print(line, end="")
+                if side_by_side:
+                    console.print(render_side_by_side(original_tokens, enhanced_tokens, opcodes))
+                else:
+                    console.print(render_inline(original_tokens, enhanced_tokens, opcodes, used_mode))
             except Exception as e:
                 console.print(f"[yellow]⚠[/yellow] Warning: Could not generate diff view: {e}")
 
@@ -869,8 +1056,9 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
 
         if output_file:
             try:
-                output_file.write(enhanced_prompt)
-                console.print(f"\n[green]✔[/green] Saved to [cyan]{output_file.name}[/cyan]")
+                with click.open_file(output_file, 'w') as out:
+                    out.write(enhanced_prompt)
+                console.print(f"\n[green]✔[/green] Saved to [cyan]{output_file}[/cyan]")
             except Exception as e:
                 console.print(Panel(
                     f"[red]✖ Error saving to file:[/red]\n{str(e)}\n\n"
@@ -880,15 +1068,11 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
                 ))
 
         if auto_copy_enabled:
-            try:
-                copy_to_clipboard(enhanced_prompt)
-            except Exception as e:
-                console.print(Panel(
-                    f"[red]✖ Unexpected error during clipboard copy:[/red]\n{str(e)}\n\n"
-                    f"[yellow]You can manually copy the prompt above.[/yellow]",
-                    title="Clipboard Error",
-                    border_style="red"
-                ))
+            with profiler.stage("Wait for clipboard"):
+                wait_for_clipboard(config.get('clipboard_timeout', 2.0))
+
+        if profile:
+            console.print(profiler.render())
     else:
         console.print(Panel(
             "[red]✖ Failed to generate enhanced prompt.[/red]\n\n"
@@ -906,9 +1090,229 @@ def enhance(prompt, model_name, temperature, max_tokens, config_path, verbose, n
         sys.exit(1)
 
 
+def record_stats(config, metrics, model, style):
+    """Record the timings of the last generation in the local stats store."""
+    if not config.get('record_stats', True):
+        return
+    try:
+        stats.record_enhancement(metrics, model=model, style=style,
+                                 host=config['ollama_host'],
+                                 capacity=config.get('stats_capacity', stats.DEFAULT_CAPACITY))
+    except Exception:
+        pass  # Statistics are best-effort and must never break an enhancement
+
+
+def result_metrics(result):
+    """The metrics of an EnhancementResult in the form OllamaClient.last_metrics has them."""
+    timings = result.timings
+    return {**result.metrics, "ttft": timings["ttft"], "queue_wait": timings["queue"],
+            "load_time": timings["load"], "total_time": timings["total"]}
+
+
+def run_stats_report(console):
+    """Show latency percentiles by model and style, the daily trend and cold load share."""
+    samples = list(stats.iter_samples())
+    if not samples:
+        console.print(Panel("[yellow]No statistics recorded yet.[/yellow]", title="Stats", border_style="yellow"))
+        return
+
+    summary = stats.summarize(samples)
+
+    by_model_table = Table(title="Latency by Model and Style", border_style="green")
+    by_model_table.add_column("Model", style="cyan")
+    by_model_table.add_column("Style", style="magenta")
+    by_model_table.add_column("Runs", justify="right")
+    by_model_table.add_column("TTFT p50/p95/p99 (s)", justify="right")
+    by_model_table.add_column("Total p50/p95/p99 (s)", justify="right")
+    by_model_table.add_column("Tokens/s", justify="right")
+    by_model_table.add_column("Cold loads", justify="right")
+    for (model, style), group in summary['by_model_style'].items():
+        by_model_table.add_row(
+            model, style, str(group['runs']),
+            "/".join(f"{group['ttft'][p]:.2f}" for p in (50, 95, 99)),
+            "/".join(f"{group['total'][p]:.2f}" for p in (50, 95, 99)),
+            f"{group['tokens_per_sec']:.1f}",
+            f"{group['cold_share']:.0%}",
+        )
+    console.print(by_model_table)
+
+    trend_table = Table(title="Daily Trend", border_style="blue")
+    trend_table.add_column("Day", style="cyan", no_wrap=True)
+    trend_table.add_column("Runs", justify="right")
+    trend_table.add_column("TTFT p50 (s)", justify="right")
+    trend_table.add_column("Total p50 (s)", justify="right")
+    trend_table.add_column("Total p95 (s)", justify="right")
+    trend_table.add_column("Tokens/s", justify="right")
+    trend_table.add_column("Cold loads", justify="right")
+    for day, group in list(summary['trend'].items())[-14:]:
+        trend_table.add_row(
+            day, str(group['runs']),
+            f"{group['ttft'][50]:.2f}",
+            f"{group['total'][50]:.2f}",
+            f"{group['total'][95]:.2f}",
+            f"{group['tokens_per_sec']:.1f}",
+            f"{group['cold_share']:.0%}",
+        )
+    console.print(trend_table)
+
+    console.print(f"[bold]Runs recorded:[/bold] {summary['runs']}  "
+                  f"[bold]Cold model loads:[/bold] {summary['cold_share']:.0%} "
+                  f"[dim](load time > {stats.COLD_LOAD_THRESHOLD}s)[/dim]")
+
+
+def run_tune(console, config, config_path, model, prompt=None):
+    """Sweeps runtime options for `model` and saves the fastest combination to its profile."""
+    from .config import model_options, save_model_profile
+    from .tuning import SAMPLE_PROMPT, candidate_options, tune_model
+
+    # Candidates are measured on top of the current profile, which the client still sends
+    # No coalescing, hedging or retries, which would time another generation than the one measured
+    tuning_client = OllamaClient.from_config(config, quiet=True, coalescer=None, hedge=None, retry_policy=None)
+    tuner = Enhancer(config=config, client=tuning_client)
+    profile = model_options(config.get('model_profiles'), model)
+    candidates = candidate_options(profile=profile)
+    console.print(f"[bold blue]🔧 Tuning[/bold blue] [cyan]{model}[/cyan] "
+                  f"[dim]({len(candidates)} option sets, the model reloads between them)[/dim]")
+
+    table = Table(title=f"Tuning {model}", border_style="blue")
+    table.add_column("Options", style="cyan")
+    table.add_column("Seconds", justify="right")
+
+    def on_result(options, seconds):
+        label = ", ".join(f"{k}={v}" for k, v in options.items()) or ("current profile" if profile else "model defaults")
+        timing = f"{seconds:.2f}s" if seconds is not None else "failed"
+        console.print(f"  {label}: [bold]{timing}[/bold]")
+        table.add_row(label, timing)
+
+    results = tune_model(tuner, model, candidates, prompt=prompt or SAMPLE_PROMPT, on_result=on_result)
+    console.print(table)
+
+    best_options, best_time = results[0]
+    if best_time is None:
+        console.print("[red]✖[/red] No option set produced output. Check that Ollama is running.")
+        return
+    if not best_options:
+        console.print(f"[green]✔[/green] The {'current profile' if profile else 'model defaults'} are fastest, "
+                      f"the profile was left unchanged.")
+        return
+    try:
+        path = save_model_profile(model, best_options, config_path)
+    except ConfigError as e:
+        console.print(f"[red]✖[/red] {e}")
+        return
+    console.print(f"[green]✔[/green] Merged fastest options into model_profiles['{model}'] in {path}")
+
+def offer_cached_enhancement(console, config, score, entry):
+    """Returns the enhanced prompt of a semantic cache hit if it should be reused, else None."""
+    auto = config.get('semantic_cache') == 'auto'
+    if not auto and not sys.stdin.isatty():
+        return None  # Nobody can answer "offer" when the prompt is piped in, generate as with "off"
+    console.print(Panel(
+        f"[bold]Earlier prompt:[/bold] {entry.get('original_prompt', '')}\n"
+        f"[dim]Similarity {score:.2f}, enhanced with {entry.get('model') or 'unknown model'}[/dim]",
+        title="⚡ Similar prompt found", border_style="cyan"))
+    if auto:
+        return entry['enhanced_prompt']
+    if questionary.confirm("Reuse its enhancement instead of generating a new one?", default=True).ask():
+        return entry['enhanced_prompt']
+    return None
+
+
+def run_semantic_index(console, config, client):
+    """Embeds history entries that are not in the semantic index yet."""
+    cache = SemanticCache(client, config.get('embedding_model', DEFAULT_EMBEDDING_MODEL),
+                          config.get('semantic_threshold', DEFAULT_SEMANTIC_THRESHOLD))
+    with Progress(SpinnerColumn(), TextColumn("[progress.description]{task.description}"),
+                  console=console, transient=True) as progress:
+        task = progress.add_task(f"[cyan]Embedding history with {cache.model}...", total=None)
+        added = cache.sync(on_progress=lambda n: progress.update(
+            task, description=f"[cyan]Embedded {n} prompts with {cache.model}..."))
+    console.print(f"[green]✔[/green] Added {added} prompts, the semantic index holds {len(cache.index)}.")
+    if config.get('semantic_cache', 'off') not in ('offer', 'auto'):
+        console.print("[dim]Set semantic_cache to \"offer\" or \"auto\" in the config to use it.[/dim]")
+
+
+def run_http_server(console, config, port=None, verbose=False):
+    """Runs the HTTP server until interrupted."""
+    import asyncio
+    from .server import EnhanceServer
+
+    enhancer = Enhancer(config=config)
+    if verbose and enhancer.scheduler is not None and enhancer.scheduler.limiter is not None:
+        enhancer.scheduler.limiter.on_change = lambda old, new, reason: console.print(
+            f"[dim]Concurrency limit {old} → {new}: {reason}[/dim]")
+    server = EnhanceServer(enhancer, host=config.get('server_host', '127.0.0.1'),
+                           port=config.get('server_port', 8765) if port is None else port,
+                           workers=config.get('server_workers', 4), max_queue=config.get('server_max_queue', 32),
+                           request_timeout=config.get('server_request_timeout', 300))
+
+    async def serve():
+        await server.start()
+        console.print(f"[green]✔[/green] Serving enhancements on [cyan]http://{server.host}:{server.port}[/cyan] "
+                      f"[dim]({server.workers} workers, Ctrl+C to stop)[/dim]")
+        if verbose and enhancer.scheduler is not None:
+            console.print(f"[dim]{enhancer.scheduler.describe()}[/dim]")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        console.print("[yellow]⚠[/yellow] Server stopped.")
+    except OSError as e:
+        console.print(Panel(f"[bold red]✖ Could not start the server:[/bold red] {e}", title="Server Error", border_style="red"))
+        sys.exit(1)
+    finally:
+        server.close()
+
+
+def run_history_export(console, fmt, output_file, style, model, since, until):
+    """Streams filtered history to the `output_file` path (stdout if not given or "-") in `fmt`."""
+    from datetime import timezone
+    from .history_export import export_csv, export_jsonl, export_parquet
+    from .history import iter_history
+
+    # UTC, like the timestamps exports write and imports read when they have no zone
+    entries = iter_history(since=since.replace(tzinfo=timezone.utc).timestamp() if since else None,
+                           until=until.replace(tzinfo=timezone.utc).timestamp() if until else None,
+                           style=style, model=model)
+    if fmt == 'parquet':
+        if output_file in (None, '-'):
+            console.print("[red]✖[/red] Parquet exports need a file. Use [bold]-o history.parquet[/bold].")
+            sys.exit(1)
+        try:
+            # Checks for pyarrow before the file is created
+            count = export_parquet(entries, output_file)
+        except RuntimeError as e:
+            console.print(Panel(f"[bold red]✖ {e}[/bold red]", title="Export Failed", border_style="red"))
+            sys.exit(1)
+    elif output_file in (None, '-'):
+        with click.open_file('-', 'w', encoding='utf-8') as out:
+            count = (export_csv if fmt == 'csv' else export_jsonl)(entries, out)
+    else:
+        # The csv module writes its own \r\n, which newline translation would double on Windows
+        with open(output_file, 'w', encoding='utf-8', newline='' if fmt == 'csv' else None) as out:
+            count = (export_csv if fmt == 'csv' else export_jsonl)(entries, out)
+    if output_file not in (None, '-'):
+        console.print(f"[green]✔[/green] Exported {count} history entries to {output_file}")
+
+
+def run_history_import(console, config, path):
+    """Appends the entries of an export file to the history, applying retention."""
+    from pathlib import Path
+    from .history_export import read_entries
+    from .history import save_entries
+
+    try:
+        count = save_entries(read_entries(Path(path)), policy=RetentionPolicy.from_config(config))
+    except (RuntimeError, ValueError, KeyError) as e:
+        console.print(Panel(f"[bold red]✖ {e}[/bold red]", title="Import Failed", border_style="red"))
+        sys.exit(1)
+    console.print(f"[green]✔[/green] Imported {count} history entries from {path}")
+
+
 def run_config_wizard(console, config_path):
     """Run the interactive configuration wizard for first-time setup."""
-    from .config import get_config_path, DEFAULT_CONFIG
+    from .config import get_config_path, read_config_file, DEFAULT_CONFIG
     import yaml
     
     console.print(Panel("[bold blue]🔧 Configuration Wizard[/bold blue]\n"
@@ -921,14 +1325,7 @@ def run_config_wizard(console, config_path):
         config_file_path = get_config_path(config_path)
         
         # Load existing config or use defaults
-        try:
-            if config_file_path.exists():
-                with open(config_file_path, 'r') as f:
-                    current_config = yaml.safe_load(f) or {}
-            else:
-                current_config = {}
-        except Exception:
-            current_config = {}
+        current_config = read_config_file(config_file_path) if config_file_path.exists() else {}
         
         # Merge with defaults
         config = {**DEFAULT_CONFIG, **current_config}
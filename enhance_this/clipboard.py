@@ -1,27 +1,238 @@
+import base64
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional, Tuple
+
 import pyperclip
 from rich.console import Console
 import platform
 
+from .config import get_config_dir
+
 console = Console()
 
-def copy_to_clipboard(text: str):
-    """Copies the given text to the clipboard."""
+BACKEND_CACHE_FILE = get_config_dir() / "clipboard_backend"
+
+# Command line backends and how to feed them the text on stdin.
+COMMAND_BACKENDS = {
+    "wl-copy": ["wl-copy"],
+    "xclip": ["xclip", "-selection", "clipboard"],
+    "xsel": ["xsel", "--clipboard", "--input"],
+    "pbcopy": ["pbcopy"],
+    "clip": ["clip"],
+}
+BACKENDS = ["pyperclip", "osc52"] + list(COMMAND_BACKENDS)
+
+# Terminals known to honour OSC 52, by TERM_PROGRAM and by TERM prefix
+OSC52_TERM_PROGRAMS = {"iTerm.app", "WezTerm", "vscode", "ghostty", "tmux"}
+OSC52_TERMS = ("xterm-kitty", "alacritty", "foot", "wezterm", "xterm-ghostty", "tmux")
+
+_pending: List[Tuple[threading.Thread, dict]] = []
+
+
+def _environment_key() -> str:
+    """Identifies the kind of session, so a backend cached for X11 is not reused over SSH."""
+    return ",".join([
+        platform.system(),
+        "wayland" if os.environ.get("WAYLAND_DISPLAY") else "",
+        "x11" if os.environ.get("DISPLAY") else "",
+        "ssh" if os.environ.get("SSH_TTY") or os.environ.get("SSH_CONNECTION") else "",
+    ])
+
+
+def _terminal_available() -> bool:
+    try:
+        return sys.stdout.isatty() or os.path.exists("/dev/tty")
+    except (AttributeError, ValueError):
+        return False
+
+
+def _osc52_supported() -> bool:
+    """Whether the terminal is known to set the clipboard from OSC 52.
+
+    Terminals that do not support it ignore the sequence silently, so the copy
+    cannot be reported as failed; it is only picked where it is likely to work.
+    """
+    if os.environ.get("TMUX") or os.environ.get("KITTY_WINDOW_ID"):
+        return True
+    if os.environ.get("TERM_PROGRAM") in OSC52_TERM_PROGRAMS:
+        return True
+    return os.environ.get("TERM", "").startswith(OSC52_TERMS)
+
+
+def detect_backend() -> Optional[str]:
+    """Picks a clipboard backend without spawning any process."""
+    system = platform.system()
+    if system == "Darwin":
+        return "pbcopy"
+    if system == "Windows":
+        return "pyperclip"  # Uses the Win32 API directly, no process is started
+    if os.environ.get("SSH_TTY") or os.environ.get("SSH_CONNECTION"):
+        # The local display is not ours, let the user's terminal set the clipboard
+        return "osc52" if _terminal_available() else None
+    if os.environ.get("WAYLAND_DISPLAY") and shutil.which("wl-copy"):
+        return "wl-copy"
+    if os.environ.get("DISPLAY"):
+        for backend in ("xclip", "xsel"):
+            if shutil.which(backend):
+                return backend
+    if _terminal_available() and _osc52_supported():
+        return "osc52"
+    return None
+
+
+def _read_cached_backend() -> Optional[str]:
     try:
+        backend, key = BACKEND_CACHE_FILE.read_text().strip().split("\t", 1)
+    except (OSError, ValueError):
+        return None
+    return backend if key == _environment_key() and backend in BACKENDS else None
+
+
+def _write_cached_backend(backend: Optional[str]):
+    try:
+        if backend is None:
+            BACKEND_CACHE_FILE.unlink()
+        else:
+            BACKEND_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            BACKEND_CACHE_FILE.write_text(f"{backend}\t{_environment_key()}\n")
+    except OSError:
+        pass
+
+
+def resolve_backend(backend: str = "auto") -> Optional[str]:
+    """Returns the backend to use, detecting it once and caching the result for later runs."""
+    if backend != "auto":
+        return backend
+    cached = _read_cached_backend()
+    # Earlier versions cached osc52 for any terminal; detection is cheap, so check it still applies
+    if cached and (cached != "osc52" or detect_backend() == "osc52"):
+        return cached
+    detected = detect_backend()
+    if detected:
+        _write_cached_backend(detected)
+    return detected
+
+
+def _osc52_copy(text: str):
+    """Asks the terminal to set the clipboard with an OSC 52 escape sequence."""
+    payload = base64.b64encode(text.encode("utf-8")).decode("ascii")
+    sequence = f"\033]52;c;{payload}\a"
+    if os.environ.get("TMUX"):
+        sequence = "\033Ptmux;" + sequence.replace("\033", "\033\033") + "\033\\"
+    try:
+        with open("/dev/tty", "w") as tty:
+            tty.write(sequence)
+            tty.flush()
+    except OSError:
+        if not sys.stdout.isatty():
+            raise pyperclip.PyperclipException("No terminal available for OSC 52.")
+        sys.stdout.write(sequence)
+        sys.stdout.flush()
+
+
+def _copy_with_backend(text: str, backend: Optional[str], timeout: float):
+    if backend is None:
+        raise pyperclip.PyperclipException("No clipboard backend available.")
+    if backend == "pyperclip":
         pyperclip.copy(text)
+    elif backend == "osc52":
+        _osc52_copy(text)
+    elif backend in COMMAND_BACKENDS:
+        try:
+            subprocess.run(COMMAND_BACKENDS[backend], input=text.encode("utf-8"), check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise pyperclip.PyperclipException(str(e))
+    else:
+        raise pyperclip.PyperclipException(f"Unknown clipboard backend '{backend}'.")
+
+
+# What to do when a backend fails, for backends whose fix does not depend on the system
+BACKEND_ADVICE = {
+    "osc52": "Your terminal did not accept the OSC 52 escape sequence. Enable clipboard access in its settings "
+             "(in tmux: set -g set-clipboard on), or set clipboard_backend to a local tool.",
+    "wl-copy": "Install wl-clipboard (e.g. sudo apt-get install wl-clipboard), or set clipboard_backend to osc52.",
+    "xclip": "Install xclip (e.g. sudo apt-get install xclip) and check that DISPLAY is set.",
+    "xsel": "Install xsel (e.g. sudo apt-get install xsel) and check that DISPLAY is set.",
+}
+
+
+def _report_failure(e: Exception, backend: Optional[str] = "pyperclip"):
+    system = platform.system()
+    if backend is None:
+        console.print("[yellow]⚠[/yellow] Could not copy to clipboard: no clipboard backend is available.\n"
+                     "[dim]Install wl-clipboard (Wayland) or xclip (X11), or run in a terminal that supports "
+                     "OSC 52 and set clipboard_backend: osc52.[/dim]")
+    elif backend in BACKEND_ADVICE:
+        console.print(f"[yellow]⚠[/yellow] Could not copy to clipboard with {backend}: {e}\n"
+                     f"[dim]{BACKEND_ADVICE[backend]}[/dim]")
+    elif system == "Linux":
+        console.print("[yellow]⚠[/yellow] Could not copy to clipboard. `xclip` or `xsel` may be required on Linux.\n"
+                     "[dim]Install with: sudo apt-get install xclip or sudo yum install xclip[/dim]")
+    elif system == "Windows":
+        console.print("[yellow]⚠[/yellow] Could not copy to clipboard on Windows.\n"
+                     "[dim]This may be due to missing clipboard permissions or system issues.[/dim]")
+    elif system == "Darwin":  # macOS
+        console.print("[yellow]⚠[/yellow] Could not copy to clipboard on macOS.\n"
+                     "[dim]This may be due to missing clipboard permissions.[/dim]")
+    else:
+        console.print(f"[yellow]⚠[/yellow] Could not copy to clipboard on {system}.\n"
+                     f"[dim]Error: {e}[/dim]")
+
+
+def _report(result: dict):
+    if result.get("ok"):
         console.print("[green]✔ Enhanced prompt copied to clipboard.[/green]")
-    except pyperclip.PyperclipException as e:
-        system = platform.system()
-        if system == "Linux":
-            console.print("[yellow]⚠[/yellow] Could not copy to clipboard. `xclip` or `xsel` may be required on Linux.\n"
-                         "[dim]Install with: sudo apt-get install xclip or sudo yum install xclip[/dim]")
-        elif system == "Windows":
-            console.print("[yellow]⚠[/yellow] Could not copy to clipboard on Windows.\n"
-                         "[dim]This may be due to missing clipboard permissions or system issues.[/dim]")
-        elif system == "Darwin":  # macOS
-            console.print("[yellow]⚠[/yellow] Could not copy to clipboard on macOS.\n"
-                         "[dim]This may be due to missing clipboard permissions.[/dim]")
-        else:
-            console.print(f"[yellow]⚠[/yellow] Could not copy to clipboard on {system}.\n"
-                         f"[dim]Error: {e}[/dim]")
+    elif isinstance(result.get("error"), pyperclip.PyperclipException):
+        _report_failure(result["error"], result.get("backend"))
+    elif result.get("error") is not None:
+        console.print(f"[red]✖[/red] Unexpected error while copying to clipboard: {result['error']}")
+
+
+def _run_copy(text: str, backend: str, timeout: float, result: dict):
+    resolved = resolve_backend(backend)
+    result["backend"] = resolved
+    try:
+        _copy_with_backend(text, resolved, timeout)
+        result["ok"] = True
     except Exception as e:
-        console.print(f"[red]✖[/red] Unexpected error while copying to clipboard: {e}")
\ No newline at end of file
+        result["error"] = e
+        if backend == "auto":
+            _write_cached_backend(None)  # Detect again next time
+
+
+def copy_to_clipboard(text: str, backend: str = "pyperclip", background: bool = False, timeout: float = 2.0,
+                      report: bool = True) -> bool:
+    """Copies the given text to the clipboard.
+
+    With `background=True` the copy runs on a worker thread and the result is reported by
+    `wait_for_clipboard`, so slow clipboard tools do not hold up rendering. Otherwise
+    returns whether the copy worked, printing the outcome unless `report` is False.
+    """
+    result: dict = {}
+    if background:
+        thread = threading.Thread(target=_run_copy, args=(text, backend, timeout, result), daemon=True)
+        thread.start()
+        _pending.append((thread, result))
+        return False
+    _run_copy(text, backend, timeout, result)
+    if report:
+        _report(result)
+    return bool(result.get("ok"))
+
+
+def wait_for_clipboard(timeout: float = 2.0):
+    """Waits up to `timeout` seconds in total for background copies and reports their result."""
+    deadline = time.monotonic() + timeout
+    while _pending:
+        thread, result = _pending.pop(0)
+        thread.join(max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            console.print("[yellow]⚠[/yellow] Clipboard is taking too long, giving up on the copy.")
+            continue
+        _report(result)
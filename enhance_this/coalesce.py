@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from . import errors
+from .config import get_config_dir
+from .locking import try_lock, unlock
+from .ollama_client import CancelToken, GenerationCancelled
+
+INFLIGHT_DIR = get_config_dir() / "inflight"
+MODES = ("off", "process", "machine")
+# How often waiting subscribers check for cancellation and spool followers for new text
+POLL_INTERVAL = 0.02
+# What SingleFlight._pump reads once the upstream stream is exhausted
+_END = object()
+
+_shared: Dict[Optional[Path], "SingleFlight"] = {}
+_shared_lock = threading.Lock()
+
+
+def request_key(host: str, payload: Dict[str, Any], guard=None) -> str:
+    """Identifies a generation: identical keys produce the same stream."""
+    limits = None
+    if guard is not None:
+        limits = [guard.max_bytes, guard.max_lines, guard.repetition_limit, guard.max_block_lines]
+    material = json.dumps([host, payload, limits], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """One upstream generation and the chunks it has produced so far."""
+
+    def __init__(self):
+        self.cancel = CancelToken()
+        self.chunks: List[str] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # Reads the upstream stream into `chunks` whenever `wanted`, see SingleFlight._pump
+        self.pump: Optional[threading.Thread] = None
+        self.wanted = False
+        # Whether another process generated it, see SingleFlight._follow
+        self.shared = False
+        # Filled in by OllamaClient once the stream ends
+        self.last_metrics: Dict[str, Any] = {}
+        self.last_context: Optional[List[int]] = None
+        self.condition = threading.Condition()
+
+
+class SingleFlight:
+    """Shares one upstream generation between identical requests made at the same time.
+
+    The first request for a key starts the upstream stream on a pump thread, which
+    reads the next chunk whenever a subscriber is waiting for one. Requests for the
+    same key that arrive before it finishes replay what was generated so far and then
+    follow it live. No subscriber reads upstream itself, so cancelling one returns at
+    once; the stream keeps going as long as anyone is listening and is cancelled when
+    the last one leaves.
+
+    With a `spool_dir`, the stream is also shared with other processes: the process
+    that starts it holds a lock on `<spool_dir>/<key>.spool` and appends each chunk to
+    it, and other processes tail the file instead of calling Ollama.
+    """
+
+    def __init__(self, spool_dir: Optional[Path] = None):
+        self.spool_dir = spool_dir
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["SingleFlight"]:
+        """Returns the process-wide instance for the `coalesce` setting, or None if off."""
+        mode = config.get("coalesce", "machine")
+        if mode not in ("process", "machine"):
+            return None
+        spool_dir = INFLIGHT_DIR if mode == "machine" else None
+        with _shared_lock:
+            if spool_dir not in _shared:
+                _shared[spool_dir] = cls(spool_dir)
+            return _shared[spool_dir]
+
+    key = staticmethod(request_key)
+
+    def stream(self, key: str, start: Callable[[Flight], Iterator[str]],
+               cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """Yields the chunks of the generation for `key`, starting it with `start` if needed.
+
+        `start(flight)` must stream the generation under `flight.cancel` and leave its
+        metrics and context on the flight. Returns (flight, joined), where `joined` is
+        True if the generation was already running for another request.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            joined = flight is not None
+            if flight is None:
+                flight = Flight()
+                self._flights[key] = flight
+            flight.subscribers += 1
+        if cancel is not None:
+            cancel._on_cancel(lambda: self._cancel_if_alone(key, flight))
+        try:
+            position = 0
+            while True:
+                with flight.condition:
+                    while position >= len(flight.chunks) and not flight.finished:
+                        if cancel is not None and cancel.cancelled:
+                            raise GenerationCancelled()
+                        if flight.pump is None:
+                            flight.pump = threading.Thread(target=self._pump, args=(key, flight, start),
+                                                           name="coalesce-pump", daemon=True)
+                            flight.pump.start()
+                        flight.wanted = True
+                        flight.condition.notify_all()
+                        flight.condition.wait(POLL_INTERVAL)
+                    if cancel is not None and cancel.cancelled:
+                        raise GenerationCancelled()
+                    if position >= len(flight.chunks):
+                        if flight.error is not None:
+                            raise flight.error
+                        return flight, joined or flight.shared
+                    chunk = flight.chunks[position]
+                    position += 1
+                yield chunk
+        finally:
+            self._leave(key, flight)
+
+    def _pump(self, key: str, flight: Flight, start: Callable[[Flight], Iterator[str]]):
+        """Runs on the flight's pump thread, reading a chunk into the flight each time one is wanted."""
+        error = None
+        upstream = start(flight) if self.spool_dir is None else self._spooled(key, flight, start)
+        try:
+            while True:
+                with flight.condition:
+                    while not flight.wanted and not flight.cancel.cancelled:
+                        flight.condition.wait(POLL_INTERVAL)
+                    if flight.cancel.cancelled:
+                        raise GenerationCancelled()
+                    flight.wanted = False
+                chunk = next(upstream, _END)
+                if chunk is _END:
+                    break
+                with flight.condition:
+                    flight.chunks.append(chunk)
+                    flight.condition.notify_all()
+        except BaseException as e:
+            error = e
+        finally:
+            upstream.close()
+            with self._lock:
+                # Later requests start a new generation instead of replaying this one
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.condition:
+                flight.finished = True
+                flight.error = error
+                flight.condition.notify_all()
+
+    def _cancel_if_alone(self, key: str, flight: Flight):
+        with self._lock:
+            if flight.subscribers > 1:
+                return
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.cancel.cancel()
+
+    def _leave(self, key: str, flight: Flight):
+        with self._lock:
+            flight.subscribers -= 1
+            last = flight.subscribers == 0
+            if last and self._flights.get(key) is flight:
+                del self._flights[key]
+        if last and not flight.finished:
+            # The pump thread sees the cancellation and closes the upstream stream
+            flight.cancel.cancel()
+            with flight.condition:
+                flight.condition.notify_all()
+
+    def _spooled(self, key: str, flight: Flight, start: Callable[[Flight], Iterator[str]]) -> Iterator[str]:
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"{key}.spool"
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if try_lock(fd):
+                yield from self._lead(path, fd, flight, start)
+                return
+            replayed = yield from self._follow(fd, flight)
+            if replayed is None:
+                # The other process gave up before sending anything, generate here instead
+                yield from start(flight)
+        finally:
+            os.close(fd)
+
+    def _lead(self, path: Path, fd: int, flight: Flight, start: Callable[[Flight], Iterator[str]]) -> Iterator[str]:
+        """Generates upstream and mirrors every chunk to the spool file. Holds its lock."""
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+
+        def record(**fields):
+            os.write(fd, json.dumps(fields, ensure_ascii=False).encode("utf-8") + b"\n")
+
+        try:
+            for chunk in start(flight):
+                record(chunk=chunk)
+                yield chunk
+            record(done=True, metrics=flight.last_metrics, context=flight.last_context)
+        except BaseException as e:
+            record(error=type(e).__name__, message=str(e))
+            raise
+        finally:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            unlock(fd)
+
+    def _follow(self, fd: int, flight: Flight) -> Iterator[str]:
+        """Replays and tails another process's spool file.
+
+        Returns True once the stream completed, or None if the other process stopped
+        before sending anything.
+        """
+        position = 0
+        pending = b""
+        sent = False
+        while True:
+            if os.fstat(fd).st_size < position:
+                # A new generation took over the file
+                if sent:
+                    raise errors.OllamaRequestError("The shared generation was interrupted.")
+                position, pending = 0, b""
+            os.lseek(fd, position, os.SEEK_SET)
+            data = os.read(fd, 65536)
+            if data:
+                position += len(data)
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "chunk" in entry:
+                        sent = True
+                        yield entry["chunk"]
+                    elif entry.get("done"):
+                        flight.last_metrics = entry.get("metrics") or {}
+                        flight.shared = True
+                        flight.last_context = entry.get("context")
+                        return True
+                    elif "error" in entry:
+                        if entry["error"] == "GenerationCancelled" or entry["error"] == "GeneratorExit":
+                            if sent:
+                                raise errors.OllamaRequestError("The shared generation was cancelled.")
+                            return None
+                        error_class = getattr(errors, entry["error"], None)
+                        if not (isinstance(error_class, type) and issubclass(error_class, errors.EnhanceError)):
+                            error_class = errors.OllamaRequestError
+                        raise error_class(entry.get("message") or entry["error"])
+                continue
+            if flight.cancel.cancelled:
+                raise GenerationCancelled()
+            if try_lock(fd):
+                # The other process exited without finishing; read anything it wrote last
+                unlock(fd)
+                os.lseek(fd, position, os.SEEK_SET)
+                if not os.read(fd, 1):
+                    if sent:
+                        raise errors.OllamaRequestError("The shared generation was interrupted.")
+                    return None
+                continue
+            time.sleep(POLL_INTERVAL)
@@ -1,7 +1,14 @@
+import copy
+import fnmatch
+import hashlib
+import json
 import os
+import re
 import yaml
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from .errors import ConfigError
 
 DEFAULT_CONFIG = {
     "default_temperature": 0.7,
@@ -14,6 +21,52 @@ DEFAULT_CONFIG = {
     "auto_download_model": True,
     "enhancement_templates": {},
     "preferred_models": ["llama3.1:8b", "llama3", "mistral"],
+    "record_stats": True,
+    "stats_capacity": 10000,
+    "reuse_context": True,
+    "use_system_prompt": True,
+    "clipboard_backend": "auto",
+    "clipboard_timeout": 2.0,
+    "speculate": False,
+    "speculative_styles": 2,
+    "max_output_bytes": 20000,
+    "max_output_lines": 400,
+    "repetition_limit": 3,
+    "num_ctx": "auto",
+    "max_num_ctx": 32768,
+    "model_profiles": {},
+    "diff_mode": "word",
+    "diff_max_tokens": 20000,
+    "diff_timeout": 1.0,
+    "history_max_entries": 50000,
+    "history_max_age_days": 0,
+    "history_max_bytes": 100000000,
+    "history_segment_bytes": 1000000,
+    "semantic_cache": "off",
+    "embedding_model": "nomic-embed-text",
+    "semantic_threshold": 0.92,
+    "server_host": "127.0.0.1",
+    "server_port": 8765,
+    "server_workers": 4,
+    "server_max_queue": 32,
+    "server_request_timeout": 300,
+    "coalesce": "machine",
+    "scheduler_max_concurrent": 4,
+    "scheduler_limits": {},
+    "scheduler_max_queue": 64,
+    "scheduler_adaptive": True,
+    "scheduler_adaptive_max": 16,
+    "scheduler_queue_delay_tolerance": 0.5,
+    "connect_timeout": 5,
+    "first_token_timeout": 120,
+    "inter_token_timeout": 30,
+    "total_timeout": 0,
+    "deadline": 0,
+    "generate_retries": 2,
+    "retry_backoff": 0.5,
+    "hedge_after": 0,
+    "hedge_hosts": [],
+    "hedge_model": "",
 }
 
 def get_config_dir() -> Path:
@@ -24,29 +77,195 @@ def get_config_path(config_path_str: Optional[str] = None) -> Path:
         return Path(config_path_str)
     return get_config_dir() / "config.yaml"
 
-def load_config(config_path_str: Optional[str] = None) -> Dict[str, Any]:
-    config_path = get_config_path(config_path_str)
-    config = DEFAULT_CONFIG.copy()
+# libyaml's loader is several times faster than the pure-Python one when available
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Parsed configs are cached here, one file per config path
+_CACHE_DIR_NAME = "config_cache"
+# Set to skip the config file, template discovery and cache, e.g. in CI
+NO_CONFIG_FILE_ENV = "ENHANCE_NO_CONFIG_FILE"
+ENV_PREFIX = "ENHANCE_"
 
-    if config_path.exists():
+def read_config_file(config_path: Path) -> Dict[str, Any]:
+    """Parses a YAML config file, returning an empty dict if it is missing or invalid."""
+    try:
+        with open(config_path, 'r') as f:
+            user_config = yaml.load(f, Loader=_YAML_LOADER)
+    except (yaml.YAMLError, IOError):
+        return {}  # Use default config if file is invalid
+    return user_config if isinstance(user_config, dict) else {}
+
+def _mtime_key(path: Path) -> Optional[List[int]]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _cache_path(config_path: Path) -> Path:
+    """Where the parsed `config_path` is cached: under the config directory, never next to a -c file."""
+    name = hashlib.sha256(str(config_path).encode("utf-8")).hexdigest()[:16]
+    return get_config_dir() / _CACHE_DIR_NAME / f"{name}.json"
+
+def _cache_key(config_path: Path, templates_dir: Path) -> List[Any]:
+    return [
+        str(config_path),
+        _mtime_key(config_path),
+        _mtime_key(templates_dir),
+        repr(DEFAULT_CONFIG),
+    ]
+
+def _read_cache(cache_path: Path, key: List[Any]) -> Optional[Dict[str, Any]]:
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("key") != key:
+        return None
+    return cached.get("config")
+
+def _write_cache(cache_path: Path, key: List[Any], config: Dict[str, Any]):
+    try:
+        cache_path.parent.mkdir(exist_ok=True)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"key": key, "config": config}, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError):
+        pass  # Values YAML can hold but JSON cannot (e.g. dates) just skip the cache
+
+def _coerce_env_value(raw: str, default: Any) -> Any:
+    if isinstance(default, bool):
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(raw)
+    if isinstance(default, float):
+        return float(raw)
+    if isinstance(default, list):
+        return [item.strip() for item in raw.split(",") if item.strip()]
+    if isinstance(default, dict):
+        return json.loads(raw)
+    return raw
+
+def _env_flag(name: str) -> bool:
+    return _coerce_env_value(os.environ.get(name, ""), False)
+
+def apply_env_overrides(config: Dict[str, Any], environ: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Overrides settings from ENHANCE_<SETTING> variables, e.g. ENHANCE_OLLAMA_HOST."""
+    environ = os.environ if environ is None else environ
+    for key, default in DEFAULT_CONFIG.items():
+        raw = environ.get(ENV_PREFIX + key.upper())
+        if raw is None:
+            continue
         try:
-            with open(config_path, 'r') as f:
-                user_config = yaml.safe_load(f)
-            if user_config:
-                config.update(user_config)
-        except (yaml.YAMLError, IOError):
-            pass  # Use default config if file is invalid
+            config[key] = _coerce_env_value(raw, default)
+        except ValueError:
+            pass  # Ignore malformed overrides like the config file does
+    return config
+
+def _load_from_disk(config_path: Path, templates_dir: Path) -> Dict[str, Any]:
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if config_path.exists():
+        user_config = read_config_file(config_path)
+        if user_config:
+            config.update(user_config)
 
     # Discover custom templates
-    custom_templates_dir = get_config_dir() / "templates"
-    if custom_templates_dir.is_dir():
-        for template_file in custom_templates_dir.glob("*.txt"):
+    if templates_dir.is_dir():
+        config["enhancement_templates"] = dict(config.get("enhancement_templates") or {})
+        for template_file in templates_dir.glob("*.txt"):
             style_name = template_file.stem
             if style_name not in config["enhancement_templates"]:
                 config["enhancement_templates"][style_name] = str(template_file)
-
     return config
 
+def load_config(config_path_str: Optional[str] = None) -> Dict[str, Any]:
+    if _env_flag(NO_CONFIG_FILE_ENV):
+        return apply_env_overrides(copy.deepcopy(DEFAULT_CONFIG))
+
+    config_path = get_config_path(config_path_str).resolve()
+    templates_dir = get_config_dir() / "templates"
+    cache_path = _cache_path(config_path)
+
+    # The merged config is cached until the config file or templates directory changes
+    key = _cache_key(config_path, templates_dir)
+    config = _read_cache(cache_path, key)
+    if config is None:
+        config = _load_from_disk(config_path, templates_dir)
+        if get_config_dir().is_dir():
+            _write_cache(cache_path, key, config)
+
+    return apply_env_overrides(config)
+
+def model_options(model_profiles: Optional[Dict[str, Dict[str, Any]]], model: str) -> Dict[str, Any]:
+    """Returns the Ollama options configured for `model` in `model_profiles`.
+
+    Keys are model names or globs like "llama3*". Matching globs are merged in the order
+    they appear, and an exact match is applied last so it wins over any glob.
+    """
+    options: Dict[str, Any] = {}
+    if not model_profiles:
+        return options
+    for pattern, profile in model_profiles.items():
+        if pattern != model and fnmatch.fnmatchcase(model, pattern) and isinstance(profile, dict):
+            options.update(profile)
+    exact = model_profiles.get(model)
+    if isinstance(exact, dict):
+        options.update(exact)
+    return options
+
+def _replace_block(text: str, key: str, value: Any) -> str:
+    """Replaces the top-level `key` of a YAML document with `value`, leaving the other lines as they are."""
+    block = yaml.dump({key: value}, default_flow_style=False, sort_keys=False)
+    lines = text.splitlines(keepends=True)
+    pattern = re.compile(rf"""^["']?{re.escape(key)}["']?\s*:""")
+    start = next((i for i, line in enumerate(lines) if pattern.match(line)), None)
+    if start is None:
+        return (text if not text or text.endswith("\n") else text + "\n") + block
+    end = start + 1
+    while end < len(lines) and (not lines[end].strip() or lines[end][0] in " \t"):
+        end += 1
+    # Blank lines after the block separate it from the next setting
+    while end > start + 1 and not lines[end - 1].strip():
+        end -= 1
+    return "".join(lines[:start]) + block + "".join(lines[end:])
+
+def save_model_profile(model: str, options: Dict[str, Any], config_path_str: Optional[str] = None) -> Path:
+    """Merges `options` into the profile of `model` in config.yaml.
+
+    Only the model_profiles block is rewritten, so other settings keep their comments.
+    Raises ConfigError without writing anything if config.yaml cannot be parsed.
+    """
+    config_path = get_config_path(config_path_str)
+    try:
+        text = config_path.read_text()
+    except FileNotFoundError:
+        text = ""
+    try:
+        user_config = yaml.load(text, Loader=_YAML_LOADER) or {}
+    except yaml.YAMLError as e:
+        raise ConfigError(f"{config_path} is not valid YAML, fix it before saving a profile: {e}") from e
+    if not isinstance(user_config, dict):
+        raise ConfigError(f"{config_path} does not hold settings, fix it before saving a profile.")
+    profiles = user_config.get("model_profiles")
+    profiles = dict(profiles) if isinstance(profiles, dict) else {}
+    profile = profiles.get(model)
+    profiles[model] = {**(profile if isinstance(profile, dict) else {}), **options}
+    user_config["model_profiles"] = profiles
+    updated = _replace_block(text, "model_profiles", profiles)
+    try:
+        in_place = yaml.load(updated, Loader=_YAML_LOADER) == user_config
+    except yaml.YAMLError:
+        in_place = False
+    if not in_place:
+        # A layout the line edit cannot handle (anchors, a flow mapping spanning keys, ...)
+        updated = yaml.dump(user_config, default_flow_style=False, sort_keys=False)
+    config_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = config_path.with_name(f"{config_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(updated)
+    os.replace(tmp_path, config_path)
+    return config_path
+
 def ensure_config_dir_exists():
     get_config_dir().mkdir(parents=True, exist_ok=True)
 
@@ -0,0 +1,222 @@
+import re
+import time
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+from rich.table import Table
+from rich.text import Text
+
+# Words, runs of whitespace and single punctuation marks, so a diff can mark changed words
+_WORD = re.compile(r"\s+|\w+|[^\w\s]")
+
+# Above this many tokens (both sides together) word diffs fall back to lines
+DEFAULT_MAX_TOKENS = 20000
+
+# Seconds the search for a minimal diff may take. Past it, the parts not yet aligned
+# are shown as replaced, like diff-match-patch's Diff_Timeout, so two long and
+# dissimilar texts cannot stall the terminal.
+DEFAULT_TIMEOUT = 1.0
+
+Opcode = Tuple[str, int, int, int, int]
+
+
+def tokenize(text: str, mode: str = "word") -> List[str]:
+    """Splits text into the units compared by the diff: words ("word") or lines ("line")."""
+    if mode == "line":
+        return text.splitlines(keepends=True)
+    return _WORD.findall(text)
+
+
+def _split_point(a: Sequence[int], alo: int, ahi: int,
+                 b: Sequence[int], blo: int, bhi: int, deadline: Optional[float] = None) -> Optional[Tuple[int, int]]:
+    """Finds where the forward and reverse paths of Myers' algorithm meet.
+
+    Uses O(N + M) memory (the linear space variant, as in diff-match-patch's bisect).
+    Returns the split point relative to (alo, blo), or None if nothing matches or
+    the `deadline` (a time.monotonic() value) passed first.
+    """
+    n = ahi - alo
+    m = bhi - blo
+    max_d = (n + m + 1) // 2
+    offset = max_d
+    length = 2 * max_d + 2
+    v1 = [-1] * length
+    v2 = [-1] * length
+    v1[offset + 1] = 0
+    v2[offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    for d in range(max_d):
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[alo + x1] == b[blo + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = offset + delta - k1
+                if 0 <= k2_offset < length and v2[k2_offset] != -1 and x1 >= n - v2[k2_offset]:
+                    return x1, y1
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[ahi - x2 - 1] == b[bhi - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = offset + delta - k2
+                if 0 <= k1_offset < length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return x1, y1
+    return None
+
+
+def _matching_pairs(a: Sequence[int], b: Sequence[int], deadline: Optional[float] = None) -> List[Tuple[int, int]]:
+    """Returns the (i, j) index pairs of a longest common subsequence of a and b.
+
+    Once `deadline` passes, only common prefixes and suffixes are still matched.
+    """
+    pairs: List[Tuple[int, int]] = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            pairs.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            pairs.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        split = _split_point(a, alo, ahi, b, blo, bhi, deadline)
+        if split is None:
+            continue
+        x, y = split
+        if (x, y) in ((0, 0), (ahi - alo, bhi - blo)):
+            continue  # No progress possible, treat the rest as replaced
+        stack.append((alo + x, ahi, blo + y, bhi))
+        stack.append((alo, alo + x, blo, blo + y))
+    pairs.sort()
+    return pairs
+
+
+def diff_opcodes(a: Sequence[Hashable], b: Sequence[Hashable],
+                 timeout: Optional[float] = DEFAULT_TIMEOUT) -> List[Opcode]:
+    """Diffs two token sequences, returning difflib-style (tag, i1, i2, j1, j2) opcodes.
+
+    The diff is minimal unless finding it takes longer than `timeout` seconds (None
+    for no limit); then it is coarser, but still turns `a` into `b`.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    ids: Dict[Hashable, int] = {}
+    a_ids = [ids.setdefault(token, len(ids)) for token in a]
+    b_ids = [ids.setdefault(token, len(ids)) for token in b]
+
+    # Tokens found on only one side can never match. Dropping them first keeps the
+    # search small when a short prompt is compared with a long enhanced one.
+    shared = set(a_ids).intersection(b_ids)
+    a_keep = [i for i, token in enumerate(a_ids) if token in shared]
+    b_keep = [j for j, token in enumerate(b_ids) if token in shared]
+    pairs = _matching_pairs([a_ids[i] for i in a_keep], [b_ids[j] for j in b_keep], deadline)
+
+    opcodes: List[Opcode] = []
+    i = j = 0
+    for fi, fj in pairs + [(None, None)]:
+        ai, bj = (len(a), len(b)) if fi is None else (a_keep[fi], b_keep[fj])
+        if i < ai or j < bj:
+            tag = "replace" if i < ai and j < bj else ("delete" if i < ai else "insert")
+            opcodes.append((tag, i, ai, j, bj))
+        if fi is None:
+            break
+        if opcodes and opcodes[-1][0] == "equal":
+            tag, i1, _, j1, _ = opcodes.pop()
+            opcodes.append(("equal", i1, ai + 1, j1, bj + 1))
+        else:
+            opcodes.append(("equal", ai, ai + 1, bj, bj + 1))
+        i, j = ai + 1, bj + 1
+    return opcodes
+
+
+def compute_diff(original: str, enhanced: str, mode: str = "word",
+                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                 timeout: Optional[float] = DEFAULT_TIMEOUT) -> Tuple[str, List[str], List[str], List[Opcode]]:
+    """Tokenizes and diffs two texts, falling back from words to lines above `max_tokens`.
+
+    `timeout` bounds the search for a minimal diff, see `diff_opcodes`.
+
+    Returns (mode used, original tokens, enhanced tokens, opcodes).
+    """
+    a, b = tokenize(original, mode), tokenize(enhanced, mode)
+    if mode == "word" and len(a) + len(b) > max_tokens:
+        mode = "line"
+        a, b = tokenize(original, mode), tokenize(enhanced, mode)
+    if len(a) + len(b) > max_tokens:
+        raise ValueError(f"Texts are too large to diff ({len(a) + len(b)} {mode}s, limit {max_tokens}).")
+    return mode, a, b, diff_opcodes(a, b, timeout)
+
+
+def render_inline(a: List[str], b: List[str], opcodes: List[Opcode], mode: str = "word") -> Text:
+    """Renders a diff as one Text: removed tokens in red, added tokens in green."""
+    text = Text()
+    if mode == "line":
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    text.append("  " + line)
+                continue
+            for line in a[i1:i2]:
+                text.append("- " + line, style="red")
+            for line in b[j1:j2]:
+                text.append("+ " + line, style="green")
+        return text
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            text.append("".join(a[i1:i2]))
+            continue
+        if i2 > i1:
+            text.append("".join(a[i1:i2]), style="red strike")
+        if j2 > j1:
+            text.append("".join(b[j1:j2]), style="green")
+    return text
+
+
+def render_side_by_side(a: List[str], b: List[str], opcodes: List[Opcode]) -> Table:
+    """Renders a diff as two columns, removals marked on the left and additions on the right."""
+    left = Text()
+    right = Text()
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            left.append("".join(a[i1:i2]))
+            right.append("".join(b[j1:j2]))
+            continue
+        left.append("".join(a[i1:i2]), style="red")
+        right.append("".join(b[j1:j2]), style="green")
+    table = Table(border_style="yellow", expand=True)
+    table.add_column("Original", ratio=1)
+    table.add_column("Enhanced", ratio=1)
+    table.add_row(left, right)
+    return table
@@ -1,12 +1,169 @@
 import importlib.resources
-from typing import Dict, Optional
+import re
+import threading
+import yaml
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 from rich.console import Console
 
+from .errors import UnknownStyleError
+
 console = Console()
 
-def load_templates(custom_template_paths: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+# Follow-up sent in place of the full template when a session already holds the
+# template in Ollama's context, so only this short text needs prompt evaluation.
+REFINE_TEMPLATE = (
+    "The user has revised their prompt. Apply exactly the same instructions as before "
+    "to the revised prompt below and generate ONLY the new enhanced prompt.\n\n"
+    "## Revised Prompt\n\n"
+    "\"{user_prompt}\""
+)
+
+PLACEHOLDER = "{user_prompt}"
+_HEADING = re.compile(r"^#{1,6}\s", re.MULTILINE)
+
+
+def render_template(template: str, user_prompt: str) -> str:
+    """Fills in the user prompt, treating templates that are not valid format strings literally."""
+    try:
+        return template.format(user_prompt=user_prompt)
+    except (KeyError, IndexError, ValueError):
+        return template.replace(PLACEHOLDER, user_prompt)
+
+
+def split_template(template: str) -> Tuple[str, str]:
+    """Splits a template into a static system part and a short user part holding the placeholder.
+
+    Sending the static part as the system prompt gives every request the same long prefix,
+    so Ollama can reuse its evaluated prompt cache between different user prompts. The user
+    part is the markdown section (or, without headings, the paragraph) holding `{user_prompt}`.
+    """
+    if PLACEHOLDER not in template:
+        return template, PLACEHOLDER
+
+    if _HEADING.search(template):
+        starts = [m.start() for m in _HEADING.finditer(template)]
+        if starts[0] != 0:
+            starts.insert(0, 0)
+        blocks = [template[a:b] for a, b in zip(starts, starts[1:] + [len(template)])]
+    else:
+        blocks = re.split(r"(?<=\n\n)", template)
+
+    user_blocks = [block for block in blocks if PLACEHOLDER in block]
+    system_blocks = [block for block in blocks if PLACEHOLDER not in block]
+    system = "".join(system_blocks).strip()
+    if not system:
+        return "", template
+    return system, "".join(user_blocks).strip()
+
+
+# Ollama's default context size. Contexts are sized in powers of two from here, so
+# nearby prompt lengths share a size and Ollama does not reload the model between runs.
+MIN_NUM_CTX = 2048
+# Room for the model's chat template and special tokens around system and prompt
+_CTX_OVERHEAD = 64
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimates the token count of `text` without calling the model's tokenizer.
+
+    English text averages about four characters per token; characters outside ASCII
+    are counted as one token each, which overestimates slightly rather than under.
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def context_size(prompt_tokens: int, num_predict: int, maximum: int = 32768) -> int:
+    """Returns the smallest power-of-two context (at least MIN_NUM_CTX) holding prompt and output."""
+    needed = prompt_tokens + num_predict + _CTX_OVERHEAD
+    size = MIN_NUM_CTX
+    while size < needed:
+        size *= 2
+    return min(size, maximum)
+
+
+def request_context_size(config: Dict[str, Any], system: str, prompt: str, num_predict: int,
+                         context: Optional[List[int]] = None) -> Optional[int]:
+    """Resolves the `num_ctx` option from config: a fixed size, "auto" sizing, or None for Ollama's default."""
+    setting = config.get('num_ctx', 'auto')
+    if setting != 'auto':
+        return int(setting) or None
+    prompt_tokens = estimate_tokens(system) + estimate_tokens(prompt) + len(context or [])
+    return context_size(prompt_tokens, num_predict, int(config.get('max_num_ctx', 32768)))
+
+
+# The "auto" num_ctx sent so far per (host, model) in this process, see session_context_size
+_session_sizes: Dict[Tuple[str, str], int] = {}
+_session_lock = threading.Lock()
+
+
+def session_context_size(config: Dict[str, Any], model: str, system: str, prompt: str, num_predict: int,
+                         context: Optional[List[int]] = None, reserve: int = 0) -> Optional[int]:
+    """Like `request_context_size`, but gives every style the same "auto" size for a model.
+
+    Ollama reloads a model whenever num_ctx changes. `reserve` is the most tokens any
+    style needs for this prompt (see PromptEnhancer.largest_request), so the size does
+    not depend on the style, and within the process it never shrinks below one sent
+    earlier. None is returned while Ollama's default context is enough, as no num_ctx
+    is sent then.
+    """
+    if config.get('num_ctx', 'auto') != 'auto':
+        return request_context_size(config, system, prompt, num_predict, context)
+    prompt_tokens = estimate_tokens(system) + estimate_tokens(prompt) + len(context or [])
+    size = context_size(max(prompt_tokens + num_predict, reserve), 0, int(config.get('max_num_ctx', 32768)))
+    key = (config.get('ollama_host', ''), model)
+    with _session_lock:
+        size = max(size, _session_sizes.get(key, 0))
+        _session_sizes[key] = size
+    return size if size > MIN_NUM_CTX else None
+
+
+_FRONT_MATTER = re.compile(r"\A---[ \t]*\r?\n(.*?)\r?\n---[ \t]*(?:\r?\n|\Z)", re.DOTALL)
+
+
+def parse_template(content: str) -> Tuple[str, Dict[str, Any]]:
+    """Separates an optional YAML front matter block from the template body.
+
+    Front matter holds per-style generation settings, for example::
+
+        ---
+        stop: ["\n\nExplanation:"]
+        ---
+    """
+    match = _FRONT_MATTER.match(content)
+    if not match:
+        return content, {}
+    try:
+        metadata = yaml.safe_load(match.group(1))
+    except yaml.YAMLError:
+        return content, {}
+    if not isinstance(metadata, dict):
+        return content, {}
+    return content[match.end():], metadata
+
+
+def _print_error(message: str):
+    console.print(message)
+
+
+def load_templates(custom_template_paths: Optional[Dict[str, str]] = None,
+                   on_error: Optional[Callable[[str], None]] = None) -> Dict[str, str]:
+    return load_templates_with_metadata(custom_template_paths, on_error)[0]
+
+
+def load_templates_with_metadata(custom_template_paths: Optional[Dict[str, str]] = None,
+                                 on_error: Optional[Callable[[str], None]] = None) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """Loads the template bodies and their front matter metadata, keyed by style.
+
+    Templates that cannot be loaded are skipped and reported to `on_error`, which
+    prints them by default.
+    """
+    on_error = on_error or _print_error
     templates = {}
+    metadata = {}
     package = 'enhance_this'
     
     # Load built-in templates
@@ -17,10 +174,10 @@ def load_templates(custom_template_paths: Optional[Dict[str, str]] = None) -> Di
             # and then read the text content. This is the recommended approach
             # for compatibility with both files and directories within packages.
             content = importlib.resources.files(package).joinpath(f'templates/{style}.txt').read_text(encoding='utf-8')
-            templates[style] = content
+            templates[style], metadata[style] = parse_template(content)
         except FileNotFoundError:
             # This should not happen with built-in templates
-            console.print(f"[red]✖[/red] Built-in template for style '{style}' not found.")
+            on_error(f"[red]✖[/red] Built-in template for style '{style}' not found.")
 
     # Load custom templates from config
     if custom_template_paths:
@@ -30,22 +187,65 @@ def load_templates(custom_template_paths: Optional[Dict[str, str]] = None) -> Di
             try:
                 path = Path(path_str).expanduser()
                 if path.is_file():
-                    templates[style] = path.read_text(encoding='utf-8')
+                    templates[style], metadata[style] = parse_template(path.read_text(encoding='utf-8'))
                 else:
-                    console.print(f"[yellow]⚠[/yellow] Custom template for style '{style}' not found at: {path_str}")
+                    on_error(f"[yellow]⚠[/yellow] Custom template for style '{style}' not found at: {path_str}")
             except Exception as e:
-                console.print(f"[red]✖[/red] Error loading custom template for style '{style}': {e}")
+                on_error(f"[red]✖[/red] Error loading custom template for style '{style}': {e}")
 
-    return templates
+    return templates, metadata
 
 class PromptEnhancer:
-    def __init__(self, custom_template_paths: Optional[Dict[str, str]] = None):
-        self.templates = load_templates(custom_template_paths)
+    def __init__(self, custom_template_paths: Optional[Dict[str, str]] = None,
+                 on_error: Optional[Callable[[str], None]] = None):
+        self.templates, self.metadata = load_templates_with_metadata(custom_template_paths, on_error)
+        self._splits: Dict[str, Tuple[str, str]] = {}
+        self._template_sizes: Dict[int, int] = {}
 
-    def enhance(self, user_prompt: str, style: str) -> str:
+    def _template(self, style: str) -> str:
         if style not in self.templates:
             available_styles = list(self.templates.keys())
-            raise ValueError(f"Unknown style: '{style}'. Available styles: {available_styles}")
-        
-        template = self.templates[style]
-        return template.format(user_prompt=user_prompt)
+            raise UnknownStyleError(f"Unknown style: '{style}'. Available styles: {available_styles}")
+        return self.templates[style]
+
+    def enhance(self, user_prompt: str, style: str) -> str:
+        template = self._template(style)
+        return render_template(template, user_prompt)
+
+    def build(self, user_prompt: str, style: str, split: bool = True) -> Tuple[str, str]:
+        """Returns the (system, prompt) pair for a request, with the static template as system."""
+        template = self._template(style)
+        if not split:
+            return "", render_template(template, user_prompt)
+        if style not in self._splits:
+            system, user_part = split_template(template)
+            self._splits[style] = (render_template(system, ""), user_part)
+        system, user_part = self._splits[style]
+        return system, render_template(user_part, user_prompt)
+
+    def stop_sequences(self, style: str) -> Optional[List[str]]:
+        """Returns the stop sequences declared in the style's front matter, if any."""
+        stop = self.metadata.get(style, {}).get('stop')
+        if isinstance(stop, str):
+            return [stop]
+        return [str(s) for s in stop] if stop else None
+
+    def num_predict(self, style: str, limit: int) -> int:
+        """Returns the style's `num_predict` from its front matter, capped at `limit`."""
+        value = self.metadata.get(style, {}).get('num_predict')
+        try:
+            return min(int(value), limit) if value else limit
+        except (TypeError, ValueError):
+            return limit
+
+    def largest_request(self, user_prompt: str, limit: int) -> int:
+        """Estimates the tokens of the style needing the most for `user_prompt`, output budget included."""
+        if limit not in self._template_sizes:
+            self._template_sizes[limit] = max(
+                (estimate_tokens(render_template(template, "")) + self.num_predict(style, limit)
+                 for style, template in self.templates.items()), default=0)
+        return self._template_sizes[limit] + estimate_tokens(user_prompt)
+
+    def refine(self, user_prompt: str) -> str:
+        """Builds the follow-up prompt for a refinement turn that reuses the previous context."""
+        return REFINE_TEMPLATE.format(user_prompt=user_prompt)
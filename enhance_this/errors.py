@@ -0,0 +1,73 @@
+import requests
+
+# Errors from talking to Ollama also subclass the matching `requests` exception, so
+# code that already catches those keeps working.
+
+
+class EnhanceError(Exception):
+    """Base class of the errors raised by enhance-this."""
+
+
+class OllamaUnavailableError(EnhanceError, requests.exceptions.ConnectionError):
+    """Ollama could not be reached."""
+
+
+class OllamaTimeoutError(EnhanceError, requests.exceptions.Timeout):
+    """Ollama did not answer within the timeout."""
+
+
+class DeadlineExceededError(OllamaTimeoutError):
+    """The enhancement did not finish within its overall deadline, see resilience.Deadline."""
+
+
+class OllamaStalledError(OllamaTimeoutError):
+    """A generation made no progress in time; `phase` is connect, first_token, inter_token or total."""
+
+    def __init__(self, message: str, phase: str, **kwargs):
+        super().__init__(message, **kwargs)
+        self.phase = phase
+
+
+class OllamaRequestError(EnhanceError, requests.RequestException):
+    """Ollama rejected a request or failed while answering it."""
+
+
+class ModelNotFoundError(EnhanceError, LookupError):
+    """The requested model is not installed, or no model is installed at all."""
+
+
+class UnknownStyleError(EnhanceError, ValueError):
+    """No template exists for the requested style."""
+
+
+class TemplateError(EnhanceError):
+    """A custom template could not be loaded."""
+
+
+class EmptyResponseError(EnhanceError):
+    """The model finished without producing any output."""
+
+
+class StreamRestartError(EnhanceError):
+    """A generation restarted after a failure did not reproduce the text already returned."""
+
+
+class ConfigError(EnhanceError):
+    """config.yaml cannot be parsed, so it is not safe to update."""
+
+
+class QueueFullError(EnhanceError):
+    """Too many requests are already waiting for Ollama, see scheduler.Scheduler."""
+
+
+def ollama_error(error: Exception) -> Exception:
+    """Returns the typed error for a `requests` exception, or `error` itself."""
+    if isinstance(error, EnhanceError) or not isinstance(error, requests.RequestException):
+        return error
+    if isinstance(error, requests.exceptions.ConnectionError):
+        cls = OllamaUnavailableError
+    elif isinstance(error, requests.exceptions.Timeout):
+        cls = OllamaTimeoutError
+    else:
+        cls = OllamaRequestError
+    return cls(str(error) or type(error).__name__, request=error.request, response=error.response)
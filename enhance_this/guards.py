@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class StreamGuard:
+    """Watches a generation stream and decides when to cut it short.
+
+    Stops when the output exceeds a byte or line cap, or when the model falls into a
+    loop and emits the same line (or block of lines) `repetition_limit` times in a row.
+    Text inside <think> tags does not count, so reasoning models are not cut off early.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_lines: Optional[int] = None,
+                 repetition_limit: int = 3, max_block_lines: int = 4):
+        self.max_bytes = max_bytes or None
+        self.max_lines = max_lines or None
+        self.repetition_limit = repetition_limit
+        self.max_block_lines = max_block_lines
+        self.stop_reason: Optional[str] = None
+        self._bytes = 0
+        self._line_count = 0
+        self._current_line = ""
+        self._lines: List[str] = []
+        self._thinking = False
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "StreamGuard":
+        return cls(max_bytes=config.get('max_output_bytes'), max_lines=config.get('max_output_lines'),
+                   repetition_limit=config.get('repetition_limit', 3) or 0)
+
+    def feed(self, chunk: str) -> Tuple[str, bool]:
+        """Returns the part of `chunk` to emit and whether the stream should stop."""
+        if self.stop_reason:
+            return "", True
+
+        if "<think>" in chunk:
+            self._thinking = True
+        if self._thinking:
+            if "</think>" in chunk:
+                self._thinking = False
+            return chunk, False
+
+        if self.max_bytes is not None:
+            encoded = chunk.encode("utf-8")
+            if self._bytes + len(encoded) > self.max_bytes:
+                allowed = encoded[:self.max_bytes - self._bytes].decode("utf-8", errors="ignore")
+                self._bytes = self.max_bytes
+                self.stop_reason = "max_bytes"
+                return allowed, True
+            self._bytes += len(encoded)
+
+        emitted = []
+        for piece in chunk.splitlines(keepends=True):
+            emitted.append(piece)
+            if not piece.endswith(("\n", "\r")):
+                self._current_line += piece
+                continue
+            line = (self._current_line + piece).strip()
+            self._current_line = ""
+            self._line_count += 1
+            if self.max_lines is not None and self._line_count >= self.max_lines:
+                self.stop_reason = "max_lines"
+                return "".join(emitted), True
+            if line and self._is_repeating(line):
+                self.stop_reason = "repetition"
+                return "".join(emitted), True
+        return "".join(emitted), False
+
+    def _is_repeating(self, line: str) -> bool:
+        self._lines.append(line)
+        limit = self.repetition_limit
+        if limit < 2:
+            return False
+        window = self.max_block_lines * limit
+        if len(self._lines) > window:
+            del self._lines[:-window]
+        for size in range(1, self.max_block_lines + 1):
+            if len(self._lines) < size * limit:
+                break
+            block = self._lines[-size:]
+            if all(self._lines[-size * (i + 1):len(self._lines) - size * i] == block for i in range(1, limit)):
+                return True
+        return False
@@ -1,32 +1,620 @@
+import gzip
+import io
 import json
+import os
+import time
+from itertools import islice
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .blobstore import BlobStore
 from .config import get_config_dir
+from .locking import append_line, file_lock
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, archives fall back to gzip
+    zstandard = None
 
+# Legacy single-file history, migrated into HISTORY_DIR on first use
 HISTORY_FILE = get_config_dir() / "history.json"
+HISTORY_DIR = get_config_dir() / "history"
+ACTIVE_FILE_NAME = "active.jsonl"
+# The active segment is renamed to this while it is being archived
+ROTATING_FILE_NAME = "rotating.jsonl"
+ARCHIVE_PREFIX = "archive-"
+# One small line per entry with its location and a preview label, newest last
+INDEX_FILE_NAME = "index.jsonl"
+# Sequence number the active segment will get when it is archived
+SEQUENCE_FILE_NAME = "sequence"
+LABEL_LENGTH = 50
+# Every change to the history directory happens while holding this lock
+LOCK_FILE_NAME = ".lock"
 
-def save_enhancement(original_prompt: str, enhanced_prompt: str, style: str, model: str):
-    """Saves a new enhancement to the history."""
-    entry = {
-        "original_prompt": original_prompt,
-        "enhanced_prompt": enhanced_prompt,
-        "style": style,
-        "model": model,
-    }
-    
-    history = load_history()
-    history.append(entry)
-    
-    with open(HISTORY_FILE, 'w') as f:
-        json.dump(history, f, indent=2)
-
-def load_history() -> List[Dict[str, Any]]:
-    """Loads the enhancement history."""
-    if not HISTORY_FILE.exists():
+DEFAULT_SEGMENT_BYTES = 1_000_000
+
+# Prompt and output bodies larger than this are stored once in the blob store and
+# referenced from entries as "<field>_ref"; smaller ones stay inline.
+BODY_FIELDS = ("original_prompt", "enhanced_prompt")
+BLOBS_DIR_NAME = "blobs"
+INLINE_MAX_BYTES = 256
+
+
+class RetentionPolicy:
+    """How much history to keep. Limits of 0 mean unlimited.
+
+    Old entries are dropped a whole archive segment at a time, so the history may hold
+    up to one segment more than a limit allows.
+    """
+
+    def __init__(self, max_entries: int = 0, max_age_days: float = 0, max_bytes: int = 0,
+                 segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "RetentionPolicy":
+        return cls(max_entries=config.get('history_max_entries', 0) or 0,
+                   max_age_days=config.get('history_max_age_days', 0) or 0,
+                   max_bytes=config.get('history_max_bytes', 0) or 0,
+                   segment_bytes=config.get('history_segment_bytes', DEFAULT_SEGMENT_BYTES) or DEFAULT_SEGMENT_BYTES)
+
+
+class Segment:
+    """A read-only, compressed archive of history entries.
+
+    The file name records everything retention needs, so it never has to be opened:
+    archive-<sequence>-<first timestamp>-<last timestamp>-<entry count>.jsonl.<gz|zst>
+    """
+
+    def __init__(self, path: Path, sequence: int, first: int, last: int, count: int):
+        self.path = path
+        self.sequence = sequence
+        self.first = first
+        self.last = last
+        self.count = count
+
+    @classmethod
+    def parse(cls, path: Path) -> Optional["Segment"]:
+        name = path.name
+        if not name.startswith(ARCHIVE_PREFIX) or not name.endswith((".jsonl.gz", ".jsonl.zst")):
+            return None
+        try:
+            sequence, first, last, count = (int(part) for part in name[len(ARCHIVE_PREFIX):].split(".")[0].split("-"))
+        except ValueError:
+            return None
+        return cls(path, sequence, first, last, count)
+
+    def open_binary(self):
+        if self.path.name.endswith(".zst"):
+            if zstandard is None:
+                raise OSError(f"Reading {self.path.name} requires the 'zstandard' package.")
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(self.path, 'rb'), closefd=True))
+        return gzip.open(self.path, 'rb')
+
+    def open(self):
+        return io.TextIOWrapper(self.open_binary(), encoding='utf-8')
+
+
+def _history_dir(history_dir: Optional[Path]) -> Path:
+    return HISTORY_DIR if history_dir is None else history_dir
+
+
+def blob_store(history_dir: Optional[Path] = None) -> BlobStore:
+    return BlobStore(_history_dir(history_dir) / BLOBS_DIR_NAME)
+
+
+def entry_refs(entry: Dict[str, Any]) -> List[str]:
+    """Returns the blob keys an entry references."""
+    return [entry[f"{field}_ref"] for field in BODY_FIELDS if f"{field}_ref" in entry]
+
+
+def resolve_entry(entry: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    """Returns the entry with referenced bodies read back from the blob store."""
+    if not entry_refs(entry):
+        return entry
+    resolved = dict(entry)
+    for field in BODY_FIELDS:
+        key = resolved.pop(f"{field}_ref", None)
+        if key is not None:
+            try:
+                resolved[field] = store.get(key)
+            except (OSError, ValueError):
+                resolved[field] = ""  # Blob lost, keep the metadata
+    return resolved
+
+
+def list_segments(history_dir: Optional[Path] = None) -> List[Segment]:
+    """Returns the archive segments, oldest first."""
+    directory = _history_dir(history_dir)
+    if not directory.is_dir():
         return []
-    
+    segments = [s for s in (Segment.parse(p) for p in directory.iterdir()) if s is not None]
+    return sorted(segments, key=lambda s: s.sequence)
+
+
+def _parse_lines(lines) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue  # A torn write only loses that one entry
+        if isinstance(entry, dict):
+            yield entry
+
+
+def _iter_file(path: Path) -> Iterator[Dict[str, Any]]:
     try:
-        with open(HISTORY_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError):
-        return []
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _parse_lines(f)
+    except FileNotFoundError:
+        return
+
+
+def _iter_segment(segment: Segment) -> Iterator[Dict[str, Any]]:
+    try:
+        with segment.open() as f:
+            yield from _parse_lines(f)
+    except FileNotFoundError:
+        return  # Removed by retention while we were reading
+
+
+def salvage_entries(text: str) -> List[Dict[str, Any]]:
+    """Recovers the intact entries of a damaged JSON array of history entries."""
+    decoder = json.JSONDecoder()
+    entries = []
+    position = text.find("{")
+    while position != -1:
+        try:
+            entry, end = decoder.raw_decode(text, position)
+        except ValueError:
+            position = text.find("{", position + 1)
+            continue
+        if isinstance(entry, dict) and "original_prompt" in entry:
+            entries.append(entry)
+        position = text.find("{", end)
+    return entries
+
+
+def _migrate_legacy(directory: Path):
+    """Moves entries from the old history.json into the active segment, once.
+
+    A file damaged by an interrupted write still gives up every complete entry.
+    The original is kept as history.json.migrated.
+    """
+    legacy = directory.parent / HISTORY_FILE.name
+    try:
+        text = legacy.read_text(encoding='utf-8')
+        timestamp = legacy.stat().st_mtime
+    except FileNotFoundError:
+        return
+    except (OSError, UnicodeDecodeError):
+        text, timestamp = "", time.time()
+    try:
+        entries = json.loads(text)
+    except ValueError:
+        entries = salvage_entries(text)
+    directory.mkdir(parents=True, exist_ok=True)
+    if isinstance(entries, list) and entries:
+        lines = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                entry.setdefault("timestamp", timestamp)
+                lines.append(json.dumps(entry, ensure_ascii=False) + "\n")
+        append_line(directory / ACTIVE_FILE_NAME, "".join(lines).encode('utf-8'))
+    os.replace(legacy, legacy.with_name(legacy.name + ".migrated"))
+
+
+def _needs_recovery(directory: Path) -> bool:
+    return ((directory.parent / HISTORY_FILE.name).exists()
+            or (directory / ROTATING_FILE_NAME).exists()
+            or (directory.is_dir() and not (directory / INDEX_FILE_NAME).exists()))
+
+
+def _recover(directory: Path):
+    """Migrates, finishes interrupted rotations and rebuilds a missing index. Needs the lock."""
+    _migrate_legacy(directory)
+    if (directory / ROTATING_FILE_NAME).exists():
+        _archive_rotating(directory)  # Finish a rotation interrupted by a crash
+    if not (directory / INDEX_FILE_NAME).exists() and directory.is_dir():
+        _rebuild_index(directory)
+
+
+def _prepare(history_dir: Optional[Path]) -> Path:
+    directory = _history_dir(history_dir)
+    if _needs_recovery(directory):
+        with file_lock(directory / LOCK_FILE_NAME):
+            _recover(directory)
+    return directory
+
+
+def _iter_entries(directory: Path, reverse: bool, since: Optional[float] = None,
+                  until: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    segments = list_segments(directory)
+    # Segment names hold their time range, so segments outside it are never opened
+    if since is not None:
+        segments = [s for s in segments if s.last + 1 > since]
+    if until is not None:
+        segments = [s for s in segments if s.first <= until]
+    sources = [lambda s=s: _iter_segment(s) for s in segments]
+    sources.append(lambda: _iter_file(directory / ACTIVE_FILE_NAME))
+    if not reverse:
+        for source in sources:
+            yield from source()
+        return
+    for source in reversed(sources):
+        yield from reversed(list(source()))
+
+
+def iter_history(history_dir: Optional[Path] = None, reverse: bool = False, resolve: bool = True,
+                 since: Optional[float] = None, until: Optional[float] = None,
+                 style: Optional[str] = None, model: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Streams history entries across archive segments and the active segment.
+
+    Entries come in storage order (oldest first), or newest first with `reverse=True`.
+    Only one segment is held in memory at a time (and only when reversing). With
+    `resolve=False` the blob store is not touched and large bodies are left as
+    "<field>_ref" keys. `since`/`until` are Unix timestamps.
+    """
+    directory = _prepare(history_dir)
+    store = blob_store(directory)
+    for entry in _iter_entries(directory, reverse, since, until):
+        if (style and entry.get("style") != style) or (model and entry.get("model") != model):
+            continue
+        timestamp = entry.get("timestamp") or 0
+        if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+            continue
+        yield resolve_entry(entry, store) if resolve else entry
+
+
+def recent_history(limit: int, history_dir: Optional[Path] = None, resolve: bool = True) -> List[Dict[str, Any]]:
+    """Returns up to `limit` of the newest entries, oldest first."""
+    entries = list(islice(iter_history(history_dir, reverse=True, resolve=resolve), limit))
+    entries.reverse()
+    return entries
+
+
+def load_history(history_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Loads the whole enhancement history. Prefer iter_history for large histories."""
+    return list(iter_history(history_dir))
+
+
+def _compressed_suffix() -> str:
+    return ".jsonl.zst" if zstandard is not None else ".jsonl.gz"
+
+
+def _active_sequence(directory: Path) -> int:
+    try:
+        stored = int((directory / SEQUENCE_FILE_NAME).read_text())
+    except (OSError, ValueError):
+        stored = 1
+    segments = list_segments(directory)
+    return max(stored, segments[-1].sequence + 1 if segments else 1)
+
+
+def _archive_rotating(directory: Path):
+    """Compresses the rotating segment into a new archive segment.
+
+    The bytes are archived unchanged, so index offsets recorded while the entries
+    were in the active segment stay valid inside the archive.
+    """
+    rotating = directory / ROTATING_FILE_NAME
+    data = rotating.read_bytes()
+    entries = list(_parse_lines(data.decode('utf-8', errors='replace').splitlines()))
+    sequence = _active_sequence(directory)
+    if entries:
+        timestamps = [int(e.get("timestamp") or 0) for e in entries]
+        name = f"{ARCHIVE_PREFIX}{sequence:08d}-{min(timestamps)}-{max(timestamps)}-{len(entries)}{_compressed_suffix()}"
+        tmp_path = directory / (name + ".tmp")
+        if zstandard is not None:
+            tmp_path.write_bytes(zstandard.ZstdCompressor(level=10).compress(data))
+        else:
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(data)
+        os.replace(tmp_path, directory / name)
+    (directory / SEQUENCE_FILE_NAME).write_text(str(sequence + 1))
+    rotating.unlink()
+
+
+def apply_retention(policy: RetentionPolicy, history_dir: Optional[Path] = None, now: Optional[float] = None):
+    """Deletes the oldest archive segments until the history fits the policy.
+
+    Blob references held by deleted entries are released and unreferenced blobs pruned.
+    """
+    directory = _history_dir(history_dir)
+    with file_lock(directory / LOCK_FILE_NAME):
+        _apply_retention(policy, directory, now)
+
+
+def _apply_retention(policy: RetentionPolicy, directory: Path, now: Optional[float] = None):
+    segments = list_segments(directory)
+    now = time.time() if now is None else now
+    store = blob_store(directory)
+    active = directory / ACTIVE_FILE_NAME
+    total_entries = sum(s.count for s in segments)
+    total_bytes = sum(s.path.stat().st_size for s in segments) + (active.stat().st_size if active.exists() else 0)
+    if policy.max_bytes:
+        total_bytes += store.total_bytes()
+    released = False
+    for segment in segments:
+        too_old = policy.max_age_days and segment.last < now - policy.max_age_days * 86400
+        too_many = policy.max_entries and total_entries - segment.count >= policy.max_entries
+        too_big = policy.max_bytes and total_bytes > policy.max_bytes
+        if not (too_old or too_many or too_big):
+            break
+        refs = [key for entry in _iter_segment(segment) for key in entry_refs(entry)]
+        size = segment.path.stat().st_size
+        segment.path.unlink()
+        store.release(refs)
+        released = released or bool(refs)
+        total_entries -= segment.count
+        total_bytes -= size
+        if too_big:
+            # Freed blob space is only known after pruning
+            store.prune()
+            total_bytes = (sum(s.path.stat().st_size for s in list_segments(directory))
+                           + (active.stat().st_size if active.exists() else 0) + store.total_bytes())
+            released = False
+    if released:
+        store.prune()
+    remaining = list_segments(directory)
+    if len(remaining) < len(segments):
+        _compact_index(directory, remaining[0].sequence if remaining else _active_sequence(directory))
+
+
+def rotate(policy: Optional[RetentionPolicy] = None, history_dir: Optional[Path] = None, force: bool = False) -> bool:
+    """Archives the active segment once it outgrows the policy's segment size."""
+    directory = _history_dir(history_dir)
+    with file_lock(directory / LOCK_FILE_NAME):
+        return _rotate(policy or RetentionPolicy(), directory, force)
+
+
+def _rotate(policy: RetentionPolicy, directory: Path, force: bool = False) -> bool:
+    active = directory / ACTIVE_FILE_NAME
+    try:
+        size = active.stat().st_size
+    except FileNotFoundError:
+        return False
+    if not force and size < policy.segment_bytes:
+        return False
+    os.replace(active, directory / ROTATING_FILE_NAME)
+    _archive_rotating(directory)
+    _apply_retention(policy, directory)
+    return True
+
+
+def save_enhancement(original_prompt: str, enhanced_prompt: str, style: str, model: str,
+                     policy: Optional[RetentionPolicy] = None, history_dir: Optional[Path] = None):
+    """Saves a new enhancement to the history.
+
+    Safe to call from several processes at once: the whole update happens under the
+    history lock, entries are appended as single lines and rewrites go through a
+    temporary file and rename. Returns the new entry's index record (see load_entry).
+    """
+    directory = _history_dir(history_dir)
+    with file_lock(directory / LOCK_FILE_NAME):
+        _recover(directory)
+        record = _append_entry(directory, blob_store(directory), _active_sequence(directory), original_prompt,
+                               enhanced_prompt, style, model, time.time())
+        _rotate(policy or RetentionPolicy(), directory)
+    return record
+
+
+def save_entries(entries: Iterable[Dict[str, Any]], policy: Optional[RetentionPolicy] = None,
+                 history_dir: Optional[Path] = None, batch_size: int = 1000) -> int:
+    """Appends existing entries (e.g. from an import), keeping their timestamps.
+
+    Entries are consumed as a stream and written in batches, each under the history
+    lock, so other processes can save in between. Returns the number saved.
+    """
+    directory = _history_dir(history_dir)
+    policy = policy or RetentionPolicy()
+    iterator = iter(entries)
+    saved = 0
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return saved
+        with file_lock(directory / LOCK_FILE_NAME):
+            _recover(directory)
+            store = blob_store(directory)
+            # Listing the segments for every entry would make an import O(entries x segments)
+            sequence = _active_sequence(directory)
+            for entry in batch:
+                _append_entry(directory, store, sequence, str(entry.get("original_prompt") or ""),
+                              str(entry.get("enhanced_prompt") or ""), entry.get("style"), entry.get("model"),
+                              float(entry.get("timestamp") or time.time()))
+                if _rotate(policy, directory):
+                    sequence = _active_sequence(directory)
+        saved += len(batch)
+
+
+def _append_entry(directory: Path, store: BlobStore, sequence: int, original_prompt: str, enhanced_prompt: str,
+                  style: Optional[str], model: Optional[str], timestamp: float) -> Dict[str, Any]:
+    """Writes one entry, its blobs and its index record, and returns the record. Needs the lock.
+
+    `sequence` is the active segment's, see _active_sequence; it only changes when the segment rotates.
+    """
+    entry: Dict[str, Any] = {}
+    for field, body in zip(BODY_FIELDS, (original_prompt, enhanced_prompt)):
+        if len(body.encode('utf-8')) > INLINE_MAX_BYTES:
+            entry[f"{field}_ref"] = store.put(body)
+        else:
+            entry[field] = body
+    entry.update({"style": style, "model": model, "timestamp": timestamp})
+
+    offset = append_line(directory / ACTIVE_FILE_NAME, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+    record = _index_record(entry, sequence, offset, original_prompt, enhanced_prompt)
+    append_line(directory / INDEX_FILE_NAME, json.dumps(record, ensure_ascii=False).encode('utf-8'))
+    return record
+
+
+def _label(original_prompt: str, enhanced_prompt: str) -> str:
+    original = " ".join(original_prompt.split())
+    enhanced = " ".join(enhanced_prompt.split())
+    if len(original) > LABEL_LENGTH:
+        original = original[:LABEL_LENGTH] + "..."
+    return f"{original} -> {enhanced[:LABEL_LENGTH]}..."
+
+
+def _index_record(entry: Dict[str, Any], sequence: int, offset: int,
+                  original_prompt: str, enhanced_prompt: str) -> Dict[str, Any]:
+    return {
+        "seg": sequence,
+        "off": offset,
+        "style": entry.get("style"),
+        "model": entry.get("model"),
+        "ts": entry.get("timestamp"),
+        "label": _label(original_prompt, enhanced_prompt),
+    }
+
+
+def _iter_offsets(lines) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    offset = 0
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            entry = None
+        if isinstance(entry, dict):
+            yield offset, entry
+        offset += len(line)
+
+
+def _write_index(directory: Path, records: Iterator[Dict[str, Any]]):
+    tmp_path = directory / f"{INDEX_FILE_NAME}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, directory / INDEX_FILE_NAME)
+
+
+def rebuild_index(history_dir: Optional[Path] = None):
+    """Recreates the index by scanning every segment, e.g. after migrating an old history."""
+    directory = _history_dir(history_dir)
+    with file_lock(directory / LOCK_FILE_NAME):
+        _rebuild_index(directory)
+
+
+def _iter_located(directory: Path) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """Yields (segment sequence, offset, raw entry) for every entry, oldest first."""
+    sources = [(s.sequence, s.path, True) for s in list_segments(directory)]
+    sources.append((_active_sequence(directory), directory / ACTIVE_FILE_NAME, False))
+    for sequence, path, compressed in sources:
+        try:
+            f = Segment.parse(path).open_binary() if compressed else open(path, 'rb')
+        except (OSError, AttributeError):
+            continue
+        with f:
+            for offset, entry in _iter_offsets(f):
+                yield sequence, offset, entry
+
+
+def iter_located(history_dir: Optional[Path] = None) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """Streams (segment sequence, offset, entry) oldest first, reading each segment once.
+
+    The sequence and offset are the "seg" and "off" of the entry's index record.
+    """
+    directory = _prepare(history_dir)
+    store = blob_store(directory)
+    for sequence, offset, entry in _iter_located(directory):
+        yield sequence, offset, resolve_entry(entry, store)
+
+
+def _rebuild_index(directory: Path):
+    store = blob_store(directory)
+
+    def records():
+        for sequence, offset, entry in _iter_located(directory):
+            full = resolve_entry(entry, store)
+            yield _index_record(entry, sequence, offset, full.get("original_prompt", ""),
+                                full.get("enhanced_prompt", ""))
+
+    _write_index(directory, records())
+
+
+def _compact_index(directory: Path, first_sequence: int):
+    """Drops index records of segments removed by retention."""
+    _write_index(directory, (r for r in _iter_file(directory / INDEX_FILE_NAME) if r.get("seg", 0) >= first_sequence))
+
+
+def _reverse_lines(path: Path, block_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yields the lines of a file from last to first, reading it backwards in blocks."""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        pending = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + pending).split(b"\n")
+            pending = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
+
+
+def iter_index(history_dir: Optional[Path] = None, style: Optional[str] = None,
+               model: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Streams index records newest first, reading only as much of the index as is consumed."""
+    directory = _prepare(history_dir)
+    for line in _reverse_lines(directory / INDEX_FILE_NAME):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict):
+            continue
+        if (style and record.get("style") != style) or (model and record.get("model") != model):
+            continue
+        yield record
+
+
+def history_page(page: int, page_size: int = 20, style: Optional[str] = None, model: Optional[str] = None,
+                 history_dir: Optional[Path] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """Returns one page of index records, newest first, and whether older records exist."""
+    start = page * page_size
+    records = list(islice(iter_index(history_dir, style, model), start, start + page_size + 1))
+    return records[:page_size], len(records) > page_size
+
+
+def load_entry(record: Dict[str, Any], history_dir: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """Reads the full entry an index record points to, or None if it no longer exists."""
+    directory = _history_dir(history_dir)
+    sequence, offset = record.get("seg"), record.get("off", 0)
+    segment = next((s for s in list_segments(directory) if s.sequence == sequence), None)
+    try:
+        if segment is not None:
+            with segment.open_binary() as f:
+                _skip(f, offset)
+                line = f.readline()
+        elif sequence == _active_sequence(directory):
+            with open(directory / ACTIVE_FILE_NAME, 'rb') as f:
+                f.seek(offset)
+                line = f.readline()
+        else:
+            return None
+        entry = json.loads(line)
+    except (OSError, ValueError):
+        return None
+    return resolve_entry(entry, blob_store(directory)) if isinstance(entry, dict) else None
+
+
+def _skip(f, count: int):
+    """Advances a forward-only (decompressing) stream by `count` bytes."""
+    while count > 0:
+        chunk = f.read(min(count, 1024 * 1024))
+        if not chunk:
+            break
+        count -= len(chunk)
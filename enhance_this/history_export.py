@@ -0,0 +1,116 @@
+import csv
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional, TextIO
+
+FORMATS = ["jsonl", "csv", "parquet"]
+FIELDS = ["timestamp", "style", "model", "original_prompt", "enhanced_prompt"]
+PARQUET_ROW_GROUP = 50000
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet support requires pyarrow. Install it with: pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def _row(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: entry.get(field) for field in FIELDS}
+
+
+def export_jsonl(entries: Iterable[Dict[str, Any]], out: TextIO) -> int:
+    count = 0
+    for entry in entries:
+        out.write(json.dumps(_row(entry), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+def export_csv(entries: Iterable[Dict[str, Any]], out: TextIO) -> int:
+    """Writes entries as CSV with ISO 8601 timestamps in UTC."""
+    writer = csv.DictWriter(out, fieldnames=FIELDS)
+    writer.writeheader()
+    count = 0
+    for entry in entries:
+        row = _row(entry)
+        if row["timestamp"] is not None:
+            row["timestamp"] = datetime.fromtimestamp(row["timestamp"], timezone.utc).isoformat().replace("+00:00", "Z")
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export_parquet(entries: Iterable[Dict[str, Any]], path: Path, row_group_size: int = PARQUET_ROW_GROUP) -> int:
+    """Writes entries to a Parquet file one row group at a time, so memory stays bounded."""
+    pa, pq = _require_pyarrow()
+    schema = pa.schema([
+        ("timestamp", pa.float64()),
+        ("style", pa.string()),
+        ("model", pa.string()),
+        ("original_prompt", pa.string()),
+        ("enhanced_prompt", pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(str(path), schema, compression="zstd") as writer:
+        columns: Dict[str, list] = {field: [] for field in FIELDS}
+        for entry in entries:
+            for field in FIELDS:
+                columns[field].append(entry.get(field))
+            count += 1
+            if len(columns["timestamp"]) >= row_group_size:
+                writer.write_table(pa.table(columns, schema=schema))
+                columns = {field: [] for field in FIELDS}
+        if columns["timestamp"] or count == 0:
+            writer.write_table(pa.table(columns, schema=schema))
+    return count
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    """Accepts epoch seconds or an ISO 8601 string. Times without a zone are read as UTC."""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    text = str(value)
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _normalize(row: Dict[str, Any]) -> Dict[str, Any]:
+    entry = {field: row.get(field) for field in FIELDS}
+    entry["timestamp"] = _parse_timestamp(entry["timestamp"])
+    return entry
+
+
+def read_entries(path: Path, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Streams entries from an export file, one row (or Parquet batch) at a time. The format defaults to the file extension."""
+    fmt = fmt or path.suffix.lstrip(".").lower()
+    if fmt == "json":
+        fmt = "jsonl"
+    if fmt == "jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield _normalize(json.loads(line))
+    elif fmt == "csv":
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                yield _normalize(row)
+    elif fmt == "parquet":
+        _, pq = _require_pyarrow()
+        parquet_file = pq.ParquetFile(str(path))
+        for batch in parquet_file.iter_batches(columns=[f for f in FIELDS if f in parquet_file.schema_arrow.names]):
+            for row in batch.to_pylist():
+                yield _normalize(row)
+    else:
+        raise ValueError(f"Unknown history format '{fmt}'. Use one of: {', '.join(FORMATS)}")
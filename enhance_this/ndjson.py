@@ -0,0 +1,58 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # orjson is optional, see the "fast" extra
+    orjson = None
+    loads = json.loads
+
+# Socket reads per iteration. Ollama streams with chunked encoding, so a read returns as
+# soon as a chunk arrives and a large size only helps when frames arrive faster than we read.
+READ_SIZE = 64 * 1024
+
+_RESPONSE_KEY = b'"response":"'
+_NOT_DONE = b'"done":false'
+
+
+def iter_lines(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Splits a stream of byte blocks into non-empty lines, without decoding them."""
+    pending = b""
+    for block in blocks:
+        if not block:
+            continue
+        if pending:
+            block = pending + block
+        lines = block.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+
+def iter_frames(response, read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """Yields the raw NDJSON lines of a streaming `requests` response."""
+    return iter_lines(response.iter_content(chunk_size=read_size))
+
+
+def decode_frame(line: bytes) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Returns the `response` text of an /api/generate frame and, when needed, the whole frame.
+
+    Intermediate frames only carry a piece of text, so when the text has no escapes it is
+    sliced straight out of the bytes and no dict is built (the second value is None).
+    Final frames, errors and anything unusual are fully parsed and returned as a dict.
+    """
+    if _NOT_DONE in line:
+        start = line.find(_RESPONSE_KEY)
+        if start != -1:
+            start += len(_RESPONSE_KEY)
+            end = line.find(b'"', start)
+            if end != -1 and line.find(b"\\", start, end) == -1:
+                return line[start:end].decode("utf-8"), None
+    data = loads(line)
+    if not isinstance(data, dict):
+        raise ValueError(f"Unexpected frame from Ollama: {line[:200]!r}")
+    return data.get("response", ""), data
@@ -2,20 +2,188 @@ import requests
 import json
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, BarColumn, TextColumn
-from typing import List, Dict, Any, Iterator
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 from requests.adapters import HTTPAdapter, Retry
+from . import ndjson
+from .config import model_options
+from .errors import DeadlineExceededError, EnhanceError, OllamaStalledError, StreamRestartError, ollama_error
+from .guards import StreamGuard
+from .resilience import Deadline, HedgePolicy, RetryPolicy, StreamTimeouts, retryable, watchdog
 import platform
+import queue
+import random
+import socket
+import threading
+import time
 
 console = Console()
 
+# How often a hedged generation checks whether to start the next request
+HEDGE_POLL_INTERVAL = 0.02
+# Retries of a first_token stall while the model's load time is unknown, see OllamaClient._generate
+COLD_LOAD_RETRIES = 1
+
+# The load_duration Ollama last reported per (host, model) in this process, in seconds
+_load_times: Dict[Tuple[str, str], float] = {}
+
+
+class GenerationCancelled(EnhanceError):
+    """Raised by generate_stream when its CancelToken is cancelled."""
+
+
+class CancelToken:
+    """Cancels an in-flight generation from any thread.
+
+    Cancelling shuts down the stream's socket, so a read that is blocked waiting
+    for Ollama returns immediately and Ollama sees the client go away and stops
+    generating.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses: List[requests.Response] = []
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            responses, self._responses = self._responses, []
+            callbacks, self._callbacks = self._callbacks, []
+        for response in responses:
+            _abort_response(response)
+        for callback in callbacks:
+            callback()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps up to `timeout` seconds, returning True early if the token is cancelled."""
+        return self._event.wait(timeout)
+
+    def _on_cancel(self, callback: Callable[[], None]):
+        """Runs `callback` when the token is cancelled, or right away if it already is."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def _attach(self, response: requests.Response):
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.append(response)
+                return
+        _abort_response(response)
+
+    def _detach(self, response: requests.Response):
+        with self._lock:
+            if response in self._responses:
+                self._responses.remove(response)
+
+
+def _abort_response(response: requests.Response) -> bool:
+    """Closes a streaming response, shutting the socket down first to wake a blocked reader.
+
+    Returns whether the socket could be shut down; otherwise a blocked read only
+    returns at its timeout.
+    """
+    raw = getattr(response, "raw", None)
+    woken = False
+    try:
+        # urllib3 2.3+ shuts the socket down for exactly this, safely from another thread
+        raw.shutdown()
+        woken = True
+    except Exception:
+        sock = getattr(getattr(raw, "connection", None), "sock", None)
+        if isinstance(sock, socket.socket):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                woken = True
+            except OSError:
+                pass
+    try:
+        response.close()
+    except Exception:
+        pass
+    return woken
+
+
+class _Sink:
+    """Receives the metrics and context of a stream that is not the client's own, see _hedged."""
+
+    def __init__(self):
+        self.last_metrics: Dict[str, Any] = {}
+        self.last_context: Optional[List[int]] = None
+
+
+def _is_overload(error: Exception) -> bool:
+    """Whether a failed request means Ollama has more work than it can take."""
+    if isinstance(error, DeadlineExceededError):
+        return False  # The enhancement ran out of time, not Ollama of capacity
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.RetryError)):
+        return True  # The session retries 503s, so exhausted retries are mostly "busy"
+    response = getattr(error, "response", None)
+    return response is not None and response.status_code == 503
+
+
 class OllamaClient:
-    def __init__(self, host: str, timeout: int):
+    def __init__(self, host: str, timeout: int, quiet: bool = False,
+                 model_profiles: Optional[Dict[str, Dict[str, Any]]] = None, coalescer=None,
+                 scheduler=None, priority: str = "default", retry_policy: Optional[RetryPolicy] = None,
+                 hedge: Optional[HedgePolicy] = None, timeouts: Optional[StreamTimeouts] = None):
         self.host = host
+        # For everything but generation, which uses the per-phase `timeouts`
         self.timeout = timeout
+        self.timeouts = timeouts or StreamTimeouts.uniform(timeout)
+        # Per-model runtime options (num_thread, num_gpu, ...), see config.model_options
+        self.model_profiles = model_profiles or {}
+        # Background callers handle errors themselves and must not print over the UI
+        self.quiet = quiet
         self.session = requests.Session()
         retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
         self.session.mount('http://', HTTPAdapter(max_retries=retries))
         self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        # Timings of the most recent generate_stream call, see _collect_metrics.
+        self.last_metrics: Dict[str, Any] = {}
+        # Token context returned with the final frame, can be passed back to
+        # generate_stream so Ollama only evaluates the new prompt text.
+        self.last_context: Optional[List[int]] = None
+        # A coalesce.SingleFlight shared by clients whose identical requests may overlap
+        self.coalescer = coalescer
+        # A scheduler.Scheduler that admits generations by priority class
+        self.scheduler = scheduler
+        self.priority = priority
+        # Generation retries and hedging, see resilience. The session's Retry only
+        # covers connecting and idempotent requests, never the /api/generate POST.
+        self.retry_policy = retry_policy
+        self.hedge = hedge
+        self._hedge_clients: Dict[str, "OllamaClient"] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], **overrides) -> "OllamaClient":
+        """Builds a client with every policy the config enables; `overrides` replace any of them.
+
+        A caller that must not coalesce, queue, retry or hedge says so with
+        e.g. `hedge=None`, so the differences between call sites stay visible.
+        """
+        # Both modules import this one
+        from .coalesce import SingleFlight
+        from .scheduler import Scheduler
+        options = {
+            "host": config['ollama_host'],
+            "timeout": config['timeout'],
+            "model_profiles": config.get('model_profiles'),
+            "coalescer": SingleFlight.from_config(config),
+            "scheduler": Scheduler.from_config(config),
+            "retry_policy": RetryPolicy.from_config(config),
+            "hedge": HedgePolicy.from_config(config),
+            "timeouts": StreamTimeouts.from_config(config),
+        }
+        options.update(overrides)
+        return cls(**options)
 
     def is_running(self) -> bool:
         try:
@@ -27,20 +195,30 @@ class OllamaClient:
         except requests.RequestException:
             return False
 
-    def list_models(self) -> List[str]:
+    def fetch_models(self) -> List[str]:
+        """Returns the installed model names, raising a typed error if Ollama fails."""
         try:
             response = self.session.get(f"{self.host}/api/tags", timeout=self.timeout)
             response.raise_for_status()
             models = response.json().get("models", [])
             return [model["name"] for model in models]
+        except requests.RequestException as e:
+            raise ollama_error(e) from e
+
+    def list_models(self) -> List[str]:
+        try:
+            return self.fetch_models()
         except requests.exceptions.ConnectionError:
-            console.print("[yellow]⚠[/yellow] Could not connect to Ollama service to list models.")
+            if not self.quiet:
+                console.print("[yellow]⚠[/yellow] Could not connect to Ollama service to list models.")
             return []
         except requests.exceptions.Timeout:
-            console.print("[yellow]⚠[/yellow] Timeout while trying to list models from Ollama.")
+            if not self.quiet:
+                console.print("[yellow]⚠[/yellow] Timeout while trying to list models from Ollama.")
             return []
         except requests.RequestException as e:
-            console.print(f"[yellow]⚠[/yellow] Error listing models from Ollama: {e}")
+            if not self.quiet:
+                console.print(f"[yellow]⚠[/yellow] Error listing models from Ollama: {e}")
             return []
 
     def download_model(self, model_name: str) -> bool:
@@ -62,9 +240,9 @@ class OllamaClient:
                 response.raise_for_status()
                 
                 total = 0
-                for line in response.iter_lines():
+                for line in ndjson.iter_frames(response):
                     if line:
-                        data = json.loads(line)
+                        data = ndjson.loads(line)
                         if "total" in data and "completed" in data:
                             if not progress.tasks[task].total:
                                 progress.update(task, total=data["total"])
@@ -90,8 +268,15 @@ class OllamaClient:
                 console.print(f"[red]✖[/red] Failed to parse response from Ollama while downloading '{model_name}'.")
                 return False
 
-    def preload_model(self, model_name: str):
-        """Sends a request to Ollama to load a model and keep it alive."""
+    def preload_model(self, model_name: str, num_ctx: Optional[int] = None):
+        """Sends a request to Ollama to load a model and keep it alive.
+
+        `num_ctx` should be the size generations will send, see `Enhancer.preload`.
+        """
+        # Load with the same runtime options generate_stream uses, or Ollama reloads it
+        options = model_options(self.model_profiles, model_name)
+        if num_ctx:
+            options.setdefault("num_ctx", num_ctx)
         try:
             console.print(f"Preloading model '{model_name}'...")
             response = self.session.post(
@@ -100,9 +285,11 @@ class OllamaClient:
                     "model": model_name,
                     "messages": [{"role": "user", "content": "Hi"}],
                     "keep_alive": -1, # Keep alive indefinitely
+                    "options": options,
                 },
                 stream=False,
-                timeout=self.timeout,
+                # Loading is what the first token of a generation waits for too
+                timeout=(self.timeouts.connect, self.timeouts.first_token),
             )
             response.raise_for_status()
             console.print(f"[green]✔[/green] Model '{model_name}' preloaded successfully.")
@@ -115,37 +302,365 @@ class OllamaClient:
         except requests.RequestException as e:
             console.print(f"[red]✖[/red] Failed to preload model '{model_name}': {e}")
 
-    def generate_stream(self, model: str, prompt: str, temperature: float, max_tokens: int) -> Iterator[str]:
+    def embed(self, model: str, texts: List[str]) -> Optional[List[List[float]]]:
+        """Returns one embedding per text, or None if Ollama could not embed them.
+
+        Uses the batched /api/embed endpoint and falls back to the older one-text
+        /api/embeddings endpoint on Ollama versions without it.
+        """
         try:
-                response = self.session.post(
-                    f"{self.host}/api/generate",
-                    json={
-                        "model": model,
-                        "prompt": prompt,
-                        "stream": True,
-                        "options": {
-                            "temperature": temperature,
-                            "num_predict": max_tokens,
-                        }
-                    },
-                    stream=True,
-                    timeout=self.timeout,
-                )
+            response = self.session.post(f"{self.host}/api/embed", json={"model": model, "input": texts},
+                                         timeout=self.timeout)
+            if response.status_code != 404:
                 response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        data = json.loads(line)
-                        yield data.get("response", "")
-                        if data.get("done"):
-                            break
-        except requests.exceptions.ConnectionError:
+                return response.json()["embeddings"]
+            embeddings = []
+            for text in texts:
+                response = self.session.post(f"{self.host}/api/embeddings", json={"model": model, "prompt": text},
+                                             timeout=self.timeout)
+                response.raise_for_status()
+                embeddings.append(response.json()["embedding"])
+            return embeddings
+        except (requests.RequestException, ValueError, KeyError) as e:
+            if not self.quiet:
+                console.print(f"[yellow]⚠[/yellow] Could not embed with '{model}': {e}\n"
+                              f"[dim]Install it with: ollama pull {model}[/dim]")
+            return None
+
+    @staticmethod
+    def _collect_metrics(sink, start: float, first_token: float, data: Dict[str, Any], queue_wait: float = 0.0):
+        """Stores client-side and Ollama-reported timings from the final stream frame on `sink`."""
+        end = time.perf_counter()
+        eval_count = data.get("eval_count") or 0
+        eval_duration = (data.get("eval_duration") or 0) / 1e9
+        sink.last_metrics = {
+            "ttft": (first_token - start) if first_token else end - start,
+            "total_time": end - start,
+            "load_time": (data.get("load_duration") or 0) / 1e9,
+            "prompt_eval_time": (data.get("prompt_eval_duration") or 0) / 1e9,
+            "prompt_eval_count": data.get("prompt_eval_count") or 0,
+            "eval_count": eval_count,
+            "eval_time": eval_duration,
+            "tokens_per_sec": (eval_count / eval_duration) if eval_duration else 0.0,
+            "queue_wait": queue_wait,
+        }
+
+    def generate_stream(self, model: str, prompt: str, temperature: float, max_tokens: int,
+                        context: Optional[List[int]] = None, system: Optional[str] = None,
+                        cancel: Optional[CancelToken] = None, stop: Optional[List[str]] = None,
+                        guard: Optional[StreamGuard] = None, num_ctx: Optional[int] = None,
+                        options: Optional[Dict[str, Any]] = None, priority: Optional[str] = None,
+                        deadline: Optional[Deadline] = None) -> Iterator[str]:
+        self.last_metrics = {}
+        priority = priority or self.priority
+        deadline = deadline or Deadline()
+        self.last_context = None
+        start = time.perf_counter()
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": True,
+            "options": {
+                **model_options(self.model_profiles, model),
+                **(options or {}),
+                "temperature": temperature,
+                "num_predict": max_tokens,
+            }
+        }
+        if num_ctx:
+            # A num_ctx pinned in the model's profile wins over the automatic size
+            payload["options"].setdefault("num_ctx", num_ctx)
+        if stop:
+            payload["options"]["stop"] = stop
+        if system:
+            payload["system"] = system
+        if context:
+            payload["context"] = context
+        if self.coalescer is None:
+            yield from self._generate(payload, cancel, guard, self, start, priority, deadline)
+            return
+        if cancel is not None and cancel.cancelled:
+            raise GenerationCancelled()
+        flight, joined = yield from self.coalescer.stream(
+            self.coalescer.key(self.host, payload, guard),
+            lambda flight: self._generate(payload, flight.cancel, guard, flight, start, priority, deadline), cancel)
+        self.last_metrics = dict(flight.last_metrics)
+        self.last_context = flight.last_context
+        if joined:
+            self.last_metrics["shared"] = True
+
+    def _generate(self, payload: Dict[str, Any], cancel: Optional[CancelToken], guard: Optional[StreamGuard],
+                  sink, start: float, priority: str, deadline: Deadline) -> Iterator[str]:
+        """Runs a generation with the guard, retry and hedge policies, leaving its metrics on `sink`.
+
+        A retry after text was already returned restarts the stream with the same
+        seed and skips what it reproduces; if the new stream diverges, the
+        generation fails with StreamRestartError rather than returning mixed text.
+        """
+        if self.retry_policy is not None and "seed" not in payload["options"]:
+            # Pinned after the coalescing key is taken, so identical requests still share
+            payload["options"]["seed"] = random.randrange(2 ** 31)
+        # The client and payload a restart goes to: the hedge that won, if any
+        source = [self, payload]
+        produced: List[str] = []
+        first_token = 0.0
+        attempt = 0
+        while True:
+            replay = "".join(produced)
+            if attempt == 0 and self.hedge is not None:
+                stream = self._hedged(payload, cancel, sink, start, priority, deadline, source)
+            else:
+                stream = source[0]._stream(source[1], cancel, sink, start, priority, deadline)
+            try:
+                for chunk in stream:
+                    if replay:
+                        if not (chunk.startswith(replay) or replay.startswith(chunk)):
+                            raise StreamRestartError("The restarted generation did not reproduce the text already returned.")
+                        chunk, replay = chunk[len(replay):], replay[len(chunk):]
+                        if not chunk:
+                            continue
+                    if chunk and not first_token:
+                        first_token = time.perf_counter()
+                    if guard is not None:
+                        chunk, should_stop = guard.feed(chunk)
+                        if should_stop:
+                            # Closing the stream closes the connection, which stops Ollama generating
+                            stream.close()
+                            if "total_time" not in sink.last_metrics:
+                                self._collect_metrics(sink, start, first_token, {},
+                                                      sink.last_metrics.get("queue_wait", 0.0))
+                            sink.last_metrics["stopped_by"] = guard.stop_reason
+                            if chunk:
+                                yield chunk
+                            return
+                    produced.append(chunk)
+                    yield chunk
+                if replay:
+                    raise StreamRestartError("The restarted generation ended before reproducing the text already returned.")
+                if first_token:
+                    sink.last_metrics["ttft"] = first_token - start
+                if attempt:
+                    sink.last_metrics["retries"] = attempt
+                return
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                attempt += 1
+                delay = self.retry_policy.delay(attempt) if self.retry_policy is not None else 0.0
+                remaining = deadline.remaining()
+                retries = self.retry_policy.retries if self.retry_policy is not None else 0
+                if (isinstance(e, OllamaStalledError) and e.phase == "first_token"
+                        and (source[0].host, source[1]["model"]) not in _load_times):
+                    # Probably a cold model load, which every resend waits through again
+                    retries = min(retries, COLD_LOAD_RETRIES)
+                if (self.retry_policy is None or attempt > retries or not retryable(e)
+                        or (remaining is not None and remaining <= delay)):
+                    self._report_generation_error(e)
+                    raise
+            finally:
+                stream.close()
+            if cancel is not None:
+                if cancel.wait(delay):
+                    raise GenerationCancelled()
+            else:
+                time.sleep(delay)
+
+    def _hedged(self, payload: Dict[str, Any], cancel: Optional[CancelToken], sink, start: float,
+                priority: str, deadline: Deadline, source: List[Any]) -> Iterator[str]:
+        """Streams from whichever of the request and its HedgePolicy alternatives answers first.
+
+        Each alternative is started once the previous ones went `hedge.after`
+        seconds without a token, or right away when one of them fails. Every
+        contender reads in its own thread; the first to produce text wins, the
+        others are cancelled and `source` is pointed at the winner for restarts.
+        """
+        pending = self.hedge.alternatives(self.host, payload)
+        events: "queue.Queue" = queue.Queue()
+        contenders: List[Any] = []
+
+        def launch(client, contender_payload):
+            index = len(contenders)
+            token, contender_sink = CancelToken(), _Sink()
+            contenders.append((client, contender_payload, token, contender_sink))
+
+            def run():
+                try:
+                    for chunk in client._stream(contender_payload, token, contender_sink, start, priority, deadline):
+                        events.put((index, "chunk", chunk))
+                    events.put((index, "done", None))
+                except BaseException as e:
+                    events.put((index, "error", e))
+            threading.Thread(target=run, name="enhance-hedge", daemon=True).start()
+
+        launch(self, payload)
+        if cancel is not None:
+            cancel._on_cancel(lambda: [contender[2].cancel() for contender in contenders])
+        hedge_at = time.monotonic() + self.hedge.after
+        winner = None
+        failures: Dict[int, BaseException] = {}
+        finished = False
+        try:
+            while True:
+                try:
+                    index, kind, value = events.get(timeout=HEDGE_POLL_INTERVAL)
+                except queue.Empty:
+                    if cancel is not None and cancel.cancelled:
+                        raise GenerationCancelled()
+                    if winner is None and pending and time.monotonic() >= hedge_at:
+                        launch(self._hedge_client(pending[0][0]), pending.pop(0)[1])
+                        hedge_at = time.monotonic() + self.hedge.after
+                    continue
+                if winner is None:
+                    if kind == "error":
+                        failures[index] = value
+                        if pending:
+                            launch(self._hedge_client(pending[0][0]), pending.pop(0)[1])
+                            hedge_at = time.monotonic() + self.hedge.after
+                        elif len(failures) == len(contenders):
+                            raise failures[0]
+                        continue
+                    if kind == "chunk" and not value:
+                        continue
+                    winner = index
+                    for other, contender in enumerate(contenders):
+                        if other != winner:
+                            contender[2].cancel()
+                    source[:] = contenders[winner][:2]
+                    sink.last_metrics = dict(contenders[winner][3].last_metrics)
+                if index != winner:
+                    continue
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    finished = True
+                    client, winner_payload, _, winner_sink = contenders[winner]
+                    sink.last_metrics = winner_sink.last_metrics
+                    sink.last_context = winner_sink.last_context
+                    if winner:
+                        sink.last_metrics["hedged"] = f"{winner_payload['model']} on {client.host}"
+                    return
+        finally:
+            if not finished:
+                for contender in contenders:
+                    contender[2].cancel()
+
+    def _hedge_client(self, host: str) -> "OllamaClient":
+        if host not in self._hedge_clients:
+            # Not from_config: retries and restarts stay with the client that hedged, which
+            # also coalesced the request already. The scheduler only limits its own host.
+            self._hedge_clients[host] = OllamaClient(
+                host, self.timeout, quiet=True, model_profiles=self.model_profiles,
+                scheduler=self.scheduler if host == self.host else None, timeouts=self.timeouts)
+        return self._hedge_clients[host]
+
+    def _stream(self, payload: Dict[str, Any], cancel: Optional[CancelToken], sink, start: float,
+                priority: str, deadline: Deadline) -> Iterator[str]:
+        """Runs one /api/generate request, leaving its metrics and context on `sink`.
+
+        The watchdog closes the connection when a phase of the request runs past
+        its limit in `self.timeouts`, and the error names that phase.
+        """
+        first_token = 0.0
+        queue_wait = 0.0
+        admitted = False
+        overloaded = False
+        response = None
+        finished = False
+        watch = None
+        try:
+            if cancel is not None and cancel.cancelled:
+                raise GenerationCancelled()
+            deadline.check()
+            if self.scheduler is not None:
+                queue_wait = self.scheduler.acquire(priority, cancel)
+                admitted = True
+                sink.last_metrics = {"queue_wait": queue_wait}
+            # Watched from after admission: waiting in the scheduler is not Ollama stalling
+            opened: List[requests.Response] = []
+            watch = watchdog.watch(self.timeouts, lambda: opened and _abort_response(opened[0]), deadline.expires)
+            # Until the headers arrive, the read timeout enforces the first token and total limits
+            response = self.session.post(
+                f"{self.host}/api/generate",
+                json=payload,
+                stream=True,
+                timeout=(deadline.timeout(self.timeouts.connect), watch.read_timeout()),
+            )
+            opened.append(response)
+            if watch.stalled:
+                _abort_response(response)
+            if cancel is not None:
+                cancel._attach(response)
+            response.raise_for_status()
+            for line in ndjson.iter_frames(response):
+                if cancel is not None and cancel.cancelled:
+                    raise GenerationCancelled()
+                deadline.check()
+                watch.progress()
+                # `data` is only built for final and unusual frames, see ndjson.decode_frame
+                chunk, data = ndjson.decode_frame(line)
+                if not first_token and chunk:
+                    first_token = time.perf_counter()
+                done = data is not None and data.get("done")
+                if done:
+                    finished = True
+                    self._collect_metrics(sink, start, first_token, data, queue_wait)
+                    sink.last_context = data.get("context")
+                    if data.get("load_duration") is not None:
+                        _load_times[(self.host, payload["model"])] = data["load_duration"] / 1e9
+                yield chunk
+                if done:
+                    break
+            if not finished and cancel is not None and cancel.cancelled:
+                # The stream ended early because cancel() shut the socket down
+                raise GenerationCancelled()
+            if not finished and watch.stalled:
+                raise OllamaStalledError(self.timeouts.message(watch.stalled), watch.stalled)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            # Reading from a socket shut down by cancel() fails in various ways
+            if cancel is not None and cancel.cancelled:
+                raise GenerationCancelled() from e
+            typed = ollama_error(e)
+            if isinstance(e, requests.exceptions.ConnectTimeout):
+                typed = OllamaStalledError(self.timeouts.message("connect"), "connect", request=e.request)
+            elif watch is not None and (watch.stalled or watch.overdue or isinstance(e, requests.exceptions.Timeout)):
+                # A read timeout mid-stream reaches us as a ConnectionError, hence `overdue`
+                phase = watch.stalled or watch.limiting_phase()
+                typed = OllamaStalledError(self.timeouts.message(phase), phase, request=getattr(e, "request", None))
+            if deadline.expired and isinstance(typed, requests.exceptions.Timeout):
+                typed = deadline.error()
+            overloaded = not isinstance(typed, DeadlineExceededError) and (_is_overload(e) or _is_overload(typed))
+            if isinstance(typed, OllamaStalledError) and typed.phase == "first_token":
+                # Waiting for the first token includes loading the model, which is not overload
+                overloaded = False
+            if typed is e:
+                raise
+            raise typed from e
+        finally:
+            if watch is not None:
+                watchdog.unwatch(watch)
+            # Closing the connection stops Ollama from generating for an abandoned stream
+            if response is not None:
+                if cancel is not None:
+                    cancel._detach(response)
+                response.close()
+            if admitted:
+                self.scheduler.release(priority, sink.last_metrics if finished else None, overloaded)
+
+    def _report_generation_error(self, error: Exception):
+        if self.quiet:
+            return
+        if isinstance(error, requests.exceptions.ConnectionError):
             console.print(f"[red]✖[/red] Connection error with Ollama service.\n"
                          f"[yellow]Please check if Ollama is running.[/yellow]")
-            raise
-        except requests.exceptions.Timeout:
-            console.print(f"[red]✖[/red] Ollama request timed out after {self.timeout} seconds.\n"
-                         f"[yellow]Try increasing the timeout in your config or using a smaller model.[/yellow]")
-            raise
-        except requests.RequestException as e:
-            console.print(f"[red]✖[/red] Error communicating with Ollama: {e}")
-            raise
\ No newline at end of file
+        elif isinstance(error, OllamaStalledError):
+            console.print(f"[red]✖[/red] {error}")
+        elif isinstance(error, requests.exceptions.Timeout):
+            console.print(f"[red]✖[/red] Ollama did not answer in time.\n"
+                         f"[yellow]Try increasing first_token_timeout (model loading) or inter_token_timeout "
+                         f"in your config, or using a smaller model.[/yellow]")
+        elif isinstance(error, requests.RequestException):
+            console.print(f"[red]✖[/red] Error communicating with Ollama: {error}")
@@ -0,0 +1,31 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from rich.table import Table
+
+
+class StageTimer:
+    """Collects wall-clock durations of the steps of a run for `enhance --profile`."""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+
+    def render(self) -> Table:
+        table = Table(title="Profile", border_style="blue")
+        table.add_column("Stage", style="cyan")
+        table.add_column("Time (ms)", justify="right")
+        for name, seconds in self.stages:
+            table.add_row(name, f"{seconds * 1000:.2f}")
+        return table
@@ -0,0 +1,252 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .errors import DeadlineExceededError, OllamaRequestError, OllamaTimeoutError, OllamaUnavailableError
+
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+# Generous, because the first token waits for the model to load
+DEFAULT_FIRST_TOKEN_TIMEOUT = 120.0
+DEFAULT_INTER_TOKEN_TIMEOUT = 30.0
+PHASES = ("connect", "first_token", "inter_token", "total")
+# The config setting that bounds each phase
+PHASE_SETTINGS = {phase: f"{phase}_timeout" for phase in PHASES}
+
+
+class Deadline:
+    """The time by which a whole enhancement must finish, across retries and hedges."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None without a deadline."""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def timeout(self, default: float) -> float:
+        """`default`, shortened to what is left of the deadline."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(0.001, min(default, remaining))
+
+    def check(self):
+        if self.expired:
+            raise self.error()
+
+    def error(self) -> DeadlineExceededError:
+        return DeadlineExceededError(f"The enhancement did not finish within its {self.seconds:g}s deadline.")
+
+
+def retryable(error: Exception) -> bool:
+    """Whether a failed generation may succeed if sent again."""
+    if isinstance(error, DeadlineExceededError):
+        return False
+    if isinstance(error, (OllamaUnavailableError, OllamaTimeoutError)):
+        return True
+    if isinstance(error, OllamaRequestError):
+        # No response means the stream broke mid-way; 4xx (e.g. unknown model) will not change
+        return error.response is None or error.response.status_code >= 500
+    return False
+
+
+class RetryPolicy:
+    """How often a failed generation is sent again, with exponential backoff and full jitter.
+
+    A stream that fails after producing text is restarted with the same seed, and
+    the text that was already returned is skipped if the new stream reproduces it.
+    No retry is attempted if its backoff would outlast the deadline.
+    """
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = MAX_BACKOFF):
+        self.retries = max(0, retries)
+        self.backoff = max(0.0, backoff)
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["RetryPolicy"]:
+        retries = config.get("generate_retries", DEFAULT_RETRIES)
+        if not retries:
+            return None
+        return cls(retries, config.get("retry_backoff", DEFAULT_BACKOFF))
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait before retry number `attempt` (from 1)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+class HedgePolicy:
+    """Sends a second request when the first is slow to produce its first token.
+
+    After `after` seconds without a token, the same request goes to the next of
+    `hosts`, or to `model` on the same host. Whichever produces a token first is
+    used and the other is cancelled.
+    """
+
+    def __init__(self, after: float, hosts: Optional[List[str]] = None, model: Optional[str] = None):
+        self.after = after
+        self.hosts = list(hosts or [])
+        self.model = model or None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["HedgePolicy"]:
+        after = config.get("hedge_after", 0)
+        hosts = config.get("hedge_hosts") or []
+        model = config.get("hedge_model") or None
+        if not after or not (hosts or model):
+            return None
+        return cls(after, hosts, model)
+
+    def alternatives(self, host: str, payload: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Returns (host, payload) pairs to hedge with, in order, skipping the primary itself."""
+        options = []
+        for other in self.hosts:
+            if other.rstrip("/") != host.rstrip("/"):
+                options.append((other, payload))
+        if self.model and self.model != payload.get("model"):
+            options.append((host, {**payload, "model": self.model}))
+        return options
+
+
+class StreamTimeouts:
+    """How long each phase of one generation request may take.
+
+    `connect` bounds opening the connection, `first_token` the wait for the
+    first frame (model load and prompt evaluation), `inter_token` every gap
+    between frames after that and `total` (None for no limit) the whole request.
+    """
+
+    def __init__(self, connect: float = DEFAULT_CONNECT_TIMEOUT, first_token: float = DEFAULT_FIRST_TOKEN_TIMEOUT,
+                 inter_token: float = DEFAULT_INTER_TOKEN_TIMEOUT, total: Optional[float] = None):
+        self.connect = connect
+        self.first_token = first_token
+        self.inter_token = inter_token
+        self.total = total or None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "StreamTimeouts":
+        first_token = config.get("first_token_timeout") or DEFAULT_FIRST_TOKEN_TIMEOUT
+        inter_token = config.get("inter_token_timeout") or DEFAULT_INTER_TOKEN_TIMEOUT
+        # `timeout` used to bound generations too; a larger one set for slow machines stays a floor
+        legacy = config.get("timeout") or 0
+        if legacy > DEFAULT_FIRST_TOKEN_TIMEOUT:
+            first_token = max(first_token, legacy)
+        if legacy > DEFAULT_INTER_TOKEN_TIMEOUT:
+            inter_token = max(inter_token, legacy)
+        return cls(config.get("connect_timeout") or DEFAULT_CONNECT_TIMEOUT, first_token, inter_token,
+                   config.get("total_timeout"))
+
+    @classmethod
+    def uniform(cls, timeout: float) -> "StreamTimeouts":
+        """One timeout for every phase, as a single `requests` timeout behaves."""
+        return cls(timeout, timeout, timeout)
+
+    def message(self, phase: str) -> str:
+        """Explains a stall in `phase` to the user."""
+        if phase == "connect":
+            return f"Could not connect to Ollama within {self.connect:g}s (connect_timeout)."
+        if phase == "first_token":
+            return (f"Ollama produced no output within {self.first_token:g}s; the model may still be loading "
+                    f"(raise first_token_timeout for large models).")
+        if phase == "inter_token":
+            return (f"Ollama stopped producing output for {self.inter_token:g}s in the middle of the generation "
+                    f"(raise inter_token_timeout on a slow machine).")
+        return f"The generation did not finish within its {self.total:g}s total_timeout."
+
+
+class Watch:
+    """The progress of one stream, see Watchdog.watch."""
+
+    def __init__(self, timeouts: StreamTimeouts, on_stall: Callable[[], None], expires: Optional[float] = None):
+        self.timeouts = timeouts
+        self.on_stall = on_stall
+        now = time.monotonic()
+        ends = [end for end in (now + timeouts.total if timeouts.total else None, expires) if end is not None]
+        self.total_end = min(ends) if ends else None
+        self.phase = "first_token"
+        self.phase_end = now + timeouts.first_token
+        # The phase that ran out of time, once the watchdog aborted the stream
+        self.stalled: Optional[str] = None
+
+    @property
+    def expires(self) -> float:
+        return min(self.phase_end, self.total_end) if self.total_end is not None else self.phase_end
+
+    @property
+    def overdue(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def limiting_phase(self) -> str:
+        """The phase whose limit runs out first from here."""
+        if self.total_end is not None and self.total_end <= self.phase_end:
+            return "total"
+        return self.phase
+
+    def read_timeout(self) -> float:
+        """Seconds a blocking read may wait before this stream has stalled."""
+        return max(0.001, self.expires - time.monotonic())
+
+    def progress(self):
+        """Records a frame from Ollama, which starts (or restarts) the inter-token limit."""
+        self.phase = "inter_token"
+        self.phase_end = time.monotonic() + self.timeouts.inter_token
+
+
+class Watchdog:
+    """One background thread that aborts streams whose current phase ran out of time.
+
+    A blocking socket read only knows a single timeout, so the limits that
+    change as a stream progresses are enforced here instead: the watchdog
+    calls the stream's `on_stall`, which closes its connection and wakes the
+    reader, and leaves the phase on `Watch.stalled` for the error message.
+    """
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self._watches: Set[Watch] = set()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, timeouts: StreamTimeouts, on_stall: Callable[[], None], expires: Optional[float] = None) -> Watch:
+        """Starts watching a stream; `expires` is an outer monotonic deadline. Pair with `unwatch`."""
+        watch = Watch(timeouts, on_stall, expires)
+        with self._condition:
+            self._watches.add(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="enhance-watchdog", daemon=True)
+                self._thread.start()
+        return watch
+
+    def unwatch(self, watch: Watch):
+        with self._condition:
+            self._watches.discard(watch)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                stalled = [watch for watch in self._watches if watch.expires <= now]
+                for watch in stalled:
+                    watch.stalled = watch.limiting_phase()
+                    self._watches.discard(watch)
+                if not stalled:
+                    # New watches do not wake the thread, so it never sleeps longer than `interval`
+                    soonest = min((watch.expires for watch in self._watches), default=now + 1.0)
+                    self._condition.wait(min(max(soonest - now, 0.0), self.interval))
+            for watch in stalled:
+                watch.on_stall()
+
+
+watchdog = Watchdog()
@@ -0,0 +1,331 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from .config import get_config_dir
+from .errors import QueueFullError
+from .ollama_client import CancelToken, GenerationCancelled
+
+# Highest priority first
+PRIORITIES = ("interactive", "default", "bulk")
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_MAX_QUEUE = 64
+# Limits learned per Ollama host, so the next process starts from them
+LIMITS_FILE = get_config_dir() / "concurrency.json"
+DEFAULT_ADAPTIVE_MAX = 16
+# Seconds a request may wait inside Ollama before the limit counts as too high
+DEFAULT_QUEUE_DELAY_TOLERANCE = 0.5
+# Multiplicative decreases after queueing inside Ollama, and after a timeout or 503
+DELAY_BACKOFF = 0.75
+OVERLOAD_BACKOFF = 0.5
+# One more concurrent request must add this much aggregate tokens/s to be kept
+MIN_THROUGHPUT_GAIN = 0.05
+# Samples to wait after stepping down before probing a higher limit again
+KNEE_HOLD_SAMPLES = 50
+# Weight of the newest sample in the aggregate throughput average
+THROUGHPUT_SMOOTHING = 0.3
+# How often queued requests check whether they were cancelled
+POLL_INTERVAL = 0.1
+
+_shared: Dict[Tuple, "Scheduler"] = {}
+_shared_lock = threading.Lock()
+
+
+class _ClassStats:
+    def __init__(self):
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queue: Deque[object] = deque()
+
+
+class AdaptiveLimit:
+    """Finds how many generations the Ollama host runs well at once.
+
+    Additive increase, multiplicative decrease: once a full limit's worth of
+    requests ran with the limit saturated, the limit goes up by one; if that extra
+    request did not raise the aggregate tokens/s (tokens/s per stream times streams)
+    by MIN_THROUGHPUT_GAIN the step is undone, as the host is past its throughput
+    knee. A request that waited inside Ollama for longer than `queue_delay_tolerance`
+    before its first token (TTFT minus our own queueing, the model load and the
+    prompt evaluation Ollama reports) cuts the limit by DELAY_BACKOFF, a timeout or
+    503 from Ollama by OVERLOAD_BACKOFF. A cut is only saved to `state_path` once a
+    second one in the same process confirms it, so a single slow or failed request
+    of a one-shot run does not lower the limit of later runs, which could not raise it.
+    """
+
+    def __init__(self, initial: int = DEFAULT_MAX_CONCURRENT, minimum: int = 1, maximum: int = DEFAULT_ADAPTIVE_MAX,
+                 queue_delay_tolerance: float = DEFAULT_QUEUE_DELAY_TOLERANCE, state_path: Optional[Path] = None,
+                 state_key: str = "", on_change: Optional[Callable[[int, int, str], None]] = None):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.queue_delay_tolerance = queue_delay_tolerance
+        self.state_path = state_path
+        self.state_key = state_key
+        # Called with (old limit, new limit, reason) whenever the limit changes
+        self.on_change = on_change
+        self.reason = "initial"
+        self.limit = self._clamp(self._load() or initial)
+        self._lock = threading.Lock()
+        self._changed_at = time.perf_counter()
+        self._samples = 0
+        self._throughput = 0.0
+        self._before_increase: Optional[float] = None
+        self._hold = 0
+        # Failures of requests that were already running when the limit was cut
+        self._overloads_to_ignore = 0
+        # Cuts for overload or queueing in this process, see _set
+        self._cuts = 0
+
+    def _clamp(self, limit: int) -> int:
+        return max(self.minimum, min(self.maximum, int(limit)))
+
+    def _load(self) -> Optional[int]:
+        if self.state_path is None:
+            return None
+        try:
+            limit = json.loads(self.state_path.read_text(encoding="utf-8")).get(self.state_key)
+        except (OSError, ValueError, AttributeError):
+            return None
+        if isinstance(limit, int):
+            self.reason = "learned earlier"
+            return limit
+        return None
+
+    def _save(self):
+        if self.state_path is None:
+            return
+        try:
+            try:
+                state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                state = {}
+            if not isinstance(state, dict):
+                state = {}
+            state[self.state_key] = self.limit
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.state_path.with_name(f"{self.state_path.name}.{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(state), encoding="utf-8")
+            os.replace(tmp_path, self.state_path)
+        except OSError:
+            pass  # Only costs relearning the limit next time
+
+    def _set(self, limit: int, reason: str, cut: bool = False):
+        old, self.limit = self.limit, self._clamp(limit)
+        self._changed_at = time.perf_counter()
+        self._samples = 0
+        self._throughput = 0.0
+        if self.limit == old:
+            return
+        self.reason = reason
+        if cut:
+            self._cuts += 1
+        if not cut or self._cuts > 1:
+            self._save()
+        if self.on_change is not None:
+            self.on_change(old, self.limit, reason)
+
+    def observe(self, inflight: int, metrics: Optional[Dict[str, Any]] = None, overloaded: bool = False,
+                waiting: bool = False) -> bool:
+        """Learns from one finished generation. Returns whether the limit changed.
+
+        `inflight` is the number of generations running when it finished, `metrics`
+        its OllamaClient.last_metrics, `overloaded` whether Ollama timed out or
+        answered 503, and `waiting` whether other requests were queued for a slot.
+        """
+        with self._lock:
+            old = self.limit
+            if overloaded:
+                if self._overloads_to_ignore:
+                    self._overloads_to_ignore -= 1
+                    return False
+                self._before_increase = None
+                self._hold = KNEE_HOLD_SAMPLES
+                self._overloads_to_ignore = inflight - 1
+                self._set(min(self.limit - 1, int(self.limit * OVERLOAD_BACKOFF)), "Ollama timed out or was busy",
+                          cut=True)
+                return self.limit != old
+            # Generations stopped by a guard carry no Ollama timings
+            if not metrics or not metrics.get("eval_count"):
+                return False
+            ollama_delay = (metrics.get("ttft", 0.0) - metrics.get("queue_wait", 0.0)
+                            - metrics.get("load_time", 0.0) - metrics.get("prompt_eval_time", 0.0))
+            started = time.perf_counter() - metrics.get("total_time", 0.0)
+            # Requests sent before the last change say nothing about the new limit
+            if ollama_delay > self.queue_delay_tolerance:
+                if started >= self._changed_at:
+                    self._before_increase = None
+                    self._hold = KNEE_HOLD_SAMPLES
+                    self._set(min(self.limit - 1, int(self.limit * DELAY_BACKOFF)),
+                              f"requests queued {ollama_delay:.1f}s inside Ollama", cut=True)
+                return self.limit != old
+            if started < self._changed_at:
+                return False
+            aggregate = metrics.get("tokens_per_sec", 0.0) * inflight
+            if aggregate:
+                self._throughput = (aggregate if not self._throughput else
+                                    THROUGHPUT_SMOOTHING * aggregate + (1 - THROUGHPUT_SMOOTHING) * self._throughput)
+            self._samples += 1
+            if self._hold:
+                self._hold -= 1
+                return False
+            # Only probe higher while there is demand beyond the current limit
+            if self._samples < max(self.limit, 3) or not (waiting or inflight >= self.limit):
+                return False
+            if self._before_increase is not None and \
+                    self._throughput < self._before_increase * (1 + MIN_THROUGHPUT_GAIN):
+                self._before_increase = None
+                self._hold = KNEE_HOLD_SAMPLES
+                self._set(self.limit - 1, "more parallel requests stopped adding throughput")
+            else:
+                self._before_increase = self._throughput
+                self._set(self.limit + 1, "Ollama kept up with more parallel requests")
+            return self.limit != old
+
+
+class Scheduler:
+    """Decides which generation talks to Ollama next when there are more than it should run.
+
+    At most `max_concurrent` generations run at once (or the current limit of an
+    AdaptiveLimit `limiter`), and at most `limits[priority]` of each priority class.
+    A class without a limit may use every slot, except bulk, which leaves one for
+    interactive requests to start right away. The rest wait in one queue of at most
+    `max_queue` requests, and a free slot goes to the oldest waiting request of the
+    highest priority class that is under its limit.
+    """
+
+    def __init__(self, max_concurrent: int = DEFAULT_MAX_CONCURRENT, limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = DEFAULT_MAX_QUEUE, limiter: Optional[AdaptiveLimit] = None):
+        self._max_concurrent = max(1, max_concurrent)
+        self.limits = {priority: max(1, limit) for priority, limit in (limits or {}).items() if priority in PRIORITIES}
+        self.max_queue = max(0, max_queue)
+        self.limiter = limiter
+        self._classes = {priority: _ClassStats() for priority in PRIORITIES}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> Optional["Scheduler"]:
+        """Returns the process-wide scheduler for the scheduler_* settings, or None if disabled."""
+        max_concurrent = config.get("scheduler_max_concurrent", DEFAULT_MAX_CONCURRENT)
+        if not max_concurrent:
+            return None
+        limits = config.get("scheduler_limits") or {}
+        adaptive = config.get("scheduler_adaptive", True)
+        host = config.get("ollama_host", "")
+        key = (max_concurrent, tuple(sorted(limits.items())), config.get("scheduler_max_queue", DEFAULT_MAX_QUEUE),
+               adaptive and (host, config.get("scheduler_adaptive_max", DEFAULT_ADAPTIVE_MAX),
+                             config.get("scheduler_queue_delay_tolerance", DEFAULT_QUEUE_DELAY_TOLERANCE)))
+        with _shared_lock:
+            if key not in _shared:
+                limiter = None
+                if adaptive:
+                    limiter = AdaptiveLimit(max_concurrent, maximum=key[3][1], queue_delay_tolerance=key[3][2],
+                                            state_path=LIMITS_FILE, state_key=host)
+                _shared[key] = cls(max_concurrent, dict(limits), key[2], limiter)
+            return _shared[key]
+
+    @property
+    def max_concurrent(self) -> int:
+        return self.limiter.limit if self.limiter is not None else self._max_concurrent
+
+    def class_limit(self, priority: str) -> int:
+        total = self.max_concurrent
+        if priority in self.limits:
+            return min(self.limits[priority], total)
+        return max(1, total - 1) if priority == "bulk" else total
+
+    def describe(self) -> str:
+        """One line about the concurrency limit, for verbose output."""
+        if self.limiter is None:
+            return f"Concurrency limit: {self.max_concurrent}"
+        return f"Concurrency limit: {self.max_concurrent} (adaptive, {self.limiter.reason})"
+
+    def _active(self) -> int:
+        return sum(stats.active for stats in self._classes.values())
+
+    def _queued(self) -> int:
+        return sum(len(stats.queue) for stats in self._classes.values())
+
+    def _next(self) -> Optional[object]:
+        """The queued ticket that may start now, if any."""
+        if self._active() >= self.max_concurrent:
+            return None
+        for priority in PRIORITIES:
+            stats = self._classes[priority]
+            # A class at its own limit lets lower classes use the spare capacity
+            if stats.queue and stats.active < self.class_limit(priority):
+                return stats.queue[0]
+        return None
+
+    def acquire(self, priority: str = "default", cancel: Optional[CancelToken] = None) -> float:
+        """Waits for a slot and returns the seconds spent waiting.
+
+        Raises QueueFullError if `max_queue` requests are already waiting, and
+        GenerationCancelled if `cancel` is cancelled while waiting.
+        """
+        if priority not in self._classes:
+            raise ValueError(f"Unknown priority '{priority}', expected one of: {', '.join(PRIORITIES)}.")
+        stats = self._classes[priority]
+        start = time.perf_counter()
+        ticket = object()
+        with self._condition:
+            stats.queue.append(ticket)
+            if self._next() is not ticket and self._queued() > self.max_queue:
+                stats.queue.pop()
+                stats.rejected += 1
+                raise QueueFullError(f"{self.max_queue} requests are already waiting for Ollama.")
+            try:
+                while self._next() is not ticket:
+                    if cancel is not None and cancel.cancelled:
+                        raise GenerationCancelled()
+                    self._condition.wait(POLL_INTERVAL)
+            except BaseException:
+                stats.queue.remove(ticket)
+                # Whoever was behind this request may be able to start now
+                self._condition.notify_all()
+                raise
+            stats.queue.popleft()
+            stats.active += 1
+            stats.admitted += 1
+            waited = time.perf_counter() - start
+            stats.wait_total += waited
+            stats.wait_max = max(stats.wait_max, waited)
+            return waited
+
+    def release(self, priority: str = "default", metrics: Optional[Dict[str, Any]] = None, overloaded: bool = False):
+        """Frees a slot taken with acquire, letting the limiter learn from the generation.
+
+        `metrics` are the finished generation's OllamaClient.last_metrics (None if it
+        did not finish), `overloaded` whether Ollama timed out or answered 503.
+        """
+        with self._condition:
+            inflight = self._active()
+            self._classes[priority].active -= 1
+            if self.limiter is not None and (metrics or overloaded):
+                self.limiter.observe(inflight, metrics, overloaded, waiting=self._queued() > 0)
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns running and queued requests, and wait times in seconds, per priority class."""
+        with self._condition:
+            classes = {}
+            for priority, stats in self._classes.items():
+                classes[priority] = {
+                    "active": stats.active,
+                    "queued": len(stats.queue),
+                    "limit": self.class_limit(priority),
+                    "admitted": stats.admitted,
+                    "rejected": stats.rejected,
+                    "wait_avg": stats.wait_total / stats.admitted if stats.admitted else 0.0,
+                    "wait_max": stats.wait_max,
+                }
+            return {"active": self._active(), "queued": self._queued(), "max_concurrent": self.max_concurrent,
+                    "adaptive": self.limiter is not None,
+                    "limit_reason": self.limiter.reason if self.limiter is not None else "configured",
+                    "max_queue": self.max_queue, "classes": classes}
@@ -0,0 +1,296 @@
+import array
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .config import get_config_dir
+from .history import iter_located, load_entry
+from .locking import file_lock
+
+try:
+    import numpy as np
+except ImportError:  # Searches fall back to a pure Python scan
+    np = None
+
+SEMANTIC_DIR = get_config_dir() / "semantic"
+HEADER_FILE_NAME = "header.json"
+VECTORS_FILE_NAME = "vectors.f32"
+# Two int64 per row: the history segment sequence and offset of the entry
+REFS_FILE_NAME = "refs.i64"
+IVF_FILE_NAME = "ivf.npz"
+LOCK_FILE_NAME = ".lock"
+
+MODES = ("off", "offer", "auto")
+DEFAULT_EMBEDDING_MODEL = "nomic-embed-text"
+DEFAULT_THRESHOLD = 0.92
+# Below this many rows a brute force scan takes a few milliseconds, so no IVF is built
+IVF_MIN_ROWS = 20000
+# Number of IVF lists scanned per query
+IVF_NPROBE = 8
+
+Ref = Tuple[int, int]
+
+
+def _normalize(vector: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class VectorIndex:
+    """Unit-length float32 embeddings in one flat file, each pointing at a history entry.
+
+    Rows are only ever appended, to `vectors.f32` and `refs.i64` under a lock. With
+    NumPy installed the vectors are memory-mapped and scanned with one matrix product;
+    without it they are scanned in pure Python. Large indexes get an inverted file
+    (IVF): rows are grouped under k-means centroids and a query only scans the groups
+    nearest to it, plus any rows added since the groups were built.
+    """
+
+    def __init__(self, directory: Path, model: str):
+        self.directory = directory
+        self.model = model
+        self.dim: Optional[int] = None
+        self._ivf = None
+        try:
+            header = json.loads((directory / HEADER_FILE_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            header = {}
+        # Vectors of another embedding model are not comparable, they are dropped on the next add
+        if isinstance(header, dict) and header.get("model") == model:
+            self.dim = header.get("dim")
+
+    def __len__(self) -> int:
+        if not self.dim:
+            return 0
+        try:
+            vectors = (self.directory / VECTORS_FILE_NAME).stat().st_size // (4 * self.dim)
+            refs = (self.directory / REFS_FILE_NAME).stat().st_size // 16
+        except FileNotFoundError:
+            return 0
+        # A writer that died between the two appends leaves one file longer
+        return min(vectors, refs)
+
+    def _reset(self, dim: int):
+        for name in (VECTORS_FILE_NAME, REFS_FILE_NAME, IVF_FILE_NAME):
+            try:
+                (self.directory / name).unlink()
+            except FileNotFoundError:
+                pass
+        tmp_path = self.directory / f"{HEADER_FILE_NAME}.{os.getpid()}.tmp"
+        tmp_path.write_text(json.dumps({"model": self.model, "dim": dim}), encoding="utf-8")
+        os.replace(tmp_path, self.directory / HEADER_FILE_NAME)
+        self.dim = dim
+        self._ivf = None
+
+    def add(self, vectors: Sequence[Sequence[float]], refs: Sequence[Ref]):
+        """Appends embeddings and the history entries they belong to."""
+        if not vectors:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.directory / LOCK_FILE_NAME):
+            if self.dim != len(vectors[0]):
+                self._reset(len(vectors[0]))
+            rows = len(self)
+            values = array.array("f")
+            for vector in vectors:
+                if len(vector) != self.dim:
+                    raise ValueError(f"Expected {self.dim} dimensions, got {len(vector)}.")
+                values.extend(_normalize(vector))
+            positions = array.array("q", [n for ref in refs for n in ref])
+            # Truncating to the common length first drops a torn row before appending
+            for name, data, width in ((VECTORS_FILE_NAME, values, 4 * self.dim), (REFS_FILE_NAME, positions, 16)):
+                with open(self.directory / name, "ab") as f:
+                    f.truncate(rows * width)
+                    f.write(data.tobytes())
+
+    def refs(self) -> List[Ref]:
+        rows = len(self)
+        positions = array.array("q")
+        try:
+            with open(self.directory / REFS_FILE_NAME, "rb") as f:
+                positions.frombytes(f.read(rows * 16))
+        except FileNotFoundError:
+            return []
+        return list(zip(positions[0::2], positions[1::2]))
+
+    def search(self, vector: Sequence[float], k: int = 10) -> List[Tuple[float, Ref]]:
+        """Returns up to `k` (cosine similarity, ref) pairs, most similar first."""
+        rows = len(self)
+        if not rows or len(vector) != self.dim:
+            return []
+        query = _normalize(vector)
+        if np is None:
+            scored = self._scan(query, rows, k)
+        else:
+            scored = self._search_numpy(np.asarray(query, dtype=np.float32), rows, k)
+        refs = self.refs()
+        return [(score, refs[row]) for score, row in scored]
+
+    def _scan(self, query: List[float], rows: int, k: int) -> List[Tuple[float, int]]:
+        values = array.array("f")
+        with open(self.directory / VECTORS_FILE_NAME, "rb") as f:
+            values.frombytes(f.read(rows * 4 * self.dim))
+        dim = self.dim
+        scores = [(sum(a * b for a, b in zip(query, values[row * dim:(row + 1) * dim])), row) for row in range(rows)]
+        scores.sort(reverse=True)
+        return scores[:k]
+
+    def _matrix(self, rows: int):
+        return np.memmap(self.directory / VECTORS_FILE_NAME, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    def _search_numpy(self, query, rows: int, k: int) -> List[Tuple[float, int]]:
+        matrix = self._matrix(rows)
+        ivf = self._load_ivf()
+        if ivf is None:
+            candidates = None
+            scores = matrix @ query
+        else:
+            centroids, order, offsets, ivf_rows = ivf
+            nearest = np.argsort(centroids @ query)[-IVF_NPROBE:]
+            parts = [order[offsets[c]:offsets[c + 1]] for c in nearest]
+            parts.append(np.arange(ivf_rows, rows))
+            candidates = np.sort(np.concatenate(parts))
+            candidates = candidates[candidates < rows]
+            scores = matrix[candidates] @ query
+        top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(float(scores[i]), int(i if candidates is None else candidates[i])) for i in top]
+
+    def _load_ivf(self):
+        if self._ivf is None:
+            try:
+                with np.load(self.directory / IVF_FILE_NAME) as data:
+                    self._ivf = (data["centroids"], data["order"], data["offsets"], int(data["rows"]))
+            except (OSError, ValueError, KeyError):
+                return None
+        return self._ivf
+
+    def needs_ivf(self) -> bool:
+        """True if the index is large enough for IVF and its lists are missing or stale."""
+        if np is None:
+            return False
+        rows = len(self)
+        if rows < IVF_MIN_ROWS:
+            return False
+        ivf = self._load_ivf()
+        return ivf is None or rows > 2 * ivf[3]
+
+    def build_ivf(self, lists: Optional[int] = None, iterations: int = 10, seed: int = 0):
+        """Clusters the vectors with spherical k-means and stores the inverted lists."""
+        if np is None:
+            raise RuntimeError("Building an IVF index requires numpy. Install it with: pip install numpy")
+        rows = len(self)
+        matrix = self._matrix(rows)
+        lists = max(1, min(rows, lists or int(math.sqrt(rows))))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, size=min(rows, lists * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            filled = norms > 0  # Empty lists keep their old centroid
+            centroids[filled] = sums[filled] / norms[filled, None]
+
+        assignment = np.empty(rows, dtype=np.int32)
+        for start in range(0, rows, 8192):
+            assignment[start:start + 8192] = np.argmax(matrix[start:start + 8192] @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+        tmp_path = self.directory / f"{IVF_FILE_NAME}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=centroids, order=order, offsets=offsets, rows=rows)
+        os.replace(tmp_path, self.directory / IVF_FILE_NAME)
+        self._ivf = None
+
+
+class SemanticCache:
+    """Finds earlier enhancements of prompts that mean the same as a new one.
+
+    Prompts are embedded with an Ollama embedding model. A hit is the most similar
+    earlier prompt of the same style whose cosine similarity reaches `threshold`.
+    """
+
+    def __init__(self, client, model: str = DEFAULT_EMBEDDING_MODEL, threshold: float = DEFAULT_THRESHOLD,
+                 directory: Optional[Path] = None, history_dir: Optional[Path] = None):
+        self.client = client
+        self.model = model
+        self.threshold = threshold
+        self.history_dir = history_dir
+        self.index = VectorIndex(directory or SEMANTIC_DIR, model)
+
+    @classmethod
+    def from_config(cls, client, config: Dict[str, Any]) -> Optional["SemanticCache"]:
+        """Returns the cache configured by `semantic_cache`, or None if it is off."""
+        if config.get("semantic_cache", "off") not in ("offer", "auto"):
+            return None
+        return cls(client, config.get("embedding_model", DEFAULT_EMBEDDING_MODEL),
+                   config.get("semantic_threshold", DEFAULT_THRESHOLD))
+
+    def embed(self, text: str) -> Optional[List[float]]:
+        vectors = self.client.embed(self.model, [text])
+        return vectors[0] if vectors else None
+
+    def lookup(self, vector: Sequence[float], style: str, k: int = 10) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """Returns (similarity, history entry) of the best earlier match, or None.
+
+        The index does not know styles, so while the `k` nearest prompts all reach the
+        threshold but none has `style`, the search is repeated with four times as many.
+        """
+        seen: Set[Ref] = set()
+        while True:
+            results = self.index.search(vector, k)
+            for score, ref in results:
+                if score < self.threshold:
+                    return None
+                if ref in seen:
+                    continue
+                seen.add(ref)
+                # Entries removed by history retention are skipped
+                entry = load_entry({"seg": ref[0], "off": ref[1]}, self.history_dir)
+                if entry and entry.get("style") == style and entry.get("enhanced_prompt"):
+                    return score, entry
+            if len(results) < k:
+                return None
+            k *= 4
+
+    def remember(self, vector: Sequence[float], record: Dict[str, Any]):
+        """Adds a prompt just saved to the history, given its index record."""
+        self.index.add([vector], [(record["seg"], record["off"])])
+
+    def sync(self, batch_size: int = 64, on_progress: Optional[Callable[[int], None]] = None) -> int:
+        """Embeds history entries that are not indexed yet and rebuilds the IVF lists if due.
+
+        Returns the number of entries added. Stops early if embedding fails.
+        """
+        known: Set[Ref] = set(self.index.refs())
+        added = 0
+        batch: List[Tuple[Ref, str]] = []
+
+        def flush() -> bool:
+            nonlocal added
+            vectors = self.client.embed(self.model, [text for _, text in batch])
+            if vectors is None:
+                return False
+            self.index.add(vectors, [ref for ref, _ in batch])
+            added += len(batch)
+            batch.clear()
+            if on_progress:
+                on_progress(added)
+            return True
+
+        for sequence, offset, entry in iter_located(self.history_dir):
+            text = entry.get("original_prompt")
+            if not text or (sequence, offset) in known:
+                continue
+            batch.append(((sequence, offset), text))
+            if len(batch) >= batch_size and not flush():
+                return added
+        if batch and not flush():
+            return added
+        if self.index.needs_ivf():
+            self.index.build_ivf()
+        return added
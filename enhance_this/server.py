@@ -0,0 +1,358 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Set, Tuple
+
+from .api import Enhancer
+from .errors import (EmptyResponseError, ModelNotFoundError, OllamaRequestError, OllamaTimeoutError,
+                     OllamaUnavailableError, QueueFullError, StreamRestartError, UnknownStyleError)
+from .ollama_client import CancelToken, GenerationCancelled
+
+MAX_BODY_BYTES = 1024 * 1024
+HEADER_TIMEOUT = 10.0
+# Chunks buffered per stream before the worker waits for the client to catch up
+STREAM_BUFFER = 64
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+               413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway",
+               503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def error_status(error: Exception) -> int:
+    """Maps an enhancement error to the HTTP status reported to the client."""
+    if isinstance(error, ModelNotFoundError):
+        return 404
+    if isinstance(error, OllamaTimeoutError):
+        return 504
+    if isinstance(error, QueueFullError):
+        return 503
+    if isinstance(error, (OllamaUnavailableError, OllamaRequestError, EmptyResponseError, StreamRestartError)):
+        return 502
+    if isinstance(error, (UnknownStyleError, ValueError)):
+        return 400
+    return 500
+
+
+def _error_body(error: Exception) -> Dict[str, str]:
+    return {"error": type(error).__name__, "message": str(error) or type(error).__name__}
+
+
+class Request:
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes,
+                 reader: Optional[asyncio.StreamReader] = None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        # The rest of the connection, read to notice the client leaving
+        self.reader = reader
+
+
+class EnhanceServer:
+    """Serves enhancements over HTTP to many clients from one machine.
+
+    Connections are handled on an asyncio event loop, so idle or slow clients cost no
+    threads. Generations run on a pool of `workers` threads, each talking to Ollama
+    through its own client; up to `max_queue` more requests wait for a free worker and the rest
+    get 503. With an adaptive scheduler the pool has room for its maximum, so the
+    adaptive limit alone decides how many generations run. Chunks flow to the client through a small buffer, so a slow reader
+    pauses its generation instead of buffering it in memory. Each request is
+    cancelled after `request_timeout` seconds or when its client disconnects.
+
+    Endpoints:
+      POST /enhance  {"prompt", "style", "model", "temperature", "max_tokens", "priority", "stream"}
+                     Streams server-sent events if the client accepts text/event-stream,
+                     NDJSON if "stream" is true, and one JSON result otherwise.
+      GET  /styles   The available styles.
+      GET  /health   Whether Ollama is reachable, the current load and the scheduler's
+                     queue depth and wait times per priority class.
+    """
+
+    def __init__(self, enhancer: Enhancer, host: str = "127.0.0.1", port: int = 8765, workers: int = 4,
+                 max_queue: int = 32, request_timeout: float = 300.0):
+        self.enhancer = enhancer
+        self.host = host
+        self.port = port
+        scheduler = getattr(enhancer, "scheduler", None)
+        if scheduler is not None and scheduler.limiter is not None:
+            workers = max(workers, scheduler.limiter.maximum)
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.request_timeout = request_timeout
+        self.active = 0
+        self.waiting = 0
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="enhance-worker")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        # One per running generation, so closing the server stops them
+        self._cancels: Set[CancelToken] = set()
+
+    async def start(self):
+        self._slots = asyncio.Semaphore(self.workers)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+        for cancel in list(self._cancels):
+            cancel.cancel()
+        self._pool.shutdown(wait=False)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), HEADER_TIMEOUT)
+                await self._route(request, writer)
+            except HTTPError as e:
+                await self._send_json(writer, e.status, {"error": STATUS_TEXT.get(e.status, "Error"),
+                                                         "message": str(e)}, e.headers)
+            except asyncio.TimeoutError:
+                await self._send_json(writer, 408, {"error": "Request Timeout", "message": "Request not received in time."})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # Client went away
+        except Exception as e:
+            try:
+                await self._send_json(writer, 500, _error_body(e))
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Request:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers are too large.")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line.")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length.")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"Request bodies are limited to {MAX_BODY_BYTES} bytes.")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method.upper(), target.split("?", 1)[0], headers, body, reader)
+
+    async def _route(self, request: Request, writer: asyncio.StreamWriter):
+        routes = {"/enhance": ("POST", self._enhance), "/styles": ("GET", self._styles), "/health": ("GET", self._health)}
+        if request.path not in routes:
+            raise HTTPError(404, f"No endpoint {request.path}.")
+        method, handler = routes[request.path]
+        if request.method != method:
+            raise HTTPError(405, f"{request.path} only accepts {method}.", {"Allow": method})
+        await handler(request, writer)
+
+    async def _styles(self, request: Request, writer: asyncio.StreamWriter):
+        await self._send_json(writer, 200, {"styles": self.enhancer.styles, "default": self.enhancer.style})
+
+    async def _health(self, request: Request, writer: asyncio.StreamWriter):
+        loop = asyncio.get_running_loop()
+        ollama = await loop.run_in_executor(None, self.enhancer.is_available)
+        await self._send_json(writer, 200 if ollama else 503, {
+            "status": "ok" if ollama else "ollama unavailable",
+            "active": self.active, "waiting": self.waiting, "workers": self.workers,
+            "scheduler": self.enhancer.scheduler.stats() if self.enhancer.scheduler else None,
+        })
+
+    def _parse(self, request: Request) -> Tuple[str, Dict[str, Any], bool]:
+        try:
+            payload = json.loads(request.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "The body must be JSON.")
+        if not isinstance(payload, dict) or not isinstance(payload.get("prompt"), str) or not payload["prompt"].strip():
+            raise HTTPError(400, "A non-empty \"prompt\" string is required.")
+        options = {key: payload[key] for key in ("style", "model", "temperature", "max_tokens")
+                   if payload.get(key) is not None}
+        # HTTP clients are usually tools, they opt in to "interactive" explicitly
+        options["priority"] = payload.get("priority") or "default"
+        return payload["prompt"], options, bool(payload.get("stream"))
+
+    async def _enhance(self, request: Request, writer: asyncio.StreamWriter):
+        prompt, options, stream_requested = self._parse(request)
+        if self.active + self.waiting >= self.workers + self.max_queue:
+            raise HTTPError(503, "The server is busy, try again shortly.", {"Retry-After": "1"})
+        sse = "text/event-stream" in request.headers.get("accept", "")
+        streaming = sse or stream_requested
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout
+
+        self.waiting += 1
+        try:
+            try:
+                # Preparing may ask Ollama for its models, so it runs off the event loop
+                # Retries and hedges then give up in time for the request timeout
+                prepared = await loop.run_in_executor(None, lambda: self.enhancer.prepare(
+                    prompt, deadline=max(deadline - loop.time(), 0.001), **options))
+            except Exception as e:
+                raise HTTPError(error_status(e), str(e))
+            try:
+                await asyncio.wait_for(self._slots.acquire(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                raise HTTPError(503, "No worker became free in time.", {"Retry-After": "1"})
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        cancel = CancelToken()
+        self._cancels.add(cancel)
+        queue: asyncio.Queue = asyncio.Queue()
+        space = threading.Semaphore(STREAM_BUFFER)
+        worker = loop.run_in_executor(self._pool, self._produce, prepared, cancel, queue, space, loop)
+
+        def release(_):
+            self.active -= 1
+            self._slots.release()
+            self._cancels.discard(cancel)
+
+        # The slot is freed when the worker thread is, not when the client is done
+        worker.add_done_callback(release)
+        gone = asyncio.ensure_future(self._disconnected(request.reader))
+        started = False
+        try:
+            while True:
+                item = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({item, gone}, timeout=max(deadline - loop.time(), 0),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if item in done:
+                    kind, value = item.result()
+                    space.release()
+                else:
+                    item.cancel()
+                    # Stop the generation before answering, the client may not wait for more
+                    cancel.cancel()
+                    if gone in done:
+                        return
+                    kind, value = "error", OllamaTimeoutError(f"The request took longer than {self.request_timeout:g}s.")
+                if not streaming:
+                    if kind == "error":
+                        await self._send_json(writer, error_status(value), _error_body(value))
+                        return
+                    if kind == "done":
+                        await self._send_json(writer, 200, value.to_dict())
+                        return
+                    continue
+                if not started:
+                    if kind == "error":
+                        # Nothing was sent yet, so the failure can still be a proper status
+                        await self._send_json(writer, error_status(value), _error_body(value))
+                        return
+                    await self._start_stream(writer, "text/event-stream" if sse else "application/x-ndjson")
+                    started = True
+                await self._send_event(writer, sse, kind, value)
+                if kind != "chunk":
+                    await self._write_chunk(writer, b"")
+                    return
+        finally:
+            gone.cancel()
+            cancel.cancel()
+
+    @staticmethod
+    async def _disconnected(reader: Optional[asyncio.StreamReader]):
+        """Returns once the client closes its connection."""
+        if reader is None:
+            await asyncio.Future()  # Never
+        try:
+            while await reader.read(4096):
+                pass  # Nothing is expected after the request, anything sent is ignored
+        except ConnectionError:
+            pass
+
+    def _produce(self, prepared, cancel: CancelToken, queue: asyncio.Queue, space: threading.Semaphore,
+                 loop: asyncio.AbstractEventLoop):
+        """Runs one generation on a worker thread, handing chunks to the event loop.
+
+        The stream is created here, so it uses this thread's Ollama client. `space`
+        counts the free places in the buffer; the event loop releases one per item.
+        """
+
+        def put(item):
+            while not space.acquire(timeout=0.5):
+                # The buffer is full because the client is slow; stop if it left
+                if cancel.cancelled:
+                    raise GenerationCancelled()
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:  # The event loop is closed, the server is gone
+                raise GenerationCancelled()
+
+        stream = None
+        try:
+            stream = self.enhancer.stream(prepared, cancel=cancel)
+            for chunk in stream:
+                if chunk:
+                    put(("chunk", chunk))
+            put(("done", stream.result))
+        except GenerationCancelled:
+            pass
+        except Exception as e:
+            if not cancel.cancelled:
+                try:
+                    put(("error", e))
+                except GenerationCancelled:
+                    pass
+        finally:
+            if stream is not None:
+                stream.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, body: Dict[str, Any],
+                         headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        head = self._head(status, {"Content-Type": "application/json", "Content-Length": str(len(data)), **(headers or {})})
+        writer.write(head + data)
+        await writer.drain()
+
+    async def _start_stream(self, writer: asyncio.StreamWriter, content_type: str):
+        writer.write(self._head(200, {"Content-Type": content_type, "Cache-Control": "no-cache",
+                                      "Transfer-Encoding": "chunked"}))
+        await writer.drain()
+
+    async def _send_event(self, writer: asyncio.StreamWriter, sse: bool, kind: str, value: Any):
+        if kind == "chunk":
+            body: Dict[str, Any] = {"text": value}
+        elif kind == "done":
+            body = value.to_dict()
+        else:
+            body = _error_body(value)
+        data = json.dumps(body, ensure_ascii=False)
+        if sse:
+            line = f"event: {kind}\ndata: {data}\n\n"
+        else:
+            line = json.dumps({"type": kind, **body}, ensure_ascii=False) + "\n"
+        await self._write_chunk(writer, line.encode("utf-8"))
+
+    async def _write_chunk(self, writer: asyncio.StreamWriter, data: bytes):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        # Waiting here is what makes a slow client slow down its generation
+        await writer.drain()
+
+    @staticmethod
+    def _head(status: int, headers: Dict[str, str]) -> bytes:
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Error')}", "Connection: close",
+                 f"Date: {time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
@@ -0,0 +1,146 @@
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional
+
+from .api import EnhancementResult, Enhancer
+from .ollama_client import CancelToken
+
+
+def _prompt_key(entry: Dict[str, Any]) -> Optional[str]:
+    # Long prompts are stored as blob references, which are equal exactly when the text is
+    return entry.get('original_prompt_ref') or entry.get('original_prompt')
+
+
+def predict_next_styles(current_style: str, available_styles: List[str],
+                        history_entries: List[Dict[str, Any]], limit: int) -> List[str]:
+    """Ranks the styles a user is most likely to switch to from `current_style`.
+
+    A switch is two consecutive history entries for the same original prompt with
+    different styles. Styles without switches fall back to overall usage, then to
+    the order of `available_styles`.
+    """
+    switches: Counter = Counter()
+    usage: Counter = Counter()
+    previous = None
+    for entry in history_entries:
+        style = entry.get('style')
+        usage[style] += 1
+        if (previous and _prompt_key(previous) == _prompt_key(entry)
+                and previous.get('style') == current_style and style != current_style):
+            switches[style] += 1
+        previous = entry
+
+    candidates = [s for s in available_styles if s != current_style]
+    order = {style: i for i, style in enumerate(candidates)}
+    candidates.sort(key=lambda s: (-switches[s], -usage[s], order[s]))
+    return candidates[:limit]
+
+
+class SpeculativeResult:
+    """Output of one background generation that can be consumed while it is still streaming."""
+
+    def __init__(self, style: str):
+        self.style = style
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        # The finished enhancement, with its Ollama context and metrics
+        self.result: Optional[EnhancementResult] = None
+        self.cancel_token = CancelToken()
+        self._condition = threading.Condition()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token.cancelled
+
+    def cancel(self):
+        self.cancel_token.cancel()
+
+    def _append(self, chunk: str):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+
+    def _finish(self, error: Optional[Exception] = None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    def stream(self) -> Iterator[str]:
+        """Yields everything generated so far, then the remaining chunks as they arrive."""
+        position = 0
+        while True:
+            with self._condition:
+                while position >= len(self.chunks) and not self.done:
+                    self._condition.wait()
+                pending = self.chunks[position:]
+                finished = self.done
+            for chunk in pending:
+                yield chunk
+            position += len(pending)
+            if finished and position >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SpeculativeGenerator:
+    """Generates likely next styles in the background while the user reads the current result.
+
+    Styles are generated one at a time on a single worker thread, so speculation adds at
+    most one extra stream to the Ollama host, and each stream is closed as soon as it is cancelled.
+    """
+
+    def __init__(self, enhancer: Enhancer):
+        # Requests are prepared and sent at "bulk" priority through this Enhancer
+        self.enhancer = enhancer
+        self.user_prompt: Optional[str] = None
+        self.results: Dict[str, SpeculativeResult] = {}
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self, user_prompt: str, styles: List[str]):
+        """Cancels any previous speculation and starts generating `styles` for `user_prompt`."""
+        self.cancel_all()
+        self.user_prompt = user_prompt
+        self.results = {style: SpeculativeResult(style) for style in styles}
+        results = list(self.results.values())
+        self._worker = threading.Thread(target=self._run, args=(user_prompt, results), daemon=True)
+        self._worker.start()
+
+    def _run(self, user_prompt: str, results: List[SpeculativeResult]):
+        for result in results:
+            if result.cancelled:
+                result._finish()
+                continue
+            stream = None
+            try:
+                # Guesses must not delay the enhancement the user is waiting for
+                request = self.enhancer.prepare(user_prompt, style=result.style, priority="bulk")
+                stream = self.enhancer.stream(request, cancel=result.cancel_token)
+                for chunk in stream:
+                    result._append(chunk)
+                result.result = stream.result
+                result._finish()
+            except Exception as e:
+                result._finish(e)
+            finally:
+                if stream is not None:
+                    stream.close()
+
+    def take(self, style: str, user_prompt: str) -> Optional[SpeculativeResult]:
+        """Returns the speculative result for `style` and cancels the others."""
+        result = self.results.get(style) if user_prompt == self.user_prompt else None
+        if result is not None and (result.cancelled or result.error is not None):
+            result = None
+        for other in self.results.values():
+            if other is not result:
+                other.cancel()
+        self.results = {}
+        return result
+
+    def cancel_all(self):
+        """Cancels all speculative streams, closing their connections to Ollama."""
+        for result in self.results.values():
+            result.cancel()
+        self.results = {}
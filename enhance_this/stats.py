@@ -0,0 +1,169 @@
+import struct
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .config import get_config_dir
+
+STATS_FILE = get_config_dir() / "stats.bin"
+
+# Fixed-size ring buffer: a small header followed by `capacity` records.
+# Header: magic, version, capacity, next slot, number of valid records.
+_MAGIC = b"ETST"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHIII")
+# Record: timestamp, ttft, total, tokens/sec, load time, model, style, host.
+_RECORD = struct.Struct("<dffff48s24s48s")
+
+DEFAULT_CAPACITY = 10000
+# Ollama reports a few milliseconds of load time even for a warm model,
+# anything above this means the model had to be loaded from disk.
+COLD_LOAD_THRESHOLD = 0.5
+
+
+def _pack_str(value: str, size: int) -> bytes:
+    return (value or "").encode("utf-8")[:size]
+
+
+def _unpack_str(value: bytes) -> str:
+    return value.rstrip(b"\x00").decode("utf-8", errors="ignore")
+
+
+def _init_file(path: Path, capacity: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, capacity, 0, 0))
+        f.truncate(_HEADER.size + capacity * _RECORD.size)
+
+
+def _read_header(f) -> Optional[Tuple[int, int, int]]:
+    f.seek(0)
+    raw = f.read(_HEADER.size)
+    if len(raw) != _HEADER.size:
+        return None
+    magic, version, capacity, next_slot, count = _HEADER.unpack(raw)
+    if magic != _MAGIC or version != _VERSION or capacity == 0:
+        return None
+    return capacity, next_slot, count
+
+
+def record_sample(model: str, style: str, host: str, ttft: float, total: float,
+                  tokens_per_sec: float, load_time: float,
+                  timestamp: Optional[float] = None,
+                  capacity: int = DEFAULT_CAPACITY,
+                  path: Optional[Path] = None):
+    """Appends a timing sample to the stats ring buffer, overwriting the oldest one when full."""
+    path = path or STATS_FILE
+    if not path.exists():
+        _init_file(path, capacity)
+
+    with open(path, "r+b") as f:
+        header = _read_header(f)
+        if header is None:
+            # Unreadable or foreign file, start a fresh buffer in place.
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, _VERSION, capacity, 0, 0))
+            f.truncate(_HEADER.size + capacity * _RECORD.size)
+            header = (capacity, 0, 0)
+        file_capacity, next_slot, count = header
+
+        record = _RECORD.pack(
+            timestamp if timestamp is not None else time.time(),
+            ttft, total, tokens_per_sec, load_time,
+            _pack_str(model, 48), _pack_str(style, 24), _pack_str(host, 48),
+        )
+        f.seek(_HEADER.size + next_slot * _RECORD.size)
+        f.write(record)
+
+        next_slot = (next_slot + 1) % file_capacity
+        count = min(count + 1, file_capacity)
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _VERSION, file_capacity, next_slot, count))
+
+
+def record_enhancement(metrics: Dict[str, Any], model: str, style: str, host: str,
+                       capacity: int = DEFAULT_CAPACITY):
+    """Records the metrics collected by `OllamaClient.generate_stream` for one enhancement."""
+    if not metrics or "total_time" not in metrics:
+        return
+    record_sample(
+        model=model,
+        style=style,
+        host=host,
+        ttft=metrics.get("ttft") or 0.0,
+        total=metrics.get("total_time") or 0.0,
+        tokens_per_sec=metrics.get("tokens_per_sec") or 0.0,
+        load_time=metrics.get("load_time") or 0.0,
+        capacity=capacity,
+    )
+
+
+def iter_samples(path: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+    """Yields the stored samples from oldest to newest."""
+    path = path or STATS_FILE
+    if not path.exists():
+        return
+
+    with open(path, "rb") as f:
+        header = _read_header(f)
+        if header is None:
+            return
+        capacity, next_slot, count = header
+        start = (next_slot - count) % capacity
+        for i in range(count):
+            slot = (start + i) % capacity
+            f.seek(_HEADER.size + slot * _RECORD.size)
+            raw = f.read(_RECORD.size)
+            if len(raw) != _RECORD.size:
+                return
+            timestamp, ttft, total, tps, load_time, model, style, host = _RECORD.unpack(raw)
+            yield {
+                "timestamp": timestamp,
+                "ttft": ttft,
+                "total_time": total,
+                "tokens_per_sec": tps,
+                "load_time": load_time,
+                "model": _unpack_str(model),
+                "style": _unpack_str(style),
+                "host": _unpack_str(host),
+            }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of `values` (0-100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summarizes samples into per model/style percentiles, a daily trend and the cold load share."""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    days: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for sample in samples:
+        groups[(sample["model"], sample["style"])].append(sample)
+        days[time.strftime("%Y-%m-%d", time.localtime(sample["timestamp"]))].append(sample)
+
+    def _stats(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ttfts = [s["ttft"] for s in group]
+        totals = [s["total_time"] for s in group]
+        return {
+            "runs": len(group),
+            "ttft": {p: percentile(ttfts, p) for p in (50, 95, 99)},
+            "total": {p: percentile(totals, p) for p in (50, 95, 99)},
+            "tokens_per_sec": percentile([s["tokens_per_sec"] for s in group], 50),
+            "cold_share": sum(1 for s in group if s["load_time"] > COLD_LOAD_THRESHOLD) / len(group),
+        }
+
+    return {
+        "runs": len(samples),
+        "cold_share": (sum(1 for s in samples if s["load_time"] > COLD_LOAD_THRESHOLD) / len(samples)) if samples else 0.0,
+        "by_model_style": {key: _stats(group) for key, group in sorted(groups.items())},
+        "trend": {day: _stats(group) for day, group in sorted(days.items())},
+    }
+
@@ -0,0 +1,76 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .api import Enhancer
+
+# Fixed user prompt, enhanced in the default style so every candidate evaluates the
+# same full-size template and generates comparable text
+SAMPLE_PROMPT = "Write a detailed prompt asking an assistant to explain how a hash map works, with examples."
+
+
+# Memory placement settings tried one at a time: every layer on the GPU, reading the
+# whole model into RAM instead of mapping it, and Ollama's reduced VRAM mode
+MEMORY_OPTIONS = ({"num_gpu": 999}, {"use_mmap": False}, {"low_vram": True})
+
+
+def candidate_options(cpu_count: Optional[int] = None,
+                      profile: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Returns the option combinations `enhance --tune` tries, starting with the current settings.
+
+    Each candidate is applied on top of the model's `profile`, and options the profile
+    already sets are not swept: they are often there to keep the model from running out
+    of memory.
+    """
+    profile = profile or {}
+    cpus = cpu_count or os.cpu_count() or 4
+    threads = sorted({max(cpus // 2, 1), cpus})
+    candidates: List[Dict[str, Any]] = [{}]
+    for num_thread in threads:
+        for num_batch in (256, 512):
+            candidates.append({"num_thread": num_thread, "num_batch": num_batch})
+    candidates.extend(dict(options) for options in MEMORY_OPTIONS)
+    swept = []
+    for options in candidates:
+        options = {key: value for key, value in options.items() if key not in profile}
+        if options not in swept and (options or not swept):
+            swept.append(options)
+    return swept
+
+
+def tune_model(enhancer: Enhancer, model: str, candidates: List[Dict[str, Any]],
+               prompt: str = SAMPLE_PROMPT, max_tokens: int = 128, runs: int = 2,
+               on_result: Optional[Callable[[Dict[str, Any], Optional[float]], None]] = None
+               ) -> List[Tuple[Dict[str, Any], Optional[float]]]:
+    """Measures how long `model` takes to answer an enhancement with each set of options.
+
+    `prompt` is enhanced in the enhancer's default style, so the measured request is
+    the one an enhancement sends, template included. A run is scored by Ollama's
+    prompt evaluation plus generation time: options such as num_batch mostly change
+    the former, and a short generation rate alone would hide it. Changing runtime
+    options makes Ollama reload the model, which is not counted. Each candidate is
+    run `runs` times and scored by its fastest run, but runs Ollama answered partly
+    from its prompt cache are skipped, since a new prompt pays for every token.
+    Returns (options, seconds) pairs, fastest first. Candidates that fail score None
+    and come last.
+    """
+    request = enhancer.prepare(prompt, model=model, temperature=0.0, max_tokens=max_tokens)
+    results: List[Tuple[Dict[str, Any], Optional[float]]] = []
+    for options in candidates:
+        request.options = options
+        best: Optional[float] = None
+        prompt_tokens = 0
+        for _ in range(runs):
+            try:
+                metrics = enhancer.stream(request).text().metrics
+            except Exception:
+                break
+            if metrics.get("prompt_eval_count", 0) < prompt_tokens:
+                continue
+            prompt_tokens = metrics.get("prompt_eval_count", 0)
+            seconds = metrics.get("prompt_eval_time", 0.0) + metrics.get("eval_time", 0.0)
+            best = seconds if best is None else min(best, seconds)
+        results.append((options, best))
+        if on_result:
+            on_result(options, best)
+    results.sort(key=lambda result: (result[1] is None, result[1] or 0.0))
+    return results
@@ -0,0 +1,160 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from enhance_this.api import Enhancer, strip_thinking
+from enhance_this.errors import (EmptyResponseError, ModelNotFoundError, OllamaTimeoutError,
+                                 OllamaUnavailableError, UnknownStyleError)
+
+
+def stream_response(*texts):
+    response = MagicMock()
+    frames = [{"response": text} for text in texts] + [{"response": "", "done": True, "eval_count": 3,
+                                                         "eval_duration": 1e9, "load_duration": 5e8,
+                                                         "context": [7, 8]}]
+    response.iter_content.return_value = iter([json.dumps(f).encode() + b"\n" for f in frames])
+    return response
+
+@pytest.fixture
+def session():
+    with patch('requests.Session') as session_class:
+        instance = MagicMock()
+        session_class.return_value = instance
+        yield instance
+
+def test_enhance_returns_result_with_timings(session):
+    session.post.return_value = stream_response("Better ", "prompt")
+    result = Enhancer(model="llama3").enhance("my prompt", style="concise")
+    assert result.enhanced_prompt == "Better prompt"
+    assert (result.style, result.model) == ("concise", "llama3")
+    assert result.timings["load"] == 0.5
+    assert result.metrics["eval_count"] == 3
+    assert set(result.to_dict()) == {"original_prompt", "enhanced_prompt", "style", "model", "timings", "metrics"}
+
+def test_enhance_stream_yields_chunks_then_result(session):
+    session.post.return_value = stream_response("a", "b")
+    stream = Enhancer(model="llama3").enhance_stream("my prompt")
+    assert list(stream) == ["a", "b", ""]
+    assert stream.result.enhanced_prompt == "ab"
+
+def test_stream_sends_one_request(session):
+    session.post.side_effect = lambda *args, **kwargs: stream_response("a", "b")
+    stream = Enhancer(model="llama3").enhance_stream("my prompt")
+    assert list(stream) == ["a", "b", ""]
+    assert stream.text().enhanced_prompt == "ab"
+    assert list(stream) == []
+    partial = Enhancer(model="llama3").enhance_stream("my prompt")
+    assert next(iter(partial)) == "a"
+    # text() drains the generation already running instead of starting another
+    assert partial.text().enhanced_prompt == "ab"
+    assert session.post.call_count == 2
+
+def test_refinement_continues_the_result_context(session):
+    session.post.return_value = stream_response("a")
+    enhancer = Enhancer(model="llama3")
+    result = enhancer.enhance("my prompt")
+    assert result.context == [7, 8]
+    session.post.return_value = stream_response("b")
+    request = enhancer.prepare("make it shorter", context=result.context)
+    # The template is already in the context, only the refinement is sent
+    assert request.system == "" and "make it shorter" in request.request_prompt
+    assert enhancer.stream(request).text().enhanced_prompt == "b"
+    assert session.post.call_args.kwargs["json"]["context"] == [7, 8]
+
+def test_preload_uses_the_context_size_of_enhancements(session):
+    enhancer = Enhancer(model="llama3", config={"ollama_host": "http://preload-test:11434"})
+    enhancer.preload()
+    preloaded = session.post.call_args.kwargs["json"]["options"]["num_ctx"]
+    assert preloaded == enhancer.prepare("write unit tests for my parser").num_ctx
+    assert preloaded == enhancer.prepare("write unit tests for my parser", style="concise").num_ctx
+
+def test_model_is_resolved_from_preferred_models(session):
+    session.get.return_value.json.return_value = {"models": [{"name": "mistral"}, {"name": "phi3"}]}
+    enhancer = Enhancer(config={"preferred_models": ["llama3", "phi3"]})
+    assert enhancer.resolve_model() == "phi3"
+    session.get.return_value.json.return_value = {"models": []}
+    with pytest.raises(ModelNotFoundError):
+        Enhancer().resolve_model()
+
+def test_connection_errors_are_typed(session):
+    session.post.side_effect = requests.exceptions.ConnectionError("refused")
+    with pytest.raises(OllamaUnavailableError) as info:
+        Enhancer(model="llama3").enhance("p")
+    assert isinstance(info.value, requests.exceptions.ConnectionError)
+    session.post.side_effect = requests.exceptions.Timeout()
+    with pytest.raises(OllamaTimeoutError):
+        # A timeout would teach the adaptive limit, which is remembered across runs
+        Enhancer(model="llama3", config={"scheduler_adaptive": False}).enhance("p")
+
+def test_missing_model_is_typed(session):
+    response = MagicMock(status_code=404)
+    session.post.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError("404", response=response)
+    with pytest.raises(ModelNotFoundError):
+        Enhancer(model="nope").enhance("p")
+
+def test_unknown_style_and_empty_output(session):
+    with pytest.raises(UnknownStyleError):
+        Enhancer(model="llama3").prepare("p", style="nope")
+    session.post.return_value = stream_response("<think>hmm</think>")
+    with pytest.raises(EmptyResponseError):
+        Enhancer(model="llama3").enhance("p")
+
+def test_enhance_many_keeps_order_and_collects_errors(session):
+    lock = threading.Lock()
+
+    def post(url, json, **kwargs):
+        with lock:
+            if "fail" in json["prompt"]:
+                raise requests.exceptions.ConnectionError("down")
+            return stream_response(json["prompt"][-12:])
+
+    session.post.side_effect = post
+    results = Enhancer(model="llama3", config={"use_system_prompt": False}).enhance_many(
+        ["first", "fail", "third"], concurrency=3, return_exceptions=True, style="concise")
+    assert isinstance(results[1], OllamaUnavailableError)
+    assert results[0].original_prompt == "first" and results[2].original_prompt == "third"
+
+def test_enhance_many_leaves_the_limit_to_the_adaptive_scheduler(session):
+    session.post.side_effect = lambda *args, **kwargs: stream_response("Better")
+    enhancer = Enhancer(model="llama3", config={"scheduler_adaptive_max": 12,
+                                                "ollama_host": "http://batch-test:11434"})
+    with patch("enhance_this.api.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pool:
+        enhancer.enhance_many(["p"] * 20)
+    assert pool.call_args.kwargs["max_workers"] == 12
+
+def test_priority_reaches_the_scheduler(session):
+    session.post.side_effect = lambda *args, **kwargs: stream_response("Better")
+    enhancer = Enhancer(model="llama3", config={"scheduler_max_concurrent": 1, "scheduler_max_queue": 4})
+    with patch.object(enhancer.scheduler, "acquire", return_value=0.25) as acquire, \
+            patch.object(enhancer.scheduler, "release"):
+        result = enhancer.enhance("p")
+        enhancer.enhance_many(["q"])
+    assert [call.args[0] for call in acquire.call_args_list] == ["interactive", "bulk"]
+    assert result.timings["queue"] == 0.25
+    with pytest.raises(ValueError):
+        enhancer.prepare("p", priority="urgent")
+
+def test_no_side_effects_unless_asked(session):
+    session.post.return_value = stream_response("text")
+    with patch('enhance_this.history.save_enhancement') as save, \
+         patch('enhance_this.clipboard.copy_to_clipboard') as copy:
+        Enhancer(model="llama3").enhance("p")
+        save.assert_not_called()
+        copy.assert_not_called()
+        session.post.return_value = stream_response("text")
+        Enhancer(model="llama3", save_history=True, copy=True).enhance("p")
+        save.assert_called_once()
+        copy.assert_called_once()
+
+def test_template_errors_are_collected_not_printed(tmp_path, capsys):
+    enhancer = Enhancer(config={"enhancement_templates": {"mine": str(tmp_path / "missing.txt")}})
+    assert "mine" in enhancer.template_errors[0]
+    assert capsys.readouterr().out == ""
+
+def test_strip_thinking():
+    assert strip_thinking("<think>plan</think>\nAnswer") == "Answer"
+    assert strip_thinking("<think>unfinished") == ""
@@ -0,0 +1,34 @@
+from enhance_this.blobstore import BlobStore
+
+
+def test_put_get_roundtrip(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    key = store.put("héllo " * 50)
+    assert store.get(key) == "héllo " * 50
+    assert key == BlobStore.key("héllo " * 50)
+
+def test_same_text_is_stored_once_and_counted(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    key = store.put("text")
+    assert store.put("text") == key
+    counts, sizes = store.usage()
+    assert counts == {key: 2}
+    assert sizes[key] > 0
+    assert store.total_bytes() == sizes[key]
+
+def test_prune_deletes_only_unreferenced_blobs(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    kept = store.put("kept")
+    dropped = store.put("dropped")
+    store.put("kept")
+    store.release([kept, dropped])
+    assert store.prune() == 1
+    assert store.get(kept) == "kept"
+    assert store.usage()[0] == {kept: 1}
+
+def test_torn_journal_line_is_ignored(tmp_path):
+    store = BlobStore(tmp_path / "blobs")
+    key = store.put("text")
+    with open(store.refs_path, "a") as f:
+        f.write("+1 abc")
+    assert store.usage()[0] == {key: 1}
@@ -25,3 +25,81 @@ def test_copy_to_clipboard_failure(mock_pyperclip_copy, mock_console_print):
     clipboard.copy_to_clipboard(test_text)
     mock_pyperclip_copy.assert_called_once_with(test_text)
     mock_console_print.assert_called_once_with("[yellow]⚠[/yellow] Could not copy to clipboard. `xclip` or `xsel` may be required on Linux.")
+
+@pytest.fixture
+def backend_cache(tmp_path, monkeypatch):
+    cache_file = tmp_path / "clipboard_backend"
+    monkeypatch.setattr(clipboard, "BACKEND_CACHE_FILE", cache_file)
+    return cache_file
+
+def test_detect_backend_prefers_osc52_over_ssh(monkeypatch):
+    monkeypatch.setattr(clipboard.platform, "system", lambda: "Linux")
+    monkeypatch.setenv("SSH_TTY", "/dev/pts/1")
+    monkeypatch.setattr(clipboard, "_terminal_available", lambda: True)
+    assert clipboard.detect_backend() == "osc52"
+
+@pytest.mark.parametrize("env, expected", [({"TERM": "xterm-256color"}, None), ({"TERM": "xterm-kitty"}, "osc52"),
+                                           ({"TERM_PROGRAM": "WezTerm"}, "osc52"), ({"TMUX": "/tmp/tmux"}, "osc52")])
+def test_detect_backend_only_picks_osc52_locally_in_known_terminals(monkeypatch, env, expected):
+    monkeypatch.setattr(clipboard.platform, "system", lambda: "Linux")
+    for name in ("SSH_TTY", "SSH_CONNECTION", "WAYLAND_DISPLAY", "TMUX", "KITTY_WINDOW_ID", "TERM_PROGRAM"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("DISPLAY", ":0")
+    monkeypatch.setenv("TERM", "dumb")
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(clipboard.shutil, "which", lambda name: None)
+    monkeypatch.setattr(clipboard, "_terminal_available", lambda: True)
+    # Without xclip or xsel, a terminal that may ignore OSC 52 gets the install warning instead
+    assert clipboard.detect_backend() == expected
+
+def test_detect_backend_wayland(monkeypatch):
+    monkeypatch.setattr(clipboard.platform, "system", lambda: "Linux")
+    monkeypatch.delenv("SSH_TTY", raising=False)
+    monkeypatch.delenv("SSH_CONNECTION", raising=False)
+    monkeypatch.setenv("WAYLAND_DISPLAY", "wayland-0")
+    monkeypatch.setattr(clipboard.shutil, "which", lambda name: "/usr/bin/" + name)
+    assert clipboard.detect_backend() == "wl-copy"
+
+def test_resolve_backend_is_cached(backend_cache, monkeypatch):
+    monkeypatch.setattr(clipboard, "detect_backend", lambda: "xclip")
+    assert clipboard.resolve_backend("auto") == "xclip"
+
+    monkeypatch.setattr(clipboard, "detect_backend", lambda: pytest.fail("should use the cache"))
+    assert clipboard.resolve_backend("auto") == "xclip"
+
+def test_background_copy_reports_on_wait(mock_pyperclip_copy, mock_console_print):
+    clipboard.copy_to_clipboard("text", background=True)
+    clipboard.wait_for_clipboard(timeout=1.0)
+    mock_pyperclip_copy.assert_called_once_with("text")
+    mock_console_print.assert_called_once_with("[green]✔ Enhanced prompt copied to clipboard.[/green]")
+
+def test_osc52_copy_writes_escape_sequence(monkeypatch):
+    written = []
+    monkeypatch.delenv("TMUX", raising=False)
+
+    class FakeTty:
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            pass
+        def write(self, data):
+            written.append(data)
+        def flush(self):
+            pass
+
+    monkeypatch.setattr("builtins.open", lambda *args, **kwargs: FakeTty())
+    clipboard._osc52_copy("hi")
+    assert written == ["\033]52;c;aGk=\a"]
+
+@pytest.mark.parametrize("backend, advice", [("osc52", "OSC 52"), ("wl-copy", "wl-clipboard"), (None, "no clipboard backend")])
+def test_failure_advice_names_the_backend_that_failed(mock_console_print, backend_cache, monkeypatch, backend, advice):
+    def fail(*args):
+        raise clipboard.pyperclip.PyperclipException("failed")
+
+    monkeypatch.setattr(clipboard.platform, "system", lambda: "Linux")
+    monkeypatch.setattr(clipboard, "_copy_with_backend", fail)
+    monkeypatch.setattr(clipboard, "resolve_backend", lambda name: backend)
+    assert not clipboard.copy_to_clipboard("text", backend="auto")
+    message = mock_console_print.call_args.args[0]
+    assert advice in message and "xclip` or `xsel" not in message
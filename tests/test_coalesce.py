@@ -0,0 +1,277 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from enhance_this.coalesce import SingleFlight, request_key
+from enhance_this.errors import OllamaTimeoutError
+from enhance_this.ollama_client import CancelToken, GenerationCancelled, OllamaClient
+
+
+def _generation(chunks, calls, gate=None):
+    """A start() function yielding `chunks`, waiting on `gate` before each one."""
+
+    def start(flight):
+        calls.append(flight)
+        for chunk in chunks:
+            if gate is not None:
+                gate.wait(5)
+            if flight.cancel.cancelled:
+                raise GenerationCancelled()
+            yield chunk
+        flight.last_metrics = {"eval_count": len(chunks)}
+    return start
+
+
+def _consume(stream, out, index):
+    try:
+        out[index] = list(stream)
+    except Exception as e:
+        out[index] = e
+
+
+def test_request_key_depends_on_payload_and_guard():
+    payload = {"model": "m", "prompt": "p", "options": {"temperature": 0.7}}
+    guard = MagicMock(max_bytes=10, max_lines=5, repetition_limit=3, max_block_lines=2)
+    assert request_key("http://h", payload) == request_key("http://h", dict(payload))
+    assert request_key("http://h", payload) != request_key("http://h", {**payload, "prompt": "q"})
+    assert request_key("http://h", payload) != request_key("http://other", payload)
+    assert request_key("http://h", payload) != request_key("http://h", payload, guard)
+
+
+def test_concurrent_identical_requests_share_one_generation():
+    flights = SingleFlight()
+    calls = []
+    gate = threading.Event()
+    start = _generation(["a", "b", "c"], calls, gate)
+    results = [None] * 4
+    threads = [threading.Thread(target=_consume, args=(flights.stream("k", start), results, i)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert results == [["a", "b", "c"]] * 4
+    assert not flights._flights
+
+
+def test_late_subscriber_replays_earlier_chunks():
+    flights = SingleFlight()
+    calls = []
+    start = _generation(["a", "b", "c"], calls)
+    first = flights.stream("k", start)
+    assert next(first) == "a"
+    second = flights.stream("k", start)
+    assert list(second) == ["a", "b", "c"]
+    assert list(first) == ["b", "c"]
+    assert len(calls) == 1
+
+
+def test_different_keys_do_not_share():
+    flights = SingleFlight()
+    calls = []
+    assert list(flights.stream("k1", _generation(["a"], calls))) == ["a"]
+    assert list(flights.stream("k2", _generation(["b"], calls))) == ["b"]
+    assert len(calls) == 2
+
+
+def test_finished_generation_is_not_reused():
+    flights = SingleFlight()
+    calls = []
+    start = _generation(["a"], calls)
+    assert list(flights.stream("k", start)) == ["a"]
+    assert list(flights.stream("k", start)) == ["a"]
+    assert len(calls) == 2
+
+
+def test_stream_returns_flight_and_whether_it_joined():
+    flights = SingleFlight()
+    start = _generation(["a", "b"], [])
+
+    def result(stream):
+        try:
+            while True:
+                next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+    first = flights.stream("k", start)
+    next(first)
+    second = flights.stream("k", start)
+    next(second)
+    flight, joined = result(first)
+    assert flight.last_metrics == {"eval_count": 2} and not joined
+    assert result(second) == (flight, True)
+
+
+def test_cancelling_one_subscriber_keeps_the_others():
+    flights = SingleFlight()
+    calls = []
+    start = _generation(["a", "b", "c"], calls)
+    token = CancelToken()
+    first = flights.stream("k", start, token)
+    second = flights.stream("k", start)
+    assert next(first) == "a"
+    assert next(second) == "a"
+    token.cancel()
+    with pytest.raises(GenerationCancelled):
+        next(first)
+    assert list(second) == ["b", "c"]
+    assert not calls[0].cancel.cancelled
+
+
+def test_cancelled_subscriber_returns_while_a_chunk_is_pending():
+    flights = SingleFlight()
+    calls = []
+    gate = threading.Event()
+    token = CancelToken()
+    first = flights.stream("k", _generation(["a", "b"], calls, gate), token)
+    second = flights.stream("k", _generation(["a", "b"], calls, gate))
+    results = [None, None]
+    threads = [threading.Thread(target=_consume, args=(stream, results, i)) for i, stream in enumerate((first, second))]
+    threads[0].start()
+    time.sleep(0.1)
+    threads[1].start()
+    time.sleep(0.1)
+    # The first subscriber is reading the first chunk; cancelling it returns at once
+    token.cancel()
+    threads[0].join(1)
+    assert isinstance(results[0], GenerationCancelled)
+    gate.set()
+    threads[1].join(5)
+    assert results[1] == ["a", "b"]
+    assert len(calls) == 1 and not calls[0].cancel.cancelled
+
+
+def test_one_pump_thread_reads_the_whole_generation():
+    flights = SingleFlight()
+    readers = set()
+
+    def start(flight):
+        for i in range(200):
+            readers.add(threading.current_thread())
+            yield str(i)
+
+    chunks = list(flights.stream("k", start, CancelToken()))
+    assert len(chunks) == 200
+    assert len(readers) == 1 and next(iter(readers)).name == "coalesce-pump"
+
+
+def test_cancelling_the_only_subscriber_cancels_the_generation():
+    flights = SingleFlight()
+    calls = []
+    token = CancelToken()
+    stream = flights.stream("k", _generation(["a", "b"], calls), token)
+    assert next(stream) == "a"
+    token.cancel()
+    assert calls[0].cancel.cancelled
+    with pytest.raises(GenerationCancelled):
+        next(stream)
+
+
+def test_closing_the_last_subscriber_closes_the_generation():
+    flights = SingleFlight()
+    calls = []
+    stream = flights.stream("k", _generation(["a", "b"], calls))
+    assert next(stream) == "a"
+    stream.close()
+    assert calls[0].cancel.cancelled
+    assert not flights._flights
+
+
+def test_errors_reach_every_subscriber():
+    flights = SingleFlight()
+
+    def start(flight):
+        yield "a"
+        raise OllamaTimeoutError("slow")
+
+    first = flights.stream("k", start)
+    second = flights.stream("k", start)
+    assert next(first) == "a"
+    with pytest.raises(OllamaTimeoutError):
+        list(first)
+    with pytest.raises(OllamaTimeoutError):
+        list(second)
+
+
+def test_spool_is_written_and_removed_by_the_leader(tmp_path):
+    flights = SingleFlight(tmp_path)
+    stream = flights.stream("k", _generation(["a", "b"], []))
+    assert next(stream) == "a"
+    lines = (tmp_path / "k.spool").read_text(encoding="utf-8").splitlines()
+    assert json.loads(lines[0]) == {"chunk": "a"}
+    assert list(stream) == ["b"]
+    assert not (tmp_path / "k.spool").exists()
+
+
+def test_other_process_follows_the_spool(tmp_path):
+    leader, follower = SingleFlight(tmp_path), SingleFlight(tmp_path)
+    calls = []
+    start = _generation(["a", "b", "c"], calls)
+    lead = leader.stream("k", start)
+    # The suspended leader holds the spool lock, so the follower tails its file
+    assert next(lead) == "a"
+    follow = follower.stream("k", start)
+    assert next(follow) == "a"
+    assert list(lead) == ["b", "c"]
+
+    def result(stream):
+        chunks = []
+        try:
+            while True:
+                chunks.append(next(stream))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+    chunks, (flight, joined) = result(follow)
+    assert chunks == ["b", "c"]
+    assert joined and flight.last_metrics == {"eval_count": 3}
+    assert len(calls) == 1
+
+
+def test_follower_generates_itself_if_the_leader_left_nothing(tmp_path):
+    # A leftover spool of a crashed process holds no lock and no output
+    (tmp_path / "k.spool").write_text("", encoding="utf-8")
+    calls = []
+    assert list(SingleFlight(tmp_path).stream("k", _generation(["a"], calls))) == ["a"]
+    assert len(calls) == 1
+
+
+def test_from_config_returns_a_shared_instance_per_mode():
+    assert SingleFlight.from_config({"coalesce": "off"}) is None
+    process = SingleFlight.from_config({"coalesce": "process"})
+    assert process is SingleFlight.from_config({"coalesce": "process"})
+    assert process.spool_dir is None
+    assert SingleFlight.from_config({"coalesce": "machine"}).spool_dir is not None
+
+
+def test_client_marks_joined_generations_as_shared():
+    flights = SingleFlight()
+    clients = [OllamaClient(host="http://localhost:11434", timeout=5, quiet=True, coalescer=flights) for _ in range(2)]
+    response = MagicMock()
+    response.iter_content.return_value = [
+        b'{"response": "Hi", "done": false}\n',
+        b'{"response": "", "done": true, "eval_count": 1, "context": [1, 2]}\n',
+    ]
+    response.raise_for_status.return_value = None
+    for client in clients:
+        client.session = MagicMock()
+        client.session.post.return_value = response
+
+    first = clients[0].generate_stream("m", "p", 0.7, 10)
+    assert next(first) == "Hi"
+    second = clients[1].generate_stream("m", "p", 0.7, 10)
+    assert "".join(second) == "Hi"
+    list(first)
+
+    assert clients[0].session.post.call_count == 1
+    assert clients[1].session.post.call_count == 0
+    assert clients[1].last_context == [1, 2]
+    assert clients[1].last_metrics["shared"] is True
+    assert "shared" not in clients[0].last_metrics
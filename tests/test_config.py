@@ -3,6 +3,7 @@ import os
 import yaml
 from pathlib import Path
 from enhance_this import config
+from enhance_this.errors import ConfigError
 
 @pytest.fixture
 def mock_config_path(tmp_path):
@@ -11,11 +12,12 @@ def mock_config_path(tmp_path):
     test_config_dir.mkdir()
     test_config_file = test_config_dir / "config.yaml"
     
-    # Patch get_config_path to return our temporary path
-    original_get_config_path = config.get_config_path
+    # Patch get_config_path to return our temporary path, and keep caches out of the real home
+    original_get_config_path, original_get_config_dir = config.get_config_path, config.get_config_dir
     config.get_config_path = lambda *args, **kwargs: test_config_file
+    config.get_config_dir = lambda: test_config_dir
     yield test_config_file
-    config.get_config_path = original_get_config_path # Restore original
+    config.get_config_path, config.get_config_dir = original_get_config_path, original_get_config_dir
 
 def test_create_default_config_if_not_exists(mock_config_path):
     # Ensure config file does not exist initially
@@ -59,3 +61,88 @@ def test_load_config_with_invalid_file(mock_config_path):
     # Should fall back to default config
     assert loaded_config["default_temperature"] == 0.7
     assert loaded_config["ollama_host"] == "http://localhost:11434"
+
+def test_load_config_uses_cache_until_file_changes(mock_config_path, monkeypatch):
+    mock_config_path.write_text(yaml.dump({"default_temperature": 0.9}))
+    assert config.load_config()["default_temperature"] == 0.9
+    assert len(list((mock_config_path.parent / "config_cache").iterdir())) == 1
+
+    # A cache hit must not parse YAML at all
+    monkeypatch.setattr(config, "read_config_file", lambda path: pytest.fail("config was re-parsed"))
+    assert config.load_config()["default_temperature"] == 0.9
+    monkeypatch.undo()
+
+    mock_config_path.write_text(yaml.dump({"default_temperature": 1.25}))
+    assert config.load_config()["default_temperature"] == 1.25
+
+def test_load_config_env_overrides(mock_config_path, monkeypatch):
+    monkeypatch.setenv("ENHANCE_OLLAMA_HOST", "http://ci:11434")
+    monkeypatch.setenv("ENHANCE_TIMEOUT", "90")
+    monkeypatch.setenv("ENHANCE_AUTO_COPY", "false")
+    monkeypatch.setenv("ENHANCE_PREFERRED_MODELS", "phi3, qwen2")
+
+    loaded_config = config.load_config()
+    assert loaded_config["ollama_host"] == "http://ci:11434"
+    assert loaded_config["timeout"] == 90
+    assert loaded_config["auto_copy"] is False
+    assert loaded_config["preferred_models"] == ["phi3", "qwen2"]
+
+def test_load_config_skips_file_system(mock_config_path, monkeypatch):
+    mock_config_path.write_text(yaml.dump({"default_temperature": 0.9}))
+    monkeypatch.setenv("ENHANCE_NO_CONFIG_FILE", "1")
+    monkeypatch.setenv("ENHANCE_DEFAULT_STYLE", "concise")
+
+    loaded_config = config.load_config()
+    assert loaded_config["default_temperature"] == 0.7
+    assert loaded_config["default_style"] == "concise"
+    assert not (mock_config_path.parent / "config_cache").exists()
+
+@pytest.mark.parametrize("value, skipped", [("0", False), ("false", False), ("", False), ("yes", True)])
+def test_no_config_file_is_a_boolean(mock_config_path, monkeypatch, value, skipped):
+    mock_config_path.write_text(yaml.dump({"default_temperature": 0.9}))
+    monkeypatch.setenv("ENHANCE_NO_CONFIG_FILE", value)
+    assert (config.load_config()["default_temperature"] == 0.7) is skipped
+
+def test_cache_of_another_config_file_stays_in_the_config_dir(mock_config_path, tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "enhance.yaml").write_text(yaml.dump({"default_temperature": 0.3}))
+    # Restored by the fixture
+    config.get_config_path = lambda path=None: Path(path)
+    assert config.load_config(str(project / "enhance.yaml"))["default_temperature"] == 0.3
+    assert [path.name for path in project.iterdir()] == ["enhance.yaml"]
+    assert len(list((mock_config_path.parent / "config_cache").iterdir())) == 1
+
+def test_load_config_does_not_mutate_defaults(mock_config_path):
+    loaded_config = config.load_config()
+    loaded_config["enhancement_templates"]["x"] = "y"
+    assert config.DEFAULT_CONFIG["enhancement_templates"] == {}
+
+def test_model_options_merges_globs_then_exact_match():
+    profiles = {
+        "llama3*": {"num_thread": 8, "num_batch": 256},
+        "*:70b": {"num_gpu": 40},
+        "llama3:70b": {"num_batch": 512},
+    }
+    assert config.model_options(profiles, "llama3:70b") == {"num_thread": 8, "num_batch": 512, "num_gpu": 40}
+    assert config.model_options(profiles, "llama3:8b") == {"num_thread": 8, "num_batch": 256}
+    assert config.model_options(profiles, "mistral") == {}
+    assert config.model_options(None, "mistral") == {}
+
+def test_save_model_profile_keeps_other_settings(mock_config_path):
+    mock_config_path.write_text(
+        "# Slow machine\ntimeout: 60\n\nmodel_profiles:\n  mistral:\n    num_gpu: 1\n    num_thread: 2\n"
+        "  phi3:\n    num_gpu: 0\n\n# Ours\nauto_copy: false\n")
+    config.save_model_profile("mistral", {"num_thread": 8})
+    text = mock_config_path.read_text()
+    saved = yaml.safe_load(text)
+    assert saved["timeout"] == 60 and saved["auto_copy"] is False
+    # Merged into the old profile, so settings that were not measured are kept
+    assert saved["model_profiles"] == {"mistral": {"num_gpu": 1, "num_thread": 8}, "phi3": {"num_gpu": 0}}
+    assert text.startswith("# Slow machine\n") and "\n\n# Ours\n" in text
+
+def test_save_model_profile_refuses_invalid_config(mock_config_path):
+    mock_config_path.write_text("timeout: [60\n")
+    with pytest.raises(ConfigError):
+        config.save_model_profile("mistral", {"num_thread": 8})
+    assert mock_config_path.read_text() == "timeout: [60\n"
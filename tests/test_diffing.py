@@ -0,0 +1,80 @@
+import random
+import time
+
+import pytest
+
+from enhance_this.diffing import compute_diff, diff_opcodes, render_inline, render_side_by_side, tokenize
+
+
+def apply_opcodes(a, b, opcodes):
+    result = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        result.extend(b[j1:j2])
+    return result
+
+def lcs_length(a, b):
+    table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            table[i][j] = table[i + 1][j + 1] + 1 if a[i] == b[j] else max(table[i + 1][j], table[i][j + 1])
+    return table[0][0]
+
+def test_tokenize_words_and_lines():
+    assert tokenize("Hello, world!\n") == ["Hello", ",", " ", "world", "!", "\n"]
+    assert tokenize("a\nb\n", mode="line") == ["a\n", "b\n"]
+
+def test_diff_opcodes_simple_change():
+    a = tokenize("write tests for the parser")
+    b = tokenize("write unit tests for the new parser")
+    opcodes = diff_opcodes(a, b)
+    assert apply_opcodes(a, b, opcodes) == b
+    inserted = "".join("".join(b[j1:j2]) for tag, _, _, j1, j2 in opcodes if tag == "insert")
+    assert "unit" in inserted and "new" in inserted
+
+def test_diff_opcodes_empty_sides():
+    assert diff_opcodes([], []) == []
+    assert diff_opcodes(["a"], []) == [("delete", 0, 1, 0, 0)]
+    assert diff_opcodes([], ["a"]) == [("insert", 0, 0, 0, 1)]
+
+def test_diff_opcodes_finds_longest_common_subsequence():
+    rng = random.Random(7)
+    for _ in range(300):
+        a = [rng.choice("abcd") for _ in range(rng.randint(0, 12))]
+        b = [rng.choice("abcde") for _ in range(rng.randint(0, 12))]
+        opcodes = diff_opcodes(a, b)
+        assert apply_opcodes(a, b, opcodes) == b
+        assert sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal") == lcs_length(a, b)
+
+def test_compute_diff_falls_back_to_lines():
+    original = "one two three\n" * 10
+    enhanced = "one two four\n" * 10
+    mode, a, b, _ = compute_diff(original, enhanced, max_tokens=50)
+    assert mode == "line"
+    assert len(a) == 10
+
+def test_compute_diff_rejects_huge_input():
+    with pytest.raises(ValueError):
+        compute_diff("a\n" * 30, "b\n" * 30, max_tokens=50)
+
+def test_render_inline_marks_changes():
+    mode, a, b, opcodes = compute_diff("make it fast", "make it very fast")
+    text = render_inline(a, b, opcodes, mode)
+    assert text.plain == "make it very fast"
+    assert any(span.style == "green" for span in text.spans)
+
+def test_render_side_by_side_has_two_columns():
+    _, a, b, opcodes = compute_diff("old text", "new text")
+    table = render_side_by_side(a, b, opcodes)
+    assert [column.header for column in table.columns] == ["Original", "Enhanced"]
+
+def test_diff_of_dissimilar_texts_stops_at_the_timeout():
+    rng = random.Random(3)
+    a = [rng.choice("abcdefgh") for _ in range(4000)]
+    b = [rng.choice("abcdefgh") for _ in range(4000)]
+    started = time.monotonic()
+    opcodes = diff_opcodes(a, b, timeout=0.05)
+    assert time.monotonic() - started < 2
+    # Coarser than a minimal diff, but still correct
+    assert apply_opcodes(a, b, opcodes) == b
@@ -1,6 +1,9 @@
 import pytest
 from unittest.mock import patch, mock_open
-from enhance_this.enhancer import PromptEnhancer, load_templates
+from enhance_this.enhancer import (
+    PromptEnhancer, load_templates, split_template, render_template, parse_template,
+    estimate_tokens, context_size, request_context_size, session_context_size,
+)
 from pathlib import Path
 
 # Mock importlib.resources.files for Python 3.9+
@@ -15,15 +18,22 @@ def mock_importlib_resources_files():
             'technical.txt': 'Technical template: {user_prompt}',
         }
 
-        def mock_path_object(name):
-            mock_path = Path(name) # Use a real Path object for some methods
-            mock_path.is_file = lambda: name in mock_template_dir
-            mock_path.read_text = lambda encoding='utf-8': mock_template_dir[name]
-            return mock_path
+        class MockTemplatePath:
+            def __init__(self, name):
+                self.name = Path(name).name
+
+            def is_file(self):
+                return self.name in mock_template_dir
+
+            def read_text(self, encoding='utf-8'):
+                if self.name not in mock_template_dir:
+                    raise FileNotFoundError(self.name)
+                return mock_template_dir[self.name]
 
         mock_files.return_value = type('MockPath', (object,), {
-            '__truediv__': lambda self, name: mock_path_object(name),
-            'is_file': lambda: True, # For the directory itself
+            '__truediv__': lambda self, name: MockTemplatePath(name),
+            'joinpath': lambda self, name: MockTemplatePath(name),
+            'is_file': lambda self: True, # For the directory itself
         })()
         yield
 
@@ -97,3 +107,84 @@ def test_load_templates_with_empty_custom_path_string():
     }
     templates = load_templates(custom_template_paths)
     assert "empty_path_style" not in templates
+
+def test_prompt_enhancer_refine():
+    enhancer = PromptEnhancer()
+    refined = enhancer.refine("my revised prompt")
+    assert '"my revised prompt"' in refined
+    assert "Detailed template" not in refined
+
+def test_split_template_moves_prompt_section_last():
+    template = "# Role\nYou are an editor.\n\n## Original Prompt\n\n\"{user_prompt}\"\n\n## Output Format\nOnly the prompt.\n"
+    system, user_part = split_template(template)
+    assert "{user_prompt}" not in system
+    assert system.startswith("# Role") and "## Output Format" in system
+    assert user_part == "## Original Prompt\n\n\"{user_prompt}\""
+
+def test_split_template_without_headings():
+    system, user_part = split_template("Be brief.\n\nThe prompt is: {user_prompt}\n\nNo chatter.")
+    assert system == "Be brief.\n\nNo chatter."
+    assert user_part == "The prompt is: {user_prompt}"
+
+def test_split_template_single_block_is_not_split():
+    template = "Custom template for: {user_prompt}"
+    assert split_template(template) == ("", template)
+
+def test_render_template_with_literal_braces():
+    assert render_template('Schema: {"a": 1}\n{user_prompt}', "go") == 'Schema: {"a": 1}\ngo'
+    assert render_template("Escaped {{x}} {user_prompt}", "go") == "Escaped {x} go"
+
+def test_prompt_enhancer_build():
+    enhancer = PromptEnhancer()
+    assert enhancer.build("my prompt", "detailed") == ("", "Detailed template: my prompt")
+    assert enhancer.build("my prompt", "detailed", split=False) == ("", "Detailed template: my prompt")
+
+def test_parse_template_front_matter():
+    body, metadata = parse_template('---\nstop:\n  - "\\n\\nExplanation:"\n---\nEnhance: {user_prompt}')
+    assert body == "Enhance: {user_prompt}"
+    assert metadata == {"stop": ["\n\nExplanation:"]}
+
+def test_parse_template_without_front_matter():
+    assert parse_template("Enhance: {user_prompt}") == ("Enhance: {user_prompt}", {})
+    assert parse_template("---\n: [\n---\nbody") == ("---\n: [\n---\nbody", {})
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("日本語") == 3
+
+def test_context_size_rounds_to_power_of_two():
+    assert context_size(100, 300) == 2048
+    assert context_size(1500, 2000) == 4096
+    assert context_size(30000, 2000, maximum=16384) == 16384
+
+def test_request_context_size_settings():
+    assert request_context_size({"num_ctx": 0}, "system", "prompt", 100) is None
+    assert request_context_size({"num_ctx": "8192"}, "system", "prompt", 100) == 8192
+    assert request_context_size({"num_ctx": "auto"}, "x" * 8000, "prompt", 2000) == 4096
+    assert request_context_size({}, "", "prompt", 100, context=list(range(3000))) == 4096
+
+def test_session_context_size_covers_every_style_and_never_shrinks():
+    config = {"ollama_host": "http://session-test:11434"}
+    # Ollama's default is enough, so no num_ctx is sent
+    assert session_context_size(config, "llama3", "", "prompt", 100) is None
+    # A small style is sized for the largest one, so switching styles keeps the size
+    assert session_context_size(config, "llama3", "", "prompt", 100, reserve=2700) == 4096
+    assert session_context_size(config, "llama3", "", "prompt", 100, context=list(range(3000))) == 4096
+    assert session_context_size(config, "llama3", "", "prompt", 100) == 4096
+    assert session_context_size(config, "mistral", "", "prompt", 100) is None
+    assert session_context_size({**config, "num_ctx": 8192}, "llama3", "", "prompt", 100) == 8192
+
+def test_largest_request_is_the_same_for_every_style():
+    enhancer = PromptEnhancer()
+    enhancer.templates = {"concise": "Be brief: {user_prompt}", "detailed": "x" * 400 + "{user_prompt}"}
+    enhancer.metadata = {"concise": {"num_predict": 300}}
+    assert enhancer.largest_request("abcd" * 5, 2000) == 100 + 2000 + 5
+
+def test_num_predict_from_metadata():
+    enhancer = PromptEnhancer()
+    enhancer.metadata = {"concise": {"num_predict": 300}, "broken": {"num_predict": "lots"}}
+    assert enhancer.num_predict("concise", 2000) == 300
+    assert enhancer.num_predict("concise", 100) == 100
+    assert enhancer.num_predict("detailed", 2000) == 2000
+    assert enhancer.num_predict("broken", 2000) == 2000
@@ -0,0 +1,59 @@
+from enhance_this.guards import StreamGuard
+
+
+def test_no_limits_passes_everything_through():
+    guard = StreamGuard(repetition_limit=0)
+    assert guard.feed("Hello ") == ("Hello ", False)
+    assert guard.feed("world\n") == ("world\n", False)
+    assert guard.stop_reason is None
+
+def test_max_bytes_truncates_output():
+    guard = StreamGuard(max_bytes=8)
+    assert guard.feed("Hello ") == ("Hello ", False)
+    assert guard.feed("world") == ("wo", True)
+    assert guard.stop_reason == "max_bytes"
+    assert guard.feed("more") == ("", True)
+
+def test_max_bytes_does_not_split_characters():
+    guard = StreamGuard(max_bytes=5)
+    text, stop = guard.feed("abcdé")
+    assert stop
+    assert text == "abcd"
+
+def test_max_lines():
+    guard = StreamGuard(max_lines=2)
+    assert guard.feed("one\n") == ("one\n", False)
+    assert guard.feed("two\nthree\n") == ("two\n", True)
+    assert guard.stop_reason == "max_lines"
+
+def test_repeated_line_stops():
+    guard = StreamGuard(repetition_limit=3)
+    assert guard.feed("loop\n") == ("loop\n", False)
+    assert guard.feed("loop\n") == ("loop\n", False)
+    assert guard.feed("loop\n") == ("loop\n", True)
+    assert guard.stop_reason == "repetition"
+
+def test_repeated_block_stops():
+    guard = StreamGuard(repetition_limit=3)
+    stopped = False
+    for _ in range(3):
+        _, stopped = guard.feed("- a\n- b\n")
+    assert stopped
+    assert guard.stop_reason == "repetition"
+
+def test_blank_lines_do_not_count_as_repetition():
+    guard = StreamGuard(repetition_limit=2)
+    _, stopped = guard.feed("a\n\n\nb\n\n")
+    assert not stopped
+
+def test_think_block_is_ignored():
+    guard = StreamGuard(max_bytes=10, repetition_limit=2)
+    assert guard.feed("<think>hmm\nhmm\nhmm\n") == ("<think>hmm\nhmm\nhmm\n", False)
+    assert guard.feed("</think>") == ("</think>", False)
+    assert guard.feed("Answer") == ("Answer", False)
+
+def test_from_config():
+    guard = StreamGuard.from_config({"max_output_bytes": 0, "max_output_lines": 10, "repetition_limit": 0})
+    assert guard.max_bytes is None
+    assert guard.max_lines == 10
+    assert guard.repetition_limit == 0
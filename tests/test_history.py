@@ -0,0 +1,218 @@
+import json
+import multiprocessing
+
+import pytest
+
+from enhance_this import history
+from enhance_this.history import RetentionPolicy
+
+
+@pytest.fixture
+def history_dir(tmp_path):
+    return tmp_path / "history"
+
+def save(history_dir, n, policy=None, prefix="prompt"):
+    for i in range(n):
+        history.save_enhancement(f"{prefix} {i}", f"enhanced {i} " + "x" * 100, "detailed", "llama3",
+                                 policy=policy, history_dir=history_dir)
+
+def test_save_and_load(history_dir):
+    save(history_dir, 3)
+    entries = history.load_history(history_dir)
+    assert [e["original_prompt"] for e in entries] == ["prompt 0", "prompt 1", "prompt 2"]
+    assert all("timestamp" in e for e in entries)
+
+def test_load_history_empty(history_dir):
+    assert history.load_history(history_dir) == []
+
+def test_active_segment_rotates_into_compressed_archives(history_dir):
+    policy = RetentionPolicy(segment_bytes=1000)
+    save(history_dir, 30, policy)
+    segments = history.list_segments(history_dir)
+    assert len(segments) >= 3
+    assert segments[0].path.name.endswith((".jsonl.gz", ".jsonl.zst"))
+    active = history_dir / history.ACTIVE_FILE_NAME
+    assert not active.exists() or active.stat().st_size < 1000
+    entries = history.load_history(history_dir)
+    assert [e["original_prompt"] for e in entries] == [f"prompt {i}" for i in range(30)]
+    newest = list(history.iter_history(history_dir, reverse=True))
+    assert newest[0]["original_prompt"] == "prompt 29"
+
+def test_recent_history(history_dir):
+    save(history_dir, 30, RetentionPolicy(segment_bytes=1000))
+    recent = history.recent_history(5, history_dir)
+    assert [e["original_prompt"] for e in recent] == [f"prompt {i}" for i in range(25, 30)]
+
+def test_retention_by_entries_drops_oldest_segments(history_dir):
+    save(history_dir, 60, RetentionPolicy(max_entries=20, segment_bytes=1000))
+    entries = history.load_history(history_dir)
+    assert 20 <= len(entries) < 40
+    assert entries[-1]["original_prompt"] == "prompt 59"
+
+def test_retention_by_age(history_dir):
+    save(history_dir, 20, RetentionPolicy(segment_bytes=1000))
+    history.apply_retention(RetentionPolicy(max_age_days=1), history_dir, now=history.time.time() + 3 * 86400)
+    assert history.list_segments(history_dir) == []
+
+def test_interrupted_rotation_is_finished(history_dir):
+    save(history_dir, 3)
+    (history_dir / history.ACTIVE_FILE_NAME).rename(history_dir / history.ROTATING_FILE_NAME)
+    assert len(history.load_history(history_dir)) == 3
+    assert not (history_dir / history.ROTATING_FILE_NAME).exists()
+    assert len(history.list_segments(history_dir)) == 1
+
+def test_legacy_history_is_migrated(history_dir):
+    legacy = history_dir.parent / "history.json"
+    legacy.write_text(json.dumps([{"original_prompt": "old", "enhanced_prompt": "older", "style": "concise", "model": "m"}]))
+    save(history_dir, 1)
+    entries = history.load_history(history_dir)
+    assert [e["original_prompt"] for e in entries] == ["old", "prompt 0"]
+    assert not legacy.exists()
+
+def test_torn_line_is_skipped(history_dir):
+    save(history_dir, 2)
+    with open(history_dir / history.ACTIVE_FILE_NAME, "a") as f:
+        f.write('{"original_prompt": "trunc')
+    assert len(history.load_history(history_dir)) == 2
+
+def test_large_bodies_are_deduplicated(history_dir):
+    long_output = "An enhanced prompt. " * 100
+    for _ in range(5):
+        history.save_enhancement("same prompt", long_output, "detailed", "llama3", history_dir=history_dir)
+    blobs = [p for p in (history_dir / history.BLOBS_DIR_NAME).rglob("*") if p.is_file() and p.name != "refs.log"]
+    assert len(blobs) == 1
+    raw = list(history.iter_history(history_dir, resolve=False))
+    assert "enhanced_prompt" not in raw[0] and raw[0]["enhanced_prompt_ref"]
+    assert raw[0]["original_prompt"] == "same prompt"
+    assert all(e["enhanced_prompt"] == long_output for e in history.load_history(history_dir))
+
+def test_retention_prunes_unreferenced_blobs(history_dir):
+    policy = RetentionPolicy(max_entries=5, segment_bytes=500)
+    for i in range(40):
+        history.save_enhancement(f"prompt {i}", f"output {i} " + "y" * 400, "detailed", "llama3",
+                                 policy=policy, history_dir=history_dir)
+    store = history.blob_store(history_dir)
+    counts, _ = store.usage()
+    kept = {key for entry in history.iter_history(history_dir, resolve=False) for key in history.entry_refs(entry)}
+    assert set(counts) == kept
+    blobs = {p.name for p in (history_dir / history.BLOBS_DIR_NAME).rglob("*") if p.is_file() and p.name != "refs.log"}
+    assert blobs == kept
+
+def test_history_page_reads_newest_first(history_dir):
+    save(history_dir, 25, RetentionPolicy(segment_bytes=1000))
+    records, has_older = history.history_page(0, 10, history_dir=history_dir)
+    assert has_older
+    assert records[0]["label"].startswith("prompt 24 -> enhanced 24")
+    records, has_older = history.history_page(2, 10, history_dir=history_dir)
+    assert len(records) == 5 and not has_older
+
+def test_history_page_filters_by_style_and_model(history_dir):
+    history.save_enhancement("a", "b", "concise", "llama3", history_dir=history_dir)
+    history.save_enhancement("c", "d", "detailed", "mistral", history_dir=history_dir)
+    history.save_enhancement("e", "f", "concise", "mistral", history_dir=history_dir)
+    records, _ = history.history_page(0, 10, style="concise", history_dir=history_dir)
+    assert [r["label"] for r in records] == ["e -> f...", "a -> b..."]
+    records, _ = history.history_page(0, 10, style="concise", model="llama3", history_dir=history_dir)
+    assert [r["label"] for r in records] == ["a -> b..."]
+
+def test_load_entry_from_active_and_archived_segments(history_dir):
+    save(history_dir, 25, RetentionPolicy(segment_bytes=1000))
+    assert history.list_segments(history_dir)
+    records = list(history.iter_index(history_dir))
+    assert len(records) == 25
+    for i, record in enumerate(reversed(records)):
+        entry = history.load_entry(record, history_dir)
+        assert entry["original_prompt"] == f"prompt {i}"
+        assert entry["enhanced_prompt"].startswith(f"enhanced {i} ")
+
+def test_index_is_rebuilt_when_missing(history_dir):
+    save(history_dir, 25, RetentionPolicy(segment_bytes=1000))
+    expected = list(history.iter_index(history_dir))
+    (history_dir / history.INDEX_FILE_NAME).unlink()
+    assert list(history.iter_index(history_dir)) == expected
+
+def test_retention_compacts_index(history_dir):
+    save(history_dir, 60, RetentionPolicy(max_entries=20, segment_bytes=1000))
+    records = list(history.iter_index(history_dir))
+    assert len(records) == len(history.load_history(history_dir))
+    assert all(history.load_entry(r, history_dir) is not None for r in records)
+
+def _concurrent_writer(history_dir, writer, count):
+    policy = RetentionPolicy(segment_bytes=2000)
+    for i in range(count):
+        body = f"writer {writer} entry {i} " + "w" * (300 if i % 2 else 10)
+        history.save_enhancement(f"w{writer}-{i}", body, "detailed", "llama3", policy=policy, history_dir=history_dir)
+
+def test_concurrent_writers_lose_no_entries(history_dir):
+    context = multiprocessing.get_context("spawn")
+    writers, count = 6, 30
+    processes = [context.Process(target=_concurrent_writer, args=(history_dir, w, count)) for w in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    entries = history.load_history(history_dir)
+    prompts = [e["original_prompt"] for e in entries]
+    assert sorted(prompts) == sorted(f"w{w}-{i}" for w in range(writers) for i in range(count))
+    for entry in entries:
+        writer, i = entry["original_prompt"][1:].split("-")
+        assert entry["enhanced_prompt"].startswith(f"writer {writer} entry {i} ")
+    records = list(history.iter_index(history_dir))
+    assert len(records) == writers * count
+    assert all(history.load_entry(r, history_dir) is not None for r in records[:20])
+
+def test_torn_last_line_does_not_swallow_next_entry(history_dir):
+    save(history_dir, 1)
+    with open(history_dir / history.ACTIVE_FILE_NAME, "a") as f:
+        f.write('{"original_prompt": "torn')
+    history.save_enhancement("after crash", "ok", "concise", "llama3", history_dir=history_dir)
+    assert [e["original_prompt"] for e in history.load_history(history_dir)] == ["prompt 0", "after crash"]
+    assert history.history_page(0, 10, history_dir=history_dir)[0][0]["label"] == "after crash -> ok..."
+
+def test_damaged_legacy_history_is_salvaged(history_dir):
+    legacy = history_dir.parent / "history.json"
+    good = [{"original_prompt": f"old {i}", "enhanced_prompt": "{\"json\": true}", "style": "json", "model": "m"}
+            for i in range(3)]
+    legacy.write_text(json.dumps(good, indent=2)[:-40])  # Cut off mid-way through the last entry
+    entries = history.load_history(history_dir)
+    assert [e["original_prompt"] for e in entries] == ["old 0", "old 1"]
+    assert legacy.with_name("history.json.migrated").exists()
+
+def test_iter_history_filters_by_time_style_and_model(history_dir):
+    entries = [{"original_prompt": f"p{i}", "enhanced_prompt": f"e{i}", "timestamp": 1000.0 + i,
+                "style": "concise" if i % 2 else "detailed", "model": "llama3"} for i in range(10)]
+    history.save_entries(entries, RetentionPolicy(segment_bytes=300), history_dir)
+    found = list(history.iter_history(history_dir, since=1003, until=1007, style="concise"))
+    assert [e["original_prompt"] for e in found] == ["p3", "p5", "p7"]
+    assert list(history.iter_history(history_dir, model="mistral")) == []
+
+def test_save_entries_lists_segments_once_per_batch_and_rotation(history_dir, monkeypatch):
+    save(history_dir, 30, RetentionPolicy(segment_bytes=1000))
+    calls = []
+    list_segments = history.list_segments
+    monkeypatch.setattr(history, "list_segments", lambda directory: calls.append(1) or list_segments(directory))
+    entries = [{"original_prompt": f"imported {i}", "enhanced_prompt": "y", "timestamp": i} for i in range(500)]
+    assert history.save_entries(entries, history_dir=history_dir, batch_size=250) == 500
+    assert len(calls) <= 4
+    records, _ = history.history_page(0, 1, history_dir=history_dir)
+    assert history.load_entry(records[0], history_dir)["original_prompt"] == "imported 499"
+
+def test_imported_entries_point_at_their_segment_across_rotations(history_dir):
+    entries = [{"original_prompt": f"imported {i}", "enhanced_prompt": "y" * 50, "timestamp": i} for i in range(100)]
+    history.save_entries(entries, RetentionPolicy(segment_bytes=1000), history_dir=history_dir, batch_size=30)
+    assert len(history.list_segments(history_dir)) >= 5
+    records, _ = history.history_page(0, 100, history_dir=history_dir)
+    loaded = sorted(history.load_entry(record, history_dir)["original_prompt"] for record in records)
+    assert loaded == sorted(f"imported {i}" for i in range(100))
+
+def test_save_entries_keeps_timestamps_and_indexes(history_dir):
+    entries = [{"original_prompt": "old", "enhanced_prompt": "y" * 500, "timestamp": 1234.5,
+                "style": "detailed", "model": "llama3"}]
+    assert history.save_entries(entries, history_dir=history_dir) == 1
+    loaded = history.load_history(history_dir)
+    assert loaded[0]["timestamp"] == 1234.5
+    assert loaded[0]["enhanced_prompt"] == "y" * 500
+    records, _ = history.history_page(0, 10, history_dir=history_dir)
+    assert history.load_entry(records[0], history_dir)["original_prompt"] == "old"
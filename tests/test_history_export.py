@@ -0,0 +1,83 @@
+import io
+import json
+from unittest.mock import patch
+
+import pytest
+from rich.console import Console
+
+from enhance_this import history_export
+from enhance_this.history_export import export_csv, export_jsonl, read_entries
+
+ENTRIES = [
+    {"original_prompt": "hello", "enhanced_prompt": "Say hello, politely.", "style": "formal",
+     "model": "llama3", "timestamp": 1700000000.5},
+    {"original_prompt": "a, \"quoted\"\nline", "enhanced_prompt": "ünïcode ✨", "style": "casual",
+     "model": "mistral", "timestamp": 1700000100.0},
+]
+
+def test_jsonl_round_trip(tmp_path):
+    path = tmp_path / "history.jsonl"
+    with open(path, "w", encoding="utf-8") as f:
+        assert export_jsonl(iter(ENTRIES), f) == 2
+    assert list(read_entries(path)) == ENTRIES
+
+def test_jsonl_export_drops_internal_fields():
+    out = io.StringIO()
+    export_jsonl([{**ENTRIES[0], "original_prompt_ref": "abc"}], out)
+    assert set(json.loads(out.getvalue())) == set(history_export.FIELDS)
+
+def test_csv_round_trip(tmp_path):
+    path = tmp_path / "history.csv"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        export_csv(ENTRIES, f)
+    assert "2023-11-14T22:13:20.500000Z" in path.read_text(encoding="utf-8")
+    assert list(read_entries(path)) == ENTRIES
+
+def test_timestamps_accept_epoch_and_naive_iso(tmp_path):
+    path = tmp_path / "history.csv"
+    path.write_text("timestamp,style,model,original_prompt,enhanced_prompt\n"
+                    "1700000000,detailed,llama3,a,b\n"
+                    "2023-11-14T22:13:20,detailed,llama3,c,d\n", encoding="utf-8")
+    assert [e["timestamp"] for e in read_entries(path)] == [1700000000.0, 1700000000.0]
+
+def test_unknown_format_raises(tmp_path):
+    path = tmp_path / "history.xml"
+    path.write_text("", encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(read_entries(path))
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    path = tmp_path / "history.parquet"
+    assert history_export.export_parquet(iter(ENTRIES), path, row_group_size=1) == 2
+    assert list(read_entries(path)) == ENTRIES
+
+def test_parquet_export_without_pyarrow_creates_no_file(tmp_path):
+    from enhance_this.cli import run_history_export
+    path = tmp_path / "history.parquet"
+    with patch("enhance_this.history_export._require_pyarrow", side_effect=RuntimeError("no pyarrow")), \
+            patch("enhance_this.history.iter_history", return_value=iter(ENTRIES)):
+        with pytest.raises(SystemExit):
+            run_history_export(Console(file=io.StringIO()), "parquet", str(path), None, None, None, None)
+    assert not path.exists()
+
+def test_parquet_export_to_stdout_is_refused(tmp_path, monkeypatch):
+    from enhance_this.cli import run_history_export
+    monkeypatch.chdir(tmp_path)
+    with patch("enhance_this.history.iter_history", return_value=iter(ENTRIES)):
+        with pytest.raises(SystemExit):
+            run_history_export(Console(file=io.StringIO()), "parquet", "-", None, None, None, None)
+    assert list(tmp_path.iterdir()) == []
+
+def test_export_filters_by_utc_dates_and_writes_plain_csv_rows(tmp_path):
+    from datetime import datetime
+    from enhance_this.cli import run_history_export
+    path = tmp_path / "history.csv"
+    with patch("enhance_this.history.iter_history", return_value=iter(ENTRIES)) as iter_history:
+        run_history_export(Console(file=io.StringIO()), "csv", str(path), None, None,
+                           datetime(2023, 11, 14, 22, 13, 20), datetime(2023, 11, 15))
+    # --since 2023-11-14T22:13:20 is exactly the first entry's timestamp when read as UTC
+    assert iter_history.call_args.kwargs["since"] == 1700000000.0
+    assert iter_history.call_args.kwargs["until"] == 1700006400.0
+    data = path.read_bytes()
+    assert b"\r\r\n" not in data and data.count(b"\r\n") == 3
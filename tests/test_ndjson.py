@@ -0,0 +1,38 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from enhance_this import ndjson
+
+
+def test_iter_lines_joins_split_blocks():
+    blocks = [b'{"a":', b'1}\n{"b"', b":2}\n\n", b'{"c":3}']
+    assert list(ndjson.iter_lines(blocks)) == [b'{"a":1}', b'{"b":2}', b'{"c":3}']
+
+def test_iter_frames_reads_large_blocks():
+    response = MagicMock()
+    response.iter_content.return_value = [b'{"a":1}\n']
+    assert list(ndjson.iter_frames(response)) == [b'{"a":1}']
+    response.iter_content.assert_called_once_with(chunk_size=ndjson.READ_SIZE)
+
+def test_decode_frame_fast_path_skips_dict():
+    line = b'{"model":"llama3","created_at":"2024-01-01T00:00:00Z","response":"Hello","done":false}'
+    assert ndjson.decode_frame(line) == ("Hello", None)
+
+def test_decode_frame_handles_escapes_and_unicode():
+    line = json.dumps({"response": 'say "hi"\n', "done": False}, separators=(",", ":")).encode()
+    assert ndjson.decode_frame(line)[0] == 'say "hi"\n'
+    line = '{"response":"héllo ✔","done":false}'.encode("utf-8")
+    assert ndjson.decode_frame(line) == ("héllo ✔", None)
+
+def test_decode_frame_returns_final_frame():
+    line = b'{"response":"","done":true,"eval_count":3,"context":[1,2]}'
+    text, data = ndjson.decode_frame(line)
+    assert text == ""
+    assert data["eval_count"] == 3
+    assert data["context"] == [1, 2]
+
+def test_decode_frame_rejects_non_objects():
+    with pytest.raises(ValueError):
+        ndjson.decode_frame(b"[1, 2]")
@@ -1,9 +1,15 @@
 import pytest
 from unittest.mock import patch, MagicMock
-from enhance_this.ollama_client import OllamaClient
+from enhance_this.ollama_client import OllamaClient, CancelToken, GenerationCancelled
+from enhance_this.guards import StreamGuard
 import requests
 import json
 
+
+def stream_body(lines):
+    """Feeds NDJSON lines to the client the way `response.iter_content` delivers them."""
+    return (line + b"\n" for line in lines)
+
 @pytest.fixture
 def mock_requests_session():
     with patch('requests.Session') as mock_session_class:
@@ -37,10 +43,10 @@ def test_list_models_failure(ollama_client, mock_requests_session):
 
 def test_download_model_success(ollama_client, mock_requests_session):
     mock_response = MagicMock()
-    mock_response.iter_lines.return_value = [
+    mock_response.iter_content.return_value = stream_body([
         json.dumps({"status": "downloading", "total": 100, "completed": 50}).encode(),
         json.dumps({"status": "success", "total": 100, "completed": 100}).encode(),
-    ]
+    ])
     mock_requests_session.post.return_value = mock_response
     assert ollama_client.download_model("llama2")
 
@@ -50,10 +56,10 @@ def test_download_model_failure(ollama_client, mock_requests_session):
 
 def test_generate_stream_success(ollama_client, mock_requests_session):
     mock_response = MagicMock()
-    mock_response.iter_lines.return_value = [
+    mock_response.iter_content.return_value = stream_body([
         json.dumps({"response": "Hello "}).encode(),
         json.dumps({"response": "World!", "done": True}).encode(),
-    ]
+    ])
     mock_requests_session.post.return_value = mock_response
     
     chunks = list(ollama_client.generate_stream("llama2", "prompt", 0.7, 200))
@@ -85,3 +91,202 @@ def test_integration_generate_stream_live():
     prompt = "Say hello world"
     full_response = "".join(list(client.generate_stream("llama2", prompt, 0.7, 50)))
     assert "hello world" in full_response.lower()
+
+def test_generate_stream_collects_metrics(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([
+        json.dumps({"response": "Hi"}).encode(),
+        json.dumps({"response": "", "done": True, "load_duration": 2_000_000_000,
+                    "eval_count": 50, "eval_duration": 1_000_000_000}).encode(),
+    ])
+    mock_requests_session.post.return_value = mock_response
+
+    list(ollama_client.generate_stream("llama2", "prompt", 0.7, 200))
+    assert ollama_client.last_metrics["load_time"] == 2.0
+    assert ollama_client.last_metrics["tokens_per_sec"] == 50.0
+    assert ollama_client.last_metrics["ttft"] <= ollama_client.last_metrics["total_time"]
+
+def test_generate_stream_reuses_context(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([
+        json.dumps({"response": "Hi", "done": True, "context": [4, 5, 6]}).encode(),
+    ])
+    mock_requests_session.post.return_value = mock_response
+
+    list(ollama_client.generate_stream("llama2", "refined", 0.7, 200, context=[1, 2, 3]))
+    payload = mock_requests_session.post.call_args.kwargs["json"]
+    assert payload["context"] == [1, 2, 3]
+    assert ollama_client.last_context == [4, 5, 6]
+
+def test_generate_stream_sends_system_prompt(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "Hi", "done": True}).encode()])
+    mock_requests_session.post.return_value = mock_response
+
+    list(ollama_client.generate_stream("llama2", "user part", 0.7, 200, system="static template"))
+    payload = mock_requests_session.post.call_args.kwargs["json"]
+    assert payload["system"] == "static template"
+    assert payload["prompt"] == "user part"
+
+def test_generate_stream_cancelled_before_start(ollama_client, mock_requests_session):
+    token = CancelToken()
+    token.cancel()
+    with pytest.raises(GenerationCancelled):
+        list(ollama_client.generate_stream("llama2", "prompt", 0.7, 200, cancel=token))
+    mock_requests_session.post.assert_not_called()
+
+def test_generate_stream_cancel_closes_response(ollama_client, mock_requests_session):
+    token = CancelToken()
+    mock_response = MagicMock()
+
+    def lines():
+        yield json.dumps({"response": "Hello "}).encode()
+        token.cancel()
+        yield json.dumps({"response": "World!"}).encode()
+
+    mock_response.iter_content.return_value = stream_body(lines())
+    mock_requests_session.post.return_value = mock_response
+
+    chunks = []
+    with pytest.raises(GenerationCancelled):
+        for chunk in ollama_client.generate_stream("llama2", "prompt", 0.7, 200, cancel=token):
+            chunks.append(chunk)
+    assert chunks == ["Hello "]
+    assert mock_response.close.called
+
+def test_abandoned_stream_closes_response(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "Hello "}).encode()] * 3)
+    mock_requests_session.post.return_value = mock_response
+
+    stream = ollama_client.generate_stream("llama2", "prompt", 0.7, 200)
+    next(stream)
+    stream.close()
+    mock_response.close.assert_called_once()
+
+def test_generate_stream_sends_stop_sequences(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "Hi", "done": True}).encode()])
+    mock_requests_session.post.return_value = mock_response
+
+    list(ollama_client.generate_stream("llama2", "prompt", 0.7, 200, stop=["\n\nExplanation:"]))
+    payload = mock_requests_session.post.call_args.kwargs['json']
+    assert payload['options']['stop'] == ["\n\nExplanation:"]
+
+def test_generate_stream_guard_stops_and_closes(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "same line\n"}).encode()] * 10)
+    mock_requests_session.post.return_value = mock_response
+
+    chunks = list(ollama_client.generate_stream("llama2", "prompt", 0.7, 200, guard=StreamGuard(repetition_limit=3)))
+    assert chunks == ["same line\n"] * 3
+    assert ollama_client.last_metrics["stopped_by"] == "repetition"
+    assert mock_response.close.called
+
+def test_generate_stream_sends_num_ctx(ollama_client, mock_requests_session):
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "Hi", "done": True}).encode()])
+    mock_requests_session.post.return_value = mock_response
+
+    list(ollama_client.generate_stream("llama2", "prompt", 0.7, 300, num_ctx=2048))
+    options = mock_requests_session.post.call_args.kwargs['json']['options']
+    assert options['num_ctx'] == 2048
+    assert options['num_predict'] == 300
+
+def test_generate_stream_applies_model_profile(mock_requests_session):
+    client = OllamaClient(host="http://localhost:11434", timeout=5,
+                          model_profiles={"llama*": {"num_thread": 8, "num_ctx": 8192}})
+    mock_response = MagicMock()
+    mock_response.iter_content.return_value = stream_body([json.dumps({"response": "Hi", "done": True}).encode()])
+    mock_requests_session.post.return_value = mock_response
+
+    list(client.generate_stream("llama2", "prompt", 0.7, 200, num_ctx=2048, options={"num_batch": 256}))
+    options = mock_requests_session.post.call_args.kwargs['json']['options']
+    assert options == {"num_thread": 8, "num_ctx": 8192, "num_batch": 256, "temperature": 0.7, "num_predict": 200}
+
+def test_preload_model_sends_model_profile(mock_requests_session):
+    client = OllamaClient(host="http://localhost:11434", timeout=5, model_profiles={"llama2": {"num_gpu": 0}})
+    client.preload_model("llama2")
+    assert mock_requests_session.post.call_args.kwargs['json']['options'] == {"num_gpu": 0}
+    client.preload_model("llama2", num_ctx=8192)
+    assert mock_requests_session.post.call_args.kwargs['json']['options'] == {"num_gpu": 0, "num_ctx": 8192}
+
+def test_embed_batches_texts(ollama_client, mock_requests_session):
+    mock_response = MagicMock(status_code=200)
+    mock_response.json.return_value = {"embeddings": [[0.1, 0.2], [0.3, 0.4]]}
+    mock_requests_session.post.return_value = mock_response
+    assert ollama_client.embed("nomic-embed-text", ["a", "b"]) == [[0.1, 0.2], [0.3, 0.4]]
+    assert mock_requests_session.post.call_args.args[0].endswith("/api/embed")
+
+def test_embed_falls_back_to_legacy_endpoint(ollama_client, mock_requests_session):
+    missing = MagicMock(status_code=404)
+    legacy = MagicMock(status_code=200)
+    legacy.json.return_value = {"embedding": [1.0, 0.0]}
+    mock_requests_session.post.side_effect = [missing, legacy, legacy]
+    assert ollama_client.embed("nomic-embed-text", ["a", "b"]) == [[1.0, 0.0], [1.0, 0.0]]
+    assert mock_requests_session.post.call_args.args[0].endswith("/api/embeddings")
+
+def test_embed_failure_returns_none(ollama_client, mock_requests_session):
+    mock_requests_session.post.side_effect = requests.exceptions.ConnectionError
+    assert ollama_client.embed("nomic-embed-text", ["a"]) is None
+
+@pytest.mark.parametrize("public_shutdown", [True, False])
+def test_abort_response_wakes_a_blocked_reader(monkeypatch, public_shutdown):
+    # A real connection, so this fails if urllib3 stops exposing a way to shut the socket down
+    import http.server
+    import urllib3
+    import threading
+    import time
+    from enhance_this.ollama_client import _abort_response
+
+    class Stalling(http.server.BaseHTTPRequestHandler):
+        # Ollama streams chunked HTTP/1.1
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.write(b'12\r\n{"response": "a"}\n\r\n')
+            self.wfile.flush()
+            time.sleep(5)
+
+        def log_message(self, *args):
+            pass
+
+    if not public_shutdown:
+        # urllib3 before 2.3 has no HTTPResponse.shutdown, only the connection's socket
+        monkeypatch.delattr(urllib3.response.HTTPResponse, "shutdown")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Stalling)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        response = requests.get(f"http://127.0.0.1:{server.server_port}/", stream=True, timeout=10)
+        lines = response.iter_lines()
+        assert next(lines) == b'{"response": "a"}'
+        def read_rest():
+            try:
+                list(lines)
+            except Exception:
+                pass
+
+        reader = threading.Thread(target=read_rest)
+        reader.start()
+        time.sleep(0.1)
+        started = time.monotonic()
+        assert _abort_response(response)
+        reader.join(3)
+        assert not reader.is_alive() and time.monotonic() - started < 2
+    finally:
+        server.shutdown()
+
+def test_from_config_enables_configured_policies_and_takes_overrides():
+    config = {"ollama_host": "http://gpu:11434", "timeout": 7, "coalesce": "off", "scheduler_max_concurrent": 0,
+              "generate_retries": 3, "hedge_after": 2, "hedge_model": "small", "first_token_timeout": 90}
+    client = OllamaClient.from_config(config, quiet=True)
+    assert client.host == "http://gpu:11434" and client.timeout == 7
+    assert client.coalescer is None and client.scheduler is None
+    assert client.retry_policy.retries == 3 and client.hedge.model == "small"
+    assert client.timeouts.first_token == 90
+    assert OllamaClient.from_config(config, hedge=None).hedge is None
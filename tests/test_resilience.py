@@ -0,0 +1,255 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+from enhance_this.errors import (DeadlineExceededError, OllamaRequestError, OllamaStalledError, OllamaTimeoutError,
+                                 OllamaUnavailableError, StreamRestartError)
+from enhance_this.ollama_client import OllamaClient
+from enhance_this.resilience import Deadline, HedgePolicy, RetryPolicy, StreamTimeouts, Watchdog, retryable
+
+
+def _frames(*chunks, fail=False):
+    """A response body of `chunks`, ending with a final frame or, with `fail`, a broken connection."""
+    for chunk in chunks:
+        yield json.dumps({"response": chunk, "done": False}).encode() + b"\n"
+    if fail:
+        raise requests.exceptions.ChunkedEncodingError("connection broken")
+    yield json.dumps({"response": "", "done": True, "eval_count": len(chunks)}).encode() + b"\n"
+
+
+def _response(body):
+    response = MagicMock()
+    response.iter_content.return_value = body
+    return response
+
+
+def _client(*bodies, host="http://localhost:11434", **kwargs):
+    client = OllamaClient(host=host, timeout=5, quiet=True, **kwargs)
+    client.session = MagicMock()
+    client.session.post.side_effect = [_response(body) for body in bodies]
+    return client
+
+
+def test_deadline_shortens_timeouts_and_expires():
+    assert Deadline().remaining() is None
+    assert Deadline().timeout(30) == 30
+    deadline = Deadline(0.05)
+    assert deadline.timeout(30) <= 0.05
+    time.sleep(0.06)
+    assert deadline.expired
+    with pytest.raises(DeadlineExceededError):
+        deadline.check()
+
+
+def test_only_transient_errors_are_retryable():
+    assert retryable(OllamaUnavailableError("down"))
+    assert retryable(OllamaTimeoutError("slow"))
+    assert retryable(OllamaRequestError("broken stream"))
+    missing = OllamaRequestError("not found", response=MagicMock(status_code=404))
+    assert not retryable(missing)
+    assert retryable(OllamaRequestError("busy", response=MagicMock(status_code=500)))
+    assert not retryable(DeadlineExceededError("late"))
+    assert not retryable(ValueError("bug"))
+
+
+def test_policies_from_config():
+    assert RetryPolicy.from_config({"generate_retries": 0}) is None
+    assert RetryPolicy.from_config({}).retries == 2
+    assert HedgePolicy.from_config({"hedge_after": 2}) is None
+    assert HedgePolicy.from_config({"hedge_hosts": ["http://b:11434"]}) is None
+    hedge = HedgePolicy.from_config({"hedge_after": 2, "hedge_hosts": ["http://a:11434", "http://b:11434"],
+                                     "hedge_model": "small"})
+    payload = {"model": "big"}
+    assert hedge.alternatives("http://a:11434", payload) == [
+        ("http://b:11434", payload), ("http://a:11434", {"model": "small"})]
+
+
+def test_retry_delay_grows_and_is_capped():
+    policy = RetryPolicy(retries=5, backoff=1.0, max_backoff=3.0)
+    with patch("enhance_this.resilience.random.uniform", side_effect=lambda low, high: high):
+        assert [policy.delay(attempt) for attempt in (1, 2, 3)] == [1.0, 2.0, 3.0]
+
+
+def test_broken_stream_restarts_and_skips_what_was_returned():
+    client = _client(_frames("Hello ", "wor", fail=True), _frames("Hello ", "world"),
+                     retry_policy=RetryPolicy(backoff=0))
+    assert list(client.generate_stream("m", "p", 0.7, 10)) == ["Hello ", "wor", "ld", ""]
+    first, second = (call.kwargs["json"] for call in client.session.post.call_args_list)
+    # Both attempts use the same pinned seed, so the model can reproduce its output
+    assert first["options"]["seed"] == second["options"]["seed"]
+    assert client.last_metrics["retries"] == 1
+
+
+def test_restart_that_diverges_fails():
+    client = _client(_frames("Hello ", fail=True), _frames("Goodbye"), retry_policy=RetryPolicy(backoff=0))
+    stream = client.generate_stream("m", "p", 0.7, 10)
+    assert next(stream) == "Hello "
+    with pytest.raises(StreamRestartError):
+        list(stream)
+
+
+def test_client_errors_are_not_retried():
+    client = _client(retry_policy=RetryPolicy(backoff=0))
+    missing = requests.exceptions.HTTPError("404", response=MagicMock(status_code=404))
+    client.session.post.side_effect = [MagicMock(raise_for_status=MagicMock(side_effect=missing))]
+    with pytest.raises(OllamaRequestError):
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert client.session.post.call_count == 1
+
+
+def test_no_retry_outlasts_the_deadline():
+    client = _client(_frames("a", fail=True), _frames("a", "b"), retry_policy=RetryPolicy(backoff=5.0))
+    with patch("enhance_this.resilience.random.uniform", return_value=5.0):
+        with pytest.raises(OllamaRequestError):
+            list(client.generate_stream("m", "p", 0.7, 10, deadline=Deadline(1.0)))
+    assert client.session.post.call_count == 1
+
+
+def test_without_a_policy_failures_are_final():
+    client = _client(_frames("a", fail=True), _frames("a"))
+    with pytest.raises(OllamaRequestError):
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert client.session.post.call_count == 1
+
+
+def test_slow_host_is_hedged_and_cancelled():
+    cancelled = threading.Event()
+
+    def stalled():
+        # Answers only once the response is closed by the cancelled hedge
+        cancelled.wait(5)
+        yield from _frames("late")
+
+    slow = _response(stalled())
+    slow.close.side_effect = cancelled.set
+    client = OllamaClient(host="http://slow:11434", timeout=5, quiet=True,
+                          hedge=HedgePolicy(0.05, hosts=["http://fast:11434"]))
+    client.session = MagicMock()
+    client.session.post.return_value = slow
+    fast = _client(_frames("quick ", "answer"), host="http://fast:11434")
+    client._hedge_clients["http://fast:11434"] = fast
+
+    assert "".join(client.generate_stream("m", "p", 0.7, 10)) == "quick answer"
+    assert cancelled.wait(5)
+    assert fast.session.post.call_args.args[0] == "http://fast:11434/api/generate"
+    assert client.last_metrics["hedged"] == "m on http://fast:11434"
+
+
+def test_stream_timeouts_from_config():
+    timeouts = StreamTimeouts.from_config({"connect_timeout": 2, "first_token_timeout": 90,
+                                           "inter_token_timeout": 10, "total_timeout": 0})
+    assert (timeouts.connect, timeouts.first_token, timeouts.inter_token, timeouts.total) == (2, 90, 10, None)
+    assert "first_token_timeout" in timeouts.message("first_token")
+    assert "inter_token_timeout" in timeouts.message("inter_token")
+
+
+def test_a_larger_legacy_timeout_is_a_floor_for_token_limits():
+    timeouts = StreamTimeouts.from_config({"timeout": 300})
+    assert (timeouts.first_token, timeouts.inter_token) == (300, 300)
+    timeouts = StreamTimeouts.from_config({"timeout": 60, "first_token_timeout": 90})
+    assert (timeouts.first_token, timeouts.inter_token) == (90, 60)
+    # The default `timeout` of 30 changes nothing
+    timeouts = StreamTimeouts.from_config({"timeout": 30})
+    assert (timeouts.first_token, timeouts.inter_token) == (120, 30)
+
+
+def test_headers_wait_for_the_first_token_limit():
+    client = _client(_frames("a"), timeouts=StreamTimeouts(connect=2, first_token=90, inter_token=10))
+    list(client.generate_stream("m", "p", 0.7, 10))
+    connect, read = client.session.post.call_args.kwargs["timeout"]
+    assert connect == 2 and 89 < read <= 90
+
+
+@pytest.mark.parametrize("error, timeouts, phase", [
+    (requests.exceptions.ConnectTimeout("connect"), StreamTimeouts(), "connect"),
+    (requests.exceptions.ReadTimeout("read"), StreamTimeouts(first_token=90), "first_token"),
+    (requests.exceptions.ReadTimeout("read"), StreamTimeouts(first_token=90, total=20), "total"),
+])
+def test_timeouts_name_the_phase(error, timeouts, phase):
+    client = _client(timeouts=timeouts)
+    client.session.post.side_effect = error
+    with pytest.raises(OllamaStalledError) as raised:
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert raised.value.phase == phase
+    assert isinstance(raised.value, requests.exceptions.Timeout)
+
+
+def test_watchdog_aborts_a_stream_that_stops_producing():
+    closed = threading.Event()
+
+    def trickle():
+        yield b'{"response": "a", "done": false}\n'
+        # Ollama goes quiet; the socket read only returns once the watchdog closes it
+        closed.wait(5)
+
+    response = _response(trickle())
+    response.close.side_effect = closed.set
+    client = _client(timeouts=StreamTimeouts(first_token=5, inter_token=0.1))
+    client.session.post.side_effect = [response]
+    stream = client.generate_stream("m", "p", 0.7, 10)
+    assert next(stream) == "a"
+    started = time.monotonic()
+    with pytest.raises(OllamaStalledError) as raised:
+        list(stream)
+    assert raised.value.phase == "inter_token"
+    assert time.monotonic() - started < 2
+
+
+def test_watchdog_phase_moves_with_progress():
+    watchdog = Watchdog(interval=0.01)
+    stalled = threading.Event()
+    watch = watchdog.watch(StreamTimeouts(first_token=5, inter_token=0.05), stalled.set)
+    assert watch.limiting_phase() == "first_token"
+    watch.progress()
+    assert stalled.wait(2)
+    assert watch.stalled == "inter_token"
+
+
+def test_read_timeout_reported_as_connection_error_still_names_the_phase():
+    def slow(*args, **kwargs):
+        time.sleep(0.1)
+        # requests wraps a socket read timeout in the middle of a body as a ConnectionError
+        raise requests.exceptions.ConnectionError("Read timed out.")
+
+    client = _client(timeouts=StreamTimeouts(total=0.05))
+    client.session.post.side_effect = [MagicMock(iter_content=MagicMock(side_effect=slow))]
+    with pytest.raises(OllamaStalledError) as raised:
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert raised.value.phase == "total"
+
+
+def test_first_token_stalls_before_the_model_answered_are_retried_once(monkeypatch):
+    monkeypatch.setattr("enhance_this.ollama_client._load_times", {})
+    client = _client(timeouts=StreamTimeouts(first_token=90), retry_policy=RetryPolicy(retries=2, backoff=0))
+    client.session.post.side_effect = requests.exceptions.ReadTimeout("read")
+    with pytest.raises(OllamaStalledError):
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert client.session.post.call_count == 2
+
+    warm = _client(timeouts=StreamTimeouts(first_token=90), retry_policy=RetryPolicy(retries=2, backoff=0))
+    loaded = [json.dumps({"response": "", "done": True, "load_duration": 2e9}).encode() + b"\n"]
+    warm.session.post.side_effect = [_response(loaded)] + [requests.exceptions.ReadTimeout("read")] * 3
+    list(warm.generate_stream("m", "p", 0.7, 10))
+    with pytest.raises(OllamaStalledError):
+        list(warm.generate_stream("m", "p", 0.7, 10))
+    assert warm.session.post.call_count == 4
+
+
+def test_first_token_stall_is_not_overload():
+    scheduler = MagicMock()
+    scheduler.acquire.return_value = 0.0
+    client = _client(timeouts=StreamTimeouts(first_token=90, inter_token=10), scheduler=scheduler)
+    client.session.post.side_effect = requests.exceptions.ReadTimeout("read")
+    with pytest.raises(OllamaStalledError):
+        list(client.generate_stream("m", "p", 0.7, 10))
+    assert scheduler.release.call_args.args[2] is False
+
+    client.session.post.side_effect = [_response(_frames("a", fail=True))]
+    with patch("enhance_this.ollama_client._is_overload", return_value=True):
+        with pytest.raises(OllamaRequestError):
+            list(client.generate_stream("m", "p", 0.7, 10))
+    assert scheduler.release.call_args.args[2] is True
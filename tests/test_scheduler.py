@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+
+import pytest
+
+from enhance_this.errors import QueueFullError
+from enhance_this.ollama_client import CancelToken, GenerationCancelled
+from enhance_this.scheduler import AdaptiveLimit, Scheduler
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def _queue(scheduler, priority, order):
+    def run():
+        scheduler.acquire(priority)
+        order.append(priority)
+        scheduler.release(priority)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_acquire_runs_immediately_under_the_limit():
+    scheduler = Scheduler(max_concurrent=2)
+    assert scheduler.acquire("interactive") < 0.1
+    assert scheduler.acquire("bulk") < 0.1
+    stats = scheduler.stats()
+    assert stats["active"] == 2
+    assert stats["classes"]["bulk"]["admitted"] == 1
+
+
+def test_free_slot_goes_to_the_highest_priority():
+    scheduler = Scheduler(max_concurrent=1)
+    scheduler.acquire("default")
+    order = []
+    threads = [_queue(scheduler, "bulk", order)]
+    _wait_until(lambda: scheduler.stats()["queued"] == 1)
+    threads.append(_queue(scheduler, "interactive", order))
+    _wait_until(lambda: scheduler.stats()["queued"] == 2)
+    scheduler.release("default")
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "bulk"]
+    assert scheduler.stats()["classes"]["bulk"]["wait_max"] > 0
+
+
+def test_class_limit_leaves_room_for_interactive():
+    scheduler = Scheduler(max_concurrent=3, limits={"bulk": 2})
+    scheduler.acquire("bulk")
+    scheduler.acquire("bulk")
+    order = []
+    blocked = _queue(scheduler, "bulk", order)
+    _wait_until(lambda: scheduler.stats()["classes"]["bulk"]["queued"] == 1)
+    # The third slot is not taken by bulk, so an interactive request starts right away
+    assert scheduler.acquire("interactive") < 0.1
+    scheduler.release("interactive")
+    assert order == []
+    scheduler.release("bulk")
+    blocked.join(5)
+    assert order == ["bulk"]
+
+
+def test_lower_class_uses_capacity_a_capped_class_cannot():
+    scheduler = Scheduler(max_concurrent=2, limits={"interactive": 1})
+    scheduler.acquire("interactive")
+    order = []
+    waiting = _queue(scheduler, "interactive", order)
+    _wait_until(lambda: scheduler.stats()["queued"] == 1)
+    assert scheduler.acquire("bulk") < 0.1
+    scheduler.release("interactive")
+    waiting.join(5)
+    assert order == ["interactive"]
+
+
+def test_full_queue_rejects_new_requests():
+    scheduler = Scheduler(max_concurrent=1, max_queue=1)
+    scheduler.acquire("default")
+    waiting = _queue(scheduler, "default", [])
+    _wait_until(lambda: scheduler.stats()["queued"] == 1)
+    with pytest.raises(QueueFullError):
+        scheduler.acquire("interactive")
+    assert scheduler.stats()["classes"]["interactive"]["rejected"] == 1
+    scheduler.release("default")
+    waiting.join(5)
+
+
+def test_cancel_leaves_the_queue():
+    scheduler = Scheduler(max_concurrent=1)
+    scheduler.acquire("default")
+    token = CancelToken()
+    errors = []
+
+    def run():
+        try:
+            scheduler.acquire("bulk", token)
+        except GenerationCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    _wait_until(lambda: scheduler.stats()["queued"] == 1)
+    token.cancel()
+    thread.join(5)
+    assert len(errors) == 1
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        Scheduler().acquire("urgent")
+
+
+def test_from_config_shares_and_disables():
+    config = {"scheduler_max_concurrent": 3, "scheduler_limits": {"bulk": 1}, "scheduler_max_queue": 8,
+              "scheduler_adaptive": False}
+    scheduler = Scheduler.from_config(config)
+    assert scheduler is Scheduler.from_config(dict(config))
+    assert [scheduler.class_limit(p) for p in ("interactive", "default", "bulk")] == [3, 3, 1]
+    assert scheduler.limiter is None
+    assert Scheduler.from_config({"scheduler_max_concurrent": 0}) is None
+
+
+def test_bulk_leaves_a_slot_unless_limited():
+    assert Scheduler(max_concurrent=4).class_limit("bulk") == 3
+    assert Scheduler(max_concurrent=1).class_limit("bulk") == 1
+    assert Scheduler(max_concurrent=4, limits={"bulk": 4}).class_limit("bulk") == 4
+
+
+def _sample(tokens_per_sec=20.0, ttft=0.3, prompt_eval_time=0.2, total_time=0.0):
+    return {"eval_count": 50, "ttft": ttft, "queue_wait": 0.0, "load_time": 0.0,
+            "prompt_eval_time": prompt_eval_time, "tokens_per_sec": tokens_per_sec, "total_time": total_time}
+
+
+def test_adaptive_limit_grows_while_throughput_grows():
+    limiter = AdaptiveLimit(initial=2, maximum=8)
+    # Each extra stream keeps its per-stream speed, so the aggregate keeps rising
+    for _ in range(40):
+        limiter.observe(limiter.limit, _sample())
+    assert limiter.limit == 8
+
+
+def test_adaptive_limit_steps_back_at_the_throughput_knee():
+    limiter = AdaptiveLimit(initial=2, maximum=8)
+    # The host does 60 tokens/s in total however many streams share it, beyond 3
+    for _ in range(60):
+        limiter.observe(limiter.limit, _sample(tokens_per_sec=60.0 / max(limiter.limit, 3)))
+    assert limiter.limit == 3
+    assert "throughput" in limiter.reason
+
+
+def test_adaptive_limit_backs_off_when_requests_queue_inside_ollama():
+    changes = []
+    limiter = AdaptiveLimit(initial=8, on_change=lambda old, new, reason: changes.append((old, new)))
+    time.sleep(0.01)
+    assert limiter.observe(8, _sample(ttft=3.0, total_time=0.0))
+    assert changes == [(8, 6)]
+    # A request that started before the cut says nothing about the new limit
+    assert not limiter.observe(6, _sample(ttft=3.0, total_time=10.0))
+
+
+def test_adaptive_limit_halves_on_overload_once_per_burst():
+    limiter = AdaptiveLimit(initial=8)
+    assert limiter.observe(8, overloaded=True)
+    assert limiter.limit == 4
+    for _ in range(7):
+        assert not limiter.observe(8, overloaded=True)
+    assert limiter.observe(4, overloaded=True)
+    assert limiter.limit == 2
+
+
+def test_guard_stopped_generations_are_ignored():
+    limiter = AdaptiveLimit(initial=2)
+    assert not limiter.observe(2, {"ttft": 9.0, "stopped_by": "max_bytes"})
+
+
+def test_adaptive_limit_is_remembered_per_host(tmp_path):
+    state = tmp_path / "concurrency.json"
+    limiter = AdaptiveLimit(initial=8, state_path=state, state_key="http://gpu:11434")
+    limiter.observe(1, overloaded=True)
+    # One overload of a short run is not remembered, a second one confirms it
+    assert limiter.limit == 4 and not state.exists()
+    limiter.observe(1, overloaded=True)
+    assert json.loads(state.read_text()) == {"http://gpu:11434": 2}
+    assert AdaptiveLimit(initial=8, state_path=state, state_key="http://gpu:11434").limit == 2
+    assert AdaptiveLimit(initial=8, state_path=state, state_key="http://other:11434").limit == 8
+
+
+def test_scheduler_follows_the_adaptive_limit():
+    scheduler = Scheduler(max_concurrent=2, limiter=AdaptiveLimit(initial=1))
+    assert scheduler.max_concurrent == 1
+    scheduler.acquire("default")
+    scheduler.limiter.limit = 2
+    assert scheduler.acquire("default") < 0.1
+    scheduler.release("default", overloaded=True)
+    assert scheduler.max_concurrent == 1
+    assert "adaptive" in scheduler.describe()
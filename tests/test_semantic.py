@@ -0,0 +1,123 @@
+import hashlib
+
+import pytest
+
+from enhance_this import history, semantic
+from enhance_this.semantic import SemanticCache, VectorIndex
+
+DIM = 64
+
+
+def bag_of_words(text):
+    """A deterministic stand-in for an embedding model: hashed word counts."""
+    vector = [0.0] * DIM
+    for word in text.lower().split():
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % DIM] += 1.0
+    return vector
+
+
+class FakeClient:
+    def __init__(self):
+        self.calls = 0
+
+    def embed(self, model, texts):
+        self.calls += 1
+        return [bag_of_words(text) for text in texts]
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return tmp_path / "semantic", tmp_path / "history"
+
+
+def make_cache(dirs, threshold=0.8):
+    return SemanticCache(FakeClient(), "fake-embed", threshold, directory=dirs[0], history_dir=dirs[1])
+
+
+def test_lookup_finds_paraphrase_of_same_style(dirs):
+    cache = make_cache(dirs)
+    record = history.save_enhancement("write unit tests for the parser", "Enhanced tests prompt", "detailed",
+                                      "llama3", history_dir=dirs[1])
+    cache.remember(cache.embed("write unit tests for the parser"), record)
+
+    score, entry = cache.lookup(cache.embed("write unit tests for parser"), "detailed")
+    assert score >= 0.8
+    assert entry["enhanced_prompt"] == "Enhanced tests prompt"
+    assert cache.lookup(cache.embed("write unit tests for parser"), "concise") is None
+    assert cache.lookup(cache.embed("plan a holiday in spain"), "detailed") is None
+
+def test_lookup_looks_past_closer_matches_of_other_styles(dirs):
+    cache = make_cache(dirs)
+    prompt = "write unit tests for the parser"
+    for i in range(12):
+        record = history.save_enhancement(prompt, f"creative {i}", "creative", "llama3", history_dir=dirs[1])
+        cache.remember(cache.embed(prompt), record)
+    record = history.save_enhancement(prompt + " module", "Enhanced tests prompt", "detailed", "llama3",
+                                      history_dir=dirs[1])
+    cache.remember(cache.embed(prompt + " module"), record)
+
+    score, entry = cache.lookup(cache.embed(prompt), "detailed", k=4)
+    assert entry["enhanced_prompt"] == "Enhanced tests prompt"
+    assert cache.lookup(cache.embed(prompt), "concise", k=4) is None
+
+def test_sync_indexes_history_once(dirs):
+    for i in range(5):
+        history.save_enhancement(f"prompt number {i}", f"enhanced {i}", "detailed", "llama3", history_dir=dirs[1])
+    cache = make_cache(dirs)
+    assert cache.sync(batch_size=2) == 5
+    assert cache.client.calls == 3
+    assert cache.sync() == 0
+    assert len(cache.index) == 5
+
+def test_lookup_skips_entries_removed_from_history(dirs):
+    cache = make_cache(dirs)
+    cache.index.add([bag_of_words("gone prompt")], [(99, 0)])
+    assert cache.lookup(bag_of_words("gone prompt"), "detailed") is None
+
+def test_index_resets_for_a_new_embedding_model(dirs):
+    index = VectorIndex(dirs[0], "model-a")
+    index.add([[1.0, 0.0]], [(0, 0)])
+    other = VectorIndex(dirs[0], "model-b")
+    assert len(other) == 0
+    other.add([[0.0, 1.0, 0.0]], [(0, 10)])
+    assert other.search([0.0, 1.0, 0.0]) == [(pytest.approx(1.0), (0, 10))]
+    assert len(VectorIndex(dirs[0], "model-a")) == 0
+
+def test_torn_row_is_ignored_and_overwritten(dirs):
+    index = VectorIndex(dirs[0], "m")
+    index.add([[1.0, 0.0]], [(0, 0)])
+    with open(dirs[0] / semantic.VECTORS_FILE_NAME, "ab") as f:
+        f.write(b"\x00" * 8)  # A vector written without its ref
+    assert len(index) == 1
+    index.add([[0.0, 1.0]], [(0, 5)])
+    assert [ref for _, ref in index.search([0.0, 1.0])] == [(0, 5), (0, 0)]
+
+def test_from_config_is_off_by_default():
+    assert SemanticCache.from_config(FakeClient(), {}) is None
+    assert SemanticCache.from_config(FakeClient(), {"semantic_cache": False}) is None
+    assert SemanticCache.from_config(FakeClient(), {"semantic_cache": "offer", "semantic_threshold": 0.5}).threshold == 0.5
+
+def test_ivf_search_matches_brute_force(dirs):
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+    index = VectorIndex(dirs[0], "m")
+    index.add(vectors.tolist(), [(0, i) for i in range(len(vectors))])
+    query = vectors[1234] + 0.01
+    exact = index.search(query.tolist(), k=1)
+    index.build_ivf(lists=20)
+    index.add([rng.normal(size=16).tolist()], [(0, 9999)])  # Added after the build
+    assert index.search(query.tolist(), k=1)[0][1] == exact[0][1] == (0, 1234)
+
+def test_offer_without_a_terminal_generates_instead_of_asking():
+    import io
+    from unittest.mock import patch
+    from rich.console import Console
+    from enhance_this.cli import offer_cached_enhancement
+
+    entry = {"original_prompt": "a", "enhanced_prompt": "cached"}
+    console = Console(file=io.StringIO())
+    with patch("sys.stdin.isatty", return_value=False), patch("questionary.confirm") as confirm:
+        assert offer_cached_enhancement(console, {"semantic_cache": "offer"}, 0.95, entry) is None
+        assert offer_cached_enhancement(console, {"semantic_cache": "auto"}, 0.95, entry) == "cached"
+    confirm.assert_not_called()
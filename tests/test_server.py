@@ -0,0 +1,227 @@
+import asyncio
+import http.client
+import json
+import socket
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from enhance_this.api import Enhancer
+from enhance_this.errors import OllamaUnavailableError, UnknownStyleError
+from enhance_this.ollama_client import CancelToken
+from enhance_this.scheduler import AdaptiveLimit, Scheduler
+from enhance_this.server import EnhanceServer
+
+
+class FakeResult:
+    def __init__(self, text):
+        self.text = text
+
+    def to_dict(self):
+        return {"enhanced_prompt": self.text}
+
+
+class FakeStream:
+    def __init__(self, chunks, delay, error=None, cancel=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.result = None
+        self.cancel_token = cancel or CancelToken()
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.cancel_token.wait(self.delay):
+                return
+            yield chunk
+        if self.error:
+            raise self.error
+        self.result = FakeResult("".join(self.chunks))
+
+    def close(self):
+        pass
+
+
+class FakeEnhancer:
+    styles = ["detailed", "concise"]
+    style = "detailed"
+    scheduler = Scheduler(max_concurrent=2)
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.streams = []
+
+    def is_available(self):
+        return True
+
+    def prepare(self, prompt, **options):
+        if options.get("style") == "nope":
+            raise UnknownStyleError("Unknown style: 'nope'")
+        return prompt
+
+    def stream(self, prompt, cancel=None):
+        stream = FakeStream(["Better ", prompt], self.delay, self.error, cancel)
+        self.streams.append(stream)
+        return stream
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(enhancer, **kwargs):
+        server = EnhanceServer(enhancer, port=0, **kwargs)
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(server.start())
+            ready.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        ready.wait(5)
+        servers.append((server, loop, thread))
+        return server
+
+    async def finish(server):
+        # On the loop's thread: asyncio servers are not thread-safe, and a connection ending
+        # while another thread closes the server can wake its waiters twice
+        server.close()
+        # Connections still open end here instead of being destroyed pending with the loop
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    yield start
+    for server, loop, thread in servers:
+        asyncio.run_coroutine_threadsafe(finish(server), loop).result(5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(5)
+        loop.close()
+
+
+def request(server, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.port, timeout=10)
+    connection.request(method, path, json.dumps(body) if body is not None else None, headers or {})
+    response = connection.getresponse()
+    return response.status, response.getheader("Content-Type"), response.read().decode()
+
+
+def test_enhance_returns_json_result(serve):
+    server = serve(FakeEnhancer())
+    status, _, body = request(server, "POST", "/enhance", {"prompt": "tests"})
+    assert status == 200
+    assert json.loads(body) == {"enhanced_prompt": "Better tests"}
+
+def test_enhance_streams_server_sent_events(serve):
+    server = serve(FakeEnhancer())
+    status, content_type, body = request(server, "POST", "/enhance", {"prompt": "tests"},
+                                         {"Accept": "text/event-stream"})
+    assert status == 200 and content_type == "text/event-stream"
+    events = [block.split("\n") for block in body.strip().split("\n\n")]
+    assert [e[0] for e in events] == ["event: chunk", "event: chunk", "event: done"]
+    assert json.loads(events[1][1][len("data: "):]) == {"text": "tests"}
+
+def test_enhance_streams_ndjson(serve):
+    server = serve(FakeEnhancer())
+    status, content_type, body = request(server, "POST", "/enhance", {"prompt": "tests", "stream": True})
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert content_type == "application/x-ndjson"
+    assert [line["type"] for line in lines] == ["chunk", "chunk", "done"]
+
+def test_errors_map_to_statuses(serve):
+    server = serve(FakeEnhancer())
+    assert request(server, "POST", "/enhance", {"prompt": "x", "style": "nope"})[0] == 400
+    assert request(server, "POST", "/enhance", {"style": "concise"})[0] == 400
+    assert request(server, "GET", "/enhance")[0] == 405
+    assert request(server, "GET", "/missing")[0] == 404
+    failing = serve(FakeEnhancer(error=OllamaUnavailableError("down")))
+    status, _, body = request(failing, "POST", "/enhance", {"prompt": "x"})
+    assert status == 502 and json.loads(body)["error"] == "OllamaUnavailableError"
+
+def test_styles_and_health(serve):
+    server = serve(FakeEnhancer())
+    assert json.loads(request(server, "GET", "/styles")[2])["styles"] == ["detailed", "concise"]
+    health = json.loads(request(server, "GET", "/health")[2])
+    assert health["status"] == "ok"
+    assert health["scheduler"]["classes"]["interactive"]["queued"] == 0
+
+def test_overload_is_rejected_with_503(serve):
+    server = serve(FakeEnhancer(delay=0.3), workers=1, max_queue=1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(request(server, "POST", "/enhance", {"prompt": "x"})[0]))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [200, 200, 503, 503]
+
+def test_request_timeout_cancels_generation(serve):
+    enhancer = FakeEnhancer(delay=1.0)
+    server = serve(enhancer, request_timeout=0.2)
+    status, _, body = request(server, "POST", "/enhance", {"prompt": "x"})
+    assert status == 504
+    assert enhancer.streams[0].cancel_token.cancelled
+
+def test_client_disconnect_cancels_a_non_streaming_generation(serve):
+    enhancer = FakeEnhancer(delay=5.0)
+    server = serve(enhancer)
+    body = json.dumps({"prompt": "x"}).encode()
+    with socket.create_connection(("127.0.0.1", server.port), timeout=5) as client:
+        client.sendall(b"POST /enhance HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+        for _ in range(100):
+            if enhancer.streams:
+                break
+            time.sleep(0.02)
+    for _ in range(100):
+        if enhancer.streams[0].cancel_token.cancelled:
+            break
+        time.sleep(0.02)
+    assert enhancer.streams[0].cancel_token.cancelled
+
+def ollama_response(*texts):
+    response = MagicMock()
+    frames = [{"response": text} for text in texts] + [{"response": "", "done": True, "eval_count": len(texts)}]
+    response.iter_content.return_value = iter([json.dumps(frame).encode() + b"\n" for frame in frames])
+    return response
+
+def test_real_enhancer_generates_on_worker_threads(serve):
+    threads = []
+
+    def post(url, json=None, **kwargs):
+        threads.append(threading.current_thread().name)
+        return ollama_response("Better ", json["prompt"][-5:])
+
+    with patch("requests.Session") as session_class:
+        session_class.return_value.post.side_effect = post
+        enhancer = Enhancer(model="llama3", config={"coalesce": "off", "scheduler_adaptive": False})
+        server = serve(enhancer, workers=2)
+        results = []
+        clients = [threading.Thread(target=lambda: results.append(request(server, "POST", "/enhance", {"prompt": "x"})))
+                   for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+    assert [status for status, _, _ in results] == [200] * 4
+    assert all(json.loads(body)["model"] == "llama3" for _, _, body in results)
+    # Each worker thread sends through the Ollama client of its own thread
+    assert threads and all(name.startswith("enhance-worker") for name in threads)
+
+
+def test_adaptive_scheduler_gets_workers_up_to_its_maximum():
+    enhancer = FakeEnhancer()
+    assert EnhanceServer(enhancer, workers=4).workers == 4
+    # The adaptive limit decides how many run, the pool must not cap it below its maximum
+    enhancer.scheduler = Scheduler(max_concurrent=2, limiter=AdaptiveLimit(initial=2, maximum=12))
+    assert EnhanceServer(enhancer, workers=4).workers == 12
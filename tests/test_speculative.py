@@ -0,0 +1,75 @@
+import threading
+from unittest.mock import MagicMock
+from enhance_this.speculative import SpeculativeGenerator, predict_next_styles
+
+STYLES = ["detailed", "concise", "creative", "technical"]
+
+class FakeStream:
+    def __init__(self, style, release):
+        self.style = style
+        self.release = release
+        self.result = None
+
+    def __iter__(self):
+        yield "Output "
+        if self.release is not None:
+            self.release.wait(5)
+        yield f"for {self.style}"
+        self.result = MagicMock(context=[1, 2])
+
+    def close(self):
+        pass
+
+class FakeEnhancer:
+    def __init__(self, release=None):
+        self.release = release
+        self.priorities = []
+
+    def prepare(self, prompt, style=None, priority="interactive"):
+        self.priorities.append(priority)
+        return style
+
+    def stream(self, request, cancel=None):
+        return FakeStream(request, self.release)
+
+def test_predict_next_styles_prefers_past_switches():
+    history = [
+        {"original_prompt": "a", "style": "detailed"},
+        {"original_prompt": "a", "style": "technical"},
+        {"original_prompt": "b", "style": "detailed"},
+        {"original_prompt": "b", "style": "technical"},
+        {"original_prompt": "c", "style": "creative"},
+        {"original_prompt": "c", "style": "creative"},
+        {"original_prompt": "c", "style": "creative"},
+    ]
+    assert predict_next_styles("detailed", STYLES, history, 2) == ["technical", "creative"]
+
+def test_predict_next_styles_without_history():
+    assert predict_next_styles("concise", STYLES, [], 2) == ["detailed", "creative"]
+
+def test_take_returns_generated_style():
+    enhancer = FakeEnhancer()
+    generator = SpeculativeGenerator(enhancer)
+    generator.start("my prompt", ["concise"])
+    result = generator.take("concise", "my prompt")
+    assert "".join(result.stream()) == "Output for concise"
+    assert result.result.context == [1, 2]
+    assert enhancer.priorities == ["bulk"]
+
+def test_take_streams_while_still_generating():
+    release = threading.Event()
+    generator = SpeculativeGenerator(FakeEnhancer(release))
+    generator.start("my prompt", ["concise"])
+    stream = generator.take("concise", "my prompt").stream()
+    assert next(stream) == "Output "
+    release.set()
+    assert list(stream) == ["for concise"]
+
+def test_take_for_other_prompt_cancels_everything():
+    release = threading.Event()
+    generator = SpeculativeGenerator(FakeEnhancer(release))
+    generator.start("my prompt", ["concise", "creative"])
+    results = list(generator.results.values())
+    assert generator.take("concise", "another prompt") is None
+    assert all(result.cancelled for result in results)
+    release.set()
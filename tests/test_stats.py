@@ -0,0 +1,43 @@
+import pytest
+from enhance_this import stats
+
+@pytest.fixture
+def stats_path(tmp_path):
+    return tmp_path / "stats.bin"
+
+def test_record_and_iter_samples(stats_path):
+    stats.record_sample("llama3", "detailed", "http://localhost:11434", 0.5, 3.0, 40.0, 0.01, timestamp=1000.0, path=stats_path)
+    stats.record_sample("mistral", "concise", "http://localhost:11434", 2.5, 4.0, 30.0, 2.0, timestamp=2000.0, path=stats_path)
+
+    samples = list(stats.iter_samples(path=stats_path))
+    assert [s["model"] for s in samples] == ["llama3", "mistral"]
+    assert samples[1]["style"] == "concise"
+    assert samples[1]["ttft"] == pytest.approx(2.5)
+
+def test_ring_buffer_is_bounded(stats_path):
+    for i in range(7):
+        stats.record_sample("m", "s", "h", float(i), 1.0, 1.0, 0.0, timestamp=float(i), capacity=5, path=stats_path)
+
+    samples = list(stats.iter_samples(path=stats_path))
+    assert [s["ttft"] for s in samples] == [2.0, 3.0, 4.0, 5.0, 6.0]
+    assert stats_path.stat().st_size == stats._HEADER.size + 5 * stats._RECORD.size
+
+def test_corrupt_file_is_reinitialized(stats_path):
+    stats_path.write_bytes(b"garbage")
+    stats.record_sample("m", "s", "h", 1.0, 1.0, 1.0, 0.0, path=stats_path)
+    assert len(list(stats.iter_samples(path=stats_path))) == 1
+
+def test_percentile():
+    values = [1.0, 2.0, 3.0, 4.0, 5.0]
+    assert stats.percentile(values, 50) == 3.0
+    assert stats.percentile(values, 100) == 5.0
+    assert stats.percentile([], 95) == 0.0
+
+def test_summarize_cold_share(stats_path):
+    stats.record_sample("m", "s", "h", 1.0, 2.0, 10.0, 5.0, timestamp=0.0, path=stats_path)
+    stats.record_sample("m", "s", "h", 0.1, 1.0, 10.0, 0.0, timestamp=0.0, path=stats_path)
+
+    summary = stats.summarize(list(stats.iter_samples(path=stats_path)))
+    assert summary["runs"] == 2
+    assert summary["cold_share"] == 0.5
+    assert summary["by_model_style"][("m", "s")]["runs"] == 2
@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock
+
+from enhance_this.api import Enhancer
+from enhance_this.tuning import SAMPLE_PROMPT, candidate_options, tune_model
+
+
+def test_candidate_options_start_with_defaults():
+    candidates = candidate_options(cpu_count=8)
+    assert candidates[0] == {}
+    assert {"num_thread": 4, "num_batch": 512} in candidates
+    assert {"num_thread": 8, "num_batch": 256} in candidates
+    assert {"use_mmap": False} in candidates and {"num_gpu": 999} in candidates
+    assert len(candidates) == 8
+
+def test_candidate_options_keep_what_the_profile_sets():
+    candidates = candidate_options(cpu_count=8, profile={"num_gpu": 20, "num_batch": 128})
+    assert candidates[0] == {}
+    assert all("num_gpu" not in options and "num_batch" not in options for options in candidates)
+    assert candidates.count({"num_thread": 4}) == 1
+    assert {"low_vram": True} in candidates
+
+def make_enhancer(client):
+    return Enhancer(client=client)
+
+def test_tune_model_ranks_by_prompt_and_generation_time():
+    client = MagicMock()
+    # The candidate with the fastest generation evaluates the prompt slowest
+    timings = {None: (1.0, 2.0), 4: (0.5, 1.0), 8: (2.0, 0.5)}
+
+    def generate_stream(model, prompt, temperature, max_tokens, options=None, system=None, **kwargs):
+        prompt_eval_time, eval_time = timings[options.get("num_thread")]
+        client.prompts.append(system + prompt)
+        client.last_metrics = {"prompt_eval_time": prompt_eval_time, "eval_time": eval_time,
+                               "prompt_eval_count": 900}
+        yield "text"
+
+    client.prompts = []
+    client.generate_stream.side_effect = generate_stream
+    candidates = [{}, {"num_thread": 4}, {"num_thread": 8}]
+    seen = []
+    results = tune_model(make_enhancer(client), "llama3", candidates, runs=1, on_result=lambda o, s: seen.append(s))
+
+    assert [seconds for _, seconds in results] == [1.5, 2.5, 3.0]
+    assert results[0][0] == {"num_thread": 4}
+    assert seen == [3.0, 1.5, 2.5]
+    # The sample prompt is sent inside the full template, like a real enhancement
+    assert all(len(prompt) > 1000 and SAMPLE_PROMPT in prompt for prompt in client.prompts)
+
+def test_tune_model_skips_runs_served_from_the_prompt_cache():
+    client = MagicMock()
+    runs = iter([(900, 2.0), (10, 0.1)])
+
+    def generate_stream(*args, **kwargs):
+        count, prompt_eval_time = next(runs)
+        client.last_metrics = {"prompt_eval_count": count, "prompt_eval_time": prompt_eval_time, "eval_time": 1.0}
+        yield "text"
+
+    client.generate_stream.side_effect = generate_stream
+    assert tune_model(make_enhancer(client), "llama3", [{}], runs=2) == [({}, 3.0)]
+
+def test_tune_model_scores_failures_as_none():
+    client = MagicMock()
+    client.generate_stream.side_effect = RuntimeError("model failed to load")
+    results = tune_model(make_enhancer(client), "llama3", [{"num_gpu": 99}], runs=2)
+    assert results == [({"num_gpu": 99}, None)]